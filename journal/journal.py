@@ -1,11 +1,21 @@
 #!/usr/bin/python
 
+import argparse
+import collections
+import contextlib
 import datetime
+import heapq
 import os
 import sys
+from array import array
+from bisect import bisect_left, insort
 from operator import itemgetter
 from six.moves import input
 
+import journal_analytics
+import journal_stats
+import journal_storage
+
 # codes for actions
 TASK_NEW = 0
 TASK_SWITCH = 1
@@ -24,6 +34,10 @@ timed_tasks = {TASK_NEW: False,
                TASK_PAUSE: True,
                TASK_LUNCH: True,
                TASK_MEETING: True}
+timed_codes = [code for code in timed_tasks if timed_tasks[code]]
+
+# action types shown in the calendar report, in display order
+calendar_categories = [TASK_SWITCH, TASK_WALK, TASK_ADD_TASKS, TASK_LUNCH, TASK_MEETING]
 
 # codes for task types
 TASK_WORK_TYPE = 0
@@ -31,66 +45,1346 @@ TASK_PERS_TYPE = 1
 task_types = ['work', 'personal']
 
 class Task:
+    # no __dict__, a journal holds many of them
+    __slots__ = ('name', 'time', 'task_type', 'completed')
+    # bumped whenever a task is created or changed, like Action.generation
+    generation = 0
+
     def __init__(self, name='no_name', time=0, task_type=TASK_WORK_TYPE, completed=False):
-        self.name = name
+        # the same names come back in every report
+        self.name = sys.intern(name)
         self.time = time
         self.task_type = task_type
         self.completed = completed
 
+    def __setattr__(self, name, value):
+        Task.generation += 1
+        object.__setattr__(self, name, value)
+
 class Action:
+    __slots__ = ('action', 'task_id', 'ts')
+    # bumped whenever an existing action is changed, so that derived indexes
+    # can tell when they are out of date
+    generation = 0
+
     def __init__(self, action, task_id=-1, dt=None):
-        self.action = action
-        self.task_id = task_id
+        """
+        dt is a datetime, or already microseconds since the epoch
+        """
+        object.__setattr__(self, 'action', action)
+        object.__setattr__(self, 'task_id', task_id)
         if dt==None:
-            self.dt = datetime.datetime.now()
-        else:
-            self.dt = dt
+            dt = datetime.datetime.now()
+        # the time is kept as an integer, datetimes are only made to show it
+        object.__setattr__(self, 'ts', dt if isinstance(dt, int) else journal_storage.to_micros(dt))
+
+    def __setattr__(self, name, value):
+        Action.generation += 1
+        object.__setattr__(self, name, value)
+
+    @property
+    def dt(self):
+        return journal_storage.from_micros(self.ts)
+
+    @dt.setter
+    def dt(self, value):
+        self.ts = journal_storage.to_micros(value)
+
+MICROS_PER_SECOND = 1000000
+MICROS_PER_DAY = 86400*MICROS_PER_SECOND
+
+def now_micros():
+    return journal_storage.to_micros(datetime.datetime.now())
+
+def seconds_between(start, end):
+    """
+    Whole seconds from start to end, both in microseconds since the epoch
+    """
+    return (end - start) // MICROS_PER_SECOND
+
+def day_bounds(day_start, num_days):
+    """
+    Convert a day_start/num_days pair into datetime bounds [lo, hi)
+    Either bound is None when it does not apply
+    """
+    lo = None
+    hi = None
+    if day_start:
+        lo = datetime.datetime.combine(day_start, datetime.time())
+        if num_days:
+            hi = datetime.datetime.combine(day_start+datetime.timedelta(days=num_days), datetime.time())
+    return (lo, hi)
+
+def micro_bounds(day_start, num_days):
+    """
+    day_bounds in microseconds since the epoch, worked out once per query
+    """
+    lo, hi = day_bounds(day_start, num_days)
+    return (None if lo is None else journal_storage.to_micros(lo), None if hi is None else journal_storage.to_micros(hi))
+
+def month_bounds(ts):
+    """
+    The first microsecond of the month of ts and of the month after it
+    """
+    dt = journal_storage.from_micros(ts)
+    start = datetime.datetime(dt.year, dt.month, 1)
+    end = datetime.datetime(dt.year + dt.month//12, dt.month%12 + 1, 1)
+    return (journal_storage.to_micros(start), journal_storage.to_micros(end))
+
+def parse_totals(totals):
+    """
+    Totals saved as {'action type,task_id': seconds}, as they are grouped in
+    the IntervalIndex
+    """
+    parsed = {}
+    for key, value in totals.items():
+        action_type, task_id = key.split(',')
+        parsed[(int(action_type), int(task_id))] = value
+    return parsed
+
+def format_totals(totals):
+    return dict(('{0},{1}'.format(*key), value) for key, value in totals.items())
+
+class IntervalGroup:
+    __slots__ = ('positions', 'starts', 'prefix')
 
-class Journal:
     def __init__(self):
+        self.positions = []
+        self.starts = []
+        # prefix sums of the durations of the closed intervals, the open
+        # intervals are always at the end of the group
+        self.prefix = [0]
+
+    def pack(self):
+        """
+        Keep the columns as arrays of 64 bit integers rather than lists of
+        int objects, which take several times the memory
+        """
+        self.positions = array('q', self.positions)
+        self.starts = array('q', self.starts)
+        self.prefix = array('q', self.prefix)
+
+class IntervalIndex:
+    """
+    Resolved interval of every action, grouped by (action type, task_id) and
+    sorted by start, so that the time spent in an action over a range of days
+    is a bisect plus a prefix sum.
+    The group (action type, -1) holds every action of that type. Starts, ends
+    and the bounds of queries are microseconds since the epoch.
+    """
+    def __init__(self):
+        # counts the changes other than appending, see ActionArrays
+        self.rewrites = 0
+        # (action type, task_id) -> its group keys, shared by all its actions
+        self.key_lists = {}
+        self.build([])
+
+    def build(self, actions):
+        self.rewrites = self.rewrites + 1
+        self.starts = []
+        self.ends = []
+        self.durations = []
+        self.keys = []
+        self.groups = {}
+        self.open = []
+        self.ordered = True
+        # appending to lists is faster, the arrays only take the result
+        for action in actions:
+            self.append(action)
+        self.starts = array('q', self.starts)
+        for group in self.groups.values():
+            group.pack()
+        self.stamp(actions)
+
+    def stamp(self, actions):
+        self.source = actions
+        self.generation = Action.generation
+
+    def is_current(self, actions):
+        return self.source is actions and self.generation == Action.generation and len(self.starts) == len(actions)
+
+    def group_keys(self, action):
+        keys = self.key_lists.get((action.action, action.task_id))
+        if keys is None:
+            if action.task_id == -1:
+                keys = [(action.action, -1)]
+            else:
+                keys = [(action.action, -1), (action.action, action.task_id)]
+            self.key_lists[(action.action, action.task_id)] = keys
+        return keys
+
+    def append(self, action):
+        pos = len(self.starts)
+        ts = action.ts
+        if self.starts and ts < self.starts[-1]:
+            self.ordered = False
+
+        # a timed action ends everything since the previous timed action
+        if timed_tasks[action.action]:
+            self.close(ts)
+
+        keys = self.group_keys(action)
+        self.starts.append(ts)
+        self.ends.append(None)
+        self.durations.append(None)
+        self.keys.append(keys)
+        self.open.append(pos)
+        for key in keys:
+            group = self.groups.get(key)
+            if group is None:
+                group = self.groups[key] = IntervalGroup()
+            group.positions.append(pos)
+            group.starts.append(ts)
+
+    def close(self, ts):
+        """
+        End the open intervals at ts, where the next timed action starts
+        """
+        for ix in self.open:
+            duration = seconds_between(self.starts[ix], ts)
+            self.ends[ix] = ts
+            self.durations[ix] = duration
+            for key in self.keys[ix]:
+                group = self.groups[key]
+                group.prefix.append(group.prefix[-1] + duration)
+        self.open = []
+
+    def rebuild_from(self, actions, pos):
+        """
+        Resolve the intervals of the actions from position pos on again,
+        after they were changed
+        """
+        while len(self.starts) > pos:
+            self.remove_last()
+        for action in actions[pos:]:
+            self.append(action)
+        self.stamp(actions)
+
+    def remove_last(self):
+        self.rewrites = self.rewrites + 1
+        pos = len(self.starts)-1
+        keys = self.keys.pop()
+        self.starts.pop()
+        self.ends.pop()
+        self.durations.pop()
+        self.open.pop()
+        for key in keys:
+            group = self.groups[key]
+            group.positions.pop()
+            group.starts.pop()
+            if not group.positions:
+                del self.groups[key]
+
+        # reopen the intervals that were ended by the removed action
+        if timed_tasks[keys[0][0]]:
+            ix = pos-1
+            while ix >= 0:
+                self.ends[ix] = None
+                self.durations[ix] = None
+                for key in self.keys[ix]:
+                    self.groups[key].prefix.pop()
+                self.open.insert(0, ix)
+                if timed_tasks[self.keys[ix][0][0]]:
+                    break
+                ix = ix-1
+
+    def window(self, lo, hi, lead=False):
+        """
+        Positions [first, last) of the actions that may start in [lo, hi)
+        With lead, also include the timed action that is running at lo
+        """
+        if not self.ordered:
+            return (0, len(self.starts))
+        first = bisect_left(self.starts, lo) if lo is not None else 0
+        last = bisect_left(self.starts, hi) if hi is not None else len(self.starts)
+        if lead:
+            while first > 0:
+                first = first-1
+                if timed_tasks[self.keys[first][0][0]]:
+                    break
+        return (first, last)
+
+    def intervals(self, actions, first, last, now):
+        """
+        Yield (action, end, duration) for the actions at positions [first, last)
+        """
+        for ix in range(first, last):
+            yield (actions[ix], self.ends[ix], self.duration(ix, now))
+
+    def duration(self, ix, now):
+        duration = self.durations[ix]
+        if duration is None:
+            # we are still doing this action
+            duration = seconds_between(self.starts[ix], now)
+        return duration
+
+    def cumulative(self, action_type, action_key, now=None):
+        """
+        Seconds spent in the action over the whole journal: the total of the
+        closed intervals is kept in the group, only the open ones are added
+        """
+        group = self.groups.get((action_type, action_key))
+        if group is None:
+            return 0
+        if now is None:
+            now = now_micros()
+        total_time = group.prefix[-1]
+        for ix in self.open:
+            if (action_type, action_key) in self.keys[ix]:
+                total_time = total_time + seconds_between(self.starts[ix], now)
+        return total_time
+
+    def total(self, action_type, action_key, lo, hi, now=None):
+        """
+        Seconds spent in the action (for one task, or any task if action_key
+        is -1) for actions starting in [lo, hi)
+        """
+        group = self.groups.get((action_type, action_key))
+        if group is None:
+            return 0
+        if now is None:
+            now = now_micros()
+
+        if not self.ordered:
+            # the log is not sorted by time, so bisecting is not possible
+            total_time = 0
+            for ix in group.positions:
+                start = self.starts[ix]
+                if (lo is not None and start < lo) or (hi is not None and start >= hi):
+                    continue
+                duration = self.durations[ix]
+                total_time = total_time + (duration if duration is not None else seconds_between(start, now))
+            return total_time
+
+        first = bisect_left(group.starts, lo) if lo is not None else 0
+        last = bisect_left(group.starts, hi) if hi is not None else len(group.starts)
+        num_closed = len(group.prefix)-1
+        total_time = group.prefix[min(last, num_closed)] - group.prefix[min(first, num_closed)]
+
+        # we are still doing these actions
+        for start in group.starts[max(first, num_closed):last]:
+            total_time = total_time + seconds_between(start, now)
+        return total_time
+
+class TaskRecords:
+    """
+    The tasks of a journal as the list of records that storage.follow()
+    applies the new task records to. A record is only made for the tasks
+    that are looked at, and apply() writes them back to the tasks.
+    """
+    def __init__(self, tasks):
+        self.tasks = tasks
+        # task_id -> record, for the tasks looked at or added
+        self.records = {}
+        self.count = len(tasks)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return [self[i] for i in range(*ix.indices(self.count))]
+        if ix < 0:
+            ix = ix + self.count
+        if ix < 0 or ix >= self.count:
+            raise IndexError("task index out of range")
+        record = self.records.get(ix)
+        if record is None:
+            task = self.tasks[ix]
+            record = self.records[ix] = [task.name, task.time, task.task_type, task.completed]
+        return record
+
+    def __setitem__(self, ix, records):
+        # only the slices of one task the storages replace are supported
+        first = ix.start
+        if ix.step is not None or first > self.count or ix.stop - first != len(records):
+            raise ValueError("only tasks can be replaced or added")
+        for offset, record in enumerate(records):
+            self.records[first+offset] = record
+        self.count = max(self.count, first + len(records))
+
+    def append(self, record):
+        self.records[self.count] = record
+        self.count = self.count + 1
+
+    def apply(self):
+        for task_id in sorted(self.records):
+            name, time, task_type, completed = self.records[task_id]
+            if task_id >= len(self.tasks):
+                self.tasks.append(Task(name, time, task_type, completed))
+                continue
+            task = self.tasks[task_id]
+            if (task.name, task.time, task.task_type, task.completed) != (name, time, task_type, completed):
+                self.tasks[task_id] = Task(name, time, task_type, completed)
+
+class StoredActions:
+    """
+    Sequence over the actions kept in a lazy storage, only the actions that
+    are asked for are read. Actions are added through the storage.
+    """
+    def __init__(self, storage, chunk=1000):
+        self.storage = storage
+        self.chunk = chunk
+
+    def __len__(self):
+        return self.storage.count
+
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            first, last, step = ix.indices(len(self))
+            if step != 1:
+                return list(self)[ix]
+            if first >= last:
+                return []
+            return [Action(action, task_id, ts) for action, task_id, ts, end in self.storage.interval_records(first, last)]
+        if ix < 0:
+            ix = ix + len(self)
+        if ix < 0 or ix >= len(self):
+            raise IndexError("action index out of range")
+        action, task_id, ts, end = self.storage.interval_records(ix, ix+1)[0]
+        return Action(action, task_id, ts)
+
+    def __iter__(self):
+        for first in range(0, len(self), self.chunk):
+            for action in self[first:first+self.chunk]:
+                yield action
+
+class ActionStore(StoredActions):
+    """
+    Actions in the fixed-width records of a BinaryStorage, unpacked straight
+    from the mapped file when they are indexed or iterated, so memory only
+    grows with the actions that are used
+    """
+    def __getitem__(self, ix):
+        if isinstance(ix, slice):
+            return StoredActions.__getitem__(self, ix)
+        if ix < 0:
+            ix = ix + len(self)
+        if ix < 0 or ix >= len(self):
+            raise IndexError("action index out of range")
+        return Action(*self.storage.record_at(ix))
+
+class SqliteIndex:
+    """
+    Answers the same queries as IntervalIndex from a lazy storage, which keeps
+    the resolved interval next to each action. Only the open intervals are
+    kept in memory.
+    """
+    ordered = True
+
+    def __init__(self, storage):
+        self.storage = storage
+        # (action type, task_id) -> seconds of the closed intervals, read
+        # when first needed and kept up to date by append
+        self.totals = None
+        # the open intervals are the last timed action and everything after it
+        first = self.storage.last_position(timed_codes, self.storage.count) or 0
+        self.open = [(first+ix, ts, action, task_id) for ix, (action, task_id, ts, end) in
+            enumerate(self.storage.interval_records(first, self.storage.count))]
+
+    def build(self, actions, chunk=10000):
+        """
+        Resolve the interval of every action again
+        """
+        self.totals = None
+        self.storage.clear_intervals(0)
+        intervals = []
+        self.open = []
+        for ix, action in enumerate(actions):
+            ts = action.ts
+            if timed_tasks[action.action]:
+                intervals.extend((pos, ts, seconds_between(start, ts)) for pos, start, code, task_id in self.open)
+                self.open = []
+                if len(intervals) >= chunk:
+                    self.storage.set_intervals(intervals)
+                    intervals = []
+            self.open.append((ix, ts, action.action, action.task_id))
+        self.storage.set_intervals(intervals)
+
+    def stamp(self, actions):
+        pass
+
+    def rebuild_from(self, actions, pos, chunk=10000):
+        """
+        Resolve the intervals of the actions from position pos on again,
+        starting at the last timed action before it
+        """
+        self.totals = None
+        first = self.storage.last_position(timed_codes, pos) or 0
+        self.storage.clear_intervals(first)
+        intervals = []
+        self.open = []
+        for ix, (action, task_id, ts, end) in enumerate(self.storage.interval_records(first, self.storage.count), first):
+            if timed_tasks[action]:
+                intervals.extend((open_pos, ts, seconds_between(start, ts)) for open_pos, start, code, open_task_id in self.open)
+                self.open = []
+                if len(intervals) >= chunk:
+                    self.storage.set_intervals(intervals)
+                    intervals = []
+            self.open.append((ix, ts, action, task_id))
+        self.storage.set_intervals(intervals)
+
+    def is_current(self, actions):
+        # every change goes through the storage
+        return True
+
+    def add_to_totals(self, code, task_id, duration):
+        if self.totals is not None:
+            for key in [(code, -1)] + ([(code, task_id)] if task_id != -1 else []):
+                self.totals[key] = self.totals.get(key, 0) + duration
+
+    def append(self, action):
+        ts = action.ts
+        if timed_tasks[action.action]:
+            self.storage.set_intervals([(pos, ts, seconds_between(start, ts)) for pos, start, code, task_id in self.open])
+            for pos, start, code, task_id in self.open:
+                self.add_to_totals(code, task_id, seconds_between(start, ts))
+            self.open = []
+        self.open.append((self.storage.count-1, ts, action.action, action.task_id))
+
+    def remove_last(self):
+        """
+        Reopen the intervals ended by the last action, before it is removed
+        """
+        pos, start, code, task_id = self.open.pop()
+        if timed_tasks[code]:
+            first = self.storage.last_position(timed_codes, pos) or 0
+            for action, open_task_id, ts, end in self.storage.interval_records(first, pos):
+                self.add_to_totals(action, open_task_id, -seconds_between(ts, start))
+            self.storage.clear_intervals(first)
+            self.open = [(first+ix, ts, action, task_id) for ix, (action, task_id, ts, end) in
+                enumerate(self.storage.interval_records(first, pos))]
+
+    def window(self, lo, hi, lead=False):
+        first = self.storage.position(lo) if lo is not None else 0
+        last = self.storage.position(hi) if hi is not None else self.storage.count
+        if lead and first > 0:
+            first = self.storage.last_position(timed_codes, first) or 0
+        return (first, last)
+
+    def intervals(self, actions, first, last, now):
+        for action, task_id, ts, end in self.storage.interval_records(first, last):
+            yield (Action(action, task_id, ts), end, seconds_between(ts, end if end is not None else now))
+
+    def cumulative(self, action_type, action_key, now=None):
+        """
+        Seconds spent in the action over the whole journal, like
+        IntervalIndex.cumulative
+        """
+        if self.totals is None:
+            self.totals = self.storage.closed_totals()
+        if now is None:
+            now = now_micros()
+        total_time = self.totals.get((action_type, action_key), 0)
+        for pos, start, code, task_id in self.open:
+            if code == action_type and (action_key == -1 or task_id == action_key):
+                total_time = total_time + seconds_between(start, now)
+        return total_time
+
+    def total(self, action_type, action_key, lo, hi, now=None):
+        if now is None:
+            now = now_micros()
+        total_time = self.storage.sum_durations(action_type, action_key, lo, hi)
+
+        # we are still doing these actions
+        for pos, start, code, task_id in self.open:
+            if code == action_type and (action_key == -1 or task_id == action_key) and not ((lo is not None and start < lo) or (hi is not None and start >= hi)):
+                total_time = total_time + seconds_between(start, now)
+        return total_time
+
+class Checkpoint:
+    """
+    What a snapshot knows about the actions before journal.actions[0], which
+    are not loaded: how many there are and the time spent in their intervals
+    None of their intervals reaches past first_ts, the start of the first
+    loaded action
+    """
+    def __init__(self, count, totals, first_ts, offset=None, num_open=0):
+        self.count = count
+        # (action type, task_id) -> seconds, grouped like the IntervalIndex
+        self.totals = totals
+        self.first_ts = first_ts
+        # where the snapshot was taken in the action log, the num_open actions
+        # before it are loaded as the open ones
+        self.offset = offset
+        self.num_open = num_open
+
+    def total(self, action_type, action_key):
+        return self.totals.get((action_type, action_key), 0)
+
+class ReportData:
+    """
+    Everything make_custom_report prints, gathered in a single sweep over the
+    actions in the report window
+    """
+    def __init__(self):
+        self.task_times = {}
+        self.category_times = {}
+        self.first_action = None
+        self.num_overtime = 0
+        self.overtime = 0
+
+    def category_time(self, action_type):
+        return self.category_times.get(action_type, 0)
+
+def sweep_intervals(data, index, actions, first, last, lo, hi, now, num_tasks):
+    """
+    Add the time of the actions at positions [first, last) that start in
+    [lo, hi) to the times of a ReportData, and return the first start
+    """
+    first_ts = None
+    for action, end, act_time in index.intervals(actions, first, last, now):
+        ts = action.ts
+        if (lo is not None and ts < lo) or (hi is not None and ts >= hi):
+            continue
+        if first_ts is None or ts < first_ts:
+            first_ts = ts
+        data.category_times[action.action] = data.category_time(action.action) + act_time
+        if action.action == TASK_SWITCH and action.task_id >= 0 and action.task_id < num_tasks:
+            data.task_times[action.task_id] = data.task_times.get(action.task_id, 0) + act_time
+    return first_ts
+
+def segment_summary(name, index, first, last):
+    """
+    Summary of the actions at positions [first, last) of an interval index,
+    whose intervals are all closed: their time range, the time per action
+    type and task, and the first action and the calendar time of every day
+    """
+    totals = {}
+    days = {}
+    for ix in range(first, last):
+        start, end, duration = index.starts[ix], index.ends[ix], index.durations[ix]
+        for key in index.keys[ix]:
+            totals[key] = totals.get(key, 0) + duration
+        days.setdefault(start - start % MICROS_PER_DAY, {}).setdefault('first', start)
+        # cut at midnight like the calendar, the last interval may run into
+        # the days of the next segment
+        code = str(index.keys[ix][0][0])
+        while start < end:
+            day = start - start % MICROS_PER_DAY
+            piece_end = min(end, day + MICROS_PER_DAY)
+            times = days.setdefault(day, {}).setdefault('times', {})
+            times[code] = times.get(code, 0) + seconds_between(start, piece_end)
+            start = piece_end
+    return {'name': name,
+        'count': last-first,
+        'first': index.starts[first],
+        'last': index.starts[last-1],
+        'end': index.ends[last-1],
+        'totals': format_totals(totals),
+        'days': dict((journal_storage.from_micros(day).date().isoformat(), value) for day, value in days.items())}
+
+class Segment:
+    """
+    A month of actions archived out of the live log, known by its summary
+    first_ts and last_ts are the starts of its first and last actions, end_ts
+    the start of the timed action that ends its last intervals.
+    """
+    def __init__(self, summary):
+        self.name = summary['name']
+        self.count = summary['count']
+        self.first_ts = summary['first']
+        self.last_ts = summary['last']
+        self.end_ts = summary['end']
+        self.totals = parse_totals(summary['totals'])
+        # midnight -> start of the first action of the day
+        self.firsts = {}
+        # midnight -> {action type: seconds}
+        self.days = {}
+        for day, value in summary['days'].items():
+            year, month, day = day.split('-')
+            midnight = journal_storage.to_micros(datetime.datetime(int(year), int(month), int(day)))
+            if 'first' in value:
+                self.firsts[midnight] = value['first']
+            self.days[midnight] = dict((int(code), seconds) for code, seconds in value.get('times', {}).items())
+
+    def covered(self, lo, hi):
+        """
+        Whether all the actions of the segment start in [lo, hi)
+        """
+        return (lo is None or lo <= self.first_ts) and (hi is None or self.last_ts < hi)
+
+    def overlaps(self, lo, hi):
+        """
+        Whether any action of the segment may start in [lo, hi)
+        """
+        return (lo is None or lo <= self.last_ts) and (hi is None or self.first_ts < hi)
+
+class Archive:
+    """
+    The segments archived out of the live log, oldest first
+    Queries take what they need from the summaries of the segments they
+    cover, the actions of a segment are only read when a query cuts through
+    it. The segments read are kept in a least recently used cache of about
+    cache_bytes.
+    """
+    # memory taken by an action of a loaded segment, with its interval:
+    # tracemalloc puts it at 208-212 bytes for month segments of about 8800
+    # actions of every type over 40 tasks (the Action is 56 of them)
+    action_bytes = 210
+
+    def __init__(self, storage=None, cache_bytes=64*1024*1024):
+        self.storage = storage
+        self.cache_bytes = cache_bytes
+        self.segments = []
+        if storage is not None and storage.segments:
+            self.segments = [Segment(summary) for summary in storage.read_segment_summaries()]
+        self.count = sum(segment.count for segment in self.segments)
+        self.totals = {}
+        for segment in self.segments:
+            for key, value in segment.totals.items():
+                self.totals[key] = self.totals.get(key, 0) + value
+        # name -> (actions, interval index), least recently used first
+        self.loaded = collections.OrderedDict()
+        self.loaded_bytes = 0
+
+    def reaches(self, ts):
+        """
+        Whether an action at ts would change the archived intervals
+        """
+        return bool(self.segments) and ts <= self.segments[-1].end_ts
+
+    def load(self, segment):
+        """
+        The actions of a segment and their interval index
+        """
+        loaded = self.loaded.get(segment.name)
+        if loaded is not None:
+            self.loaded.move_to_end(segment.name)
+            return loaded
+        actions = [Action(action, task_id, micros) for action, task_id, micros in self.storage.read_segment(segment.name)]
+        index = IntervalIndex()
+        index.build(actions)
+        index.close(segment.end_ts)
+        loaded = self.loaded[segment.name] = (actions, index)
+        self.loaded_bytes = self.loaded_bytes + len(actions)*self.action_bytes
+        # the segment just read stays even if it is larger than the cache
+        while self.loaded_bytes > self.cache_bytes and len(self.loaded) > 1:
+            name, (actions, index) = self.loaded.popitem(last=False)
+            self.loaded_bytes = self.loaded_bytes - len(actions)*self.action_bytes
+        return loaded
+
+    def read(self, first, last):
+        """
+        The archived actions at positions [first, last), without loading
+        the segments they are in
+        """
+        actions = []
+        pos = 0
+        for segment in self.segments:
+            if pos < last and pos + segment.count > first:
+                if segment.name in self.loaded:
+                    actions.extend(self.load(segment)[0][max(first-pos, 0):last-pos])
+                else:
+                    records = self.storage.read_segment(segment.name, max(first-pos, 0), last-pos)
+                    actions.extend(Action(action, task_id, micros) for action, task_id, micros in records)
+            pos = pos + segment.count
+        return actions
+
+    def total(self, action_type, action_key, lo, hi):
+        """
+        Seconds spent in the action for archived actions starting in [lo, hi)
+        """
+        total_time = 0
+        for segment in self.segments:
+            if segment.covered(lo, hi):
+                total_time = total_time + segment.totals.get((action_type, action_key), 0)
+            elif segment.overlaps(lo, hi):
+                index = self.load(segment)[1]
+                total_time = total_time + index.total(action_type, action_key, lo, hi, segment.end_ts)
+        return total_time
+
+    def report(self, data, lo, hi, num_tasks):
+        """
+        Add the archived actions starting in [lo, hi) to a ReportData, and
+        return the first start
+        """
+        first_ts = None
+        for segment in self.segments:
+            if segment.covered(lo, hi):
+                for (action_type, task_id), seconds in segment.totals.items():
+                    if task_id == -1:
+                        data.category_times[action_type] = data.category_time(action_type) + seconds
+                    elif action_type == TASK_SWITCH and task_id < num_tasks:
+                        data.task_times[task_id] = data.task_times.get(task_id, 0) + seconds
+                ts = segment.first_ts
+            elif segment.overlaps(lo, hi):
+                actions, index = self.load(segment)
+                first, last = index.window(lo, hi)
+                ts = sweep_intervals(data, index, actions, first, last, lo, hi, segment.end_ts, num_tasks)
+            else:
+                continue
+            if ts is not None and (first_ts is None or ts < first_ts):
+                first_ts = ts
+        return first_ts
+
+    def first_ts(self, lo, hi):
+        """
+        Start of the first archived action in [lo, hi)
+        Bounds at midnight are answered from the first action of every day.
+        """
+        at_midnight = (lo is None or lo % MICROS_PER_DAY == 0) and (hi is None or hi % MICROS_PER_DAY == 0)
+        # the segments follow each other in time
+        for segment in self.segments:
+            if segment.covered(lo, hi):
+                return segment.first_ts
+            if not segment.overlaps(lo, hi):
+                continue
+            if at_midnight:
+                firsts = [ts for day, ts in segment.firsts.items() if (lo is None or day >= lo) and (hi is None or day < hi)]
+                if firsts:
+                    return min(firsts)
+            else:
+                index = self.load(segment)[1]
+                first, last = index.window(lo, hi)
+                if first < last:
+                    return index.starts[first]
+        return None
+
+    def add_days(self, matrix, lo, categories):
+        """
+        Add the calendar time of the archived days to a day_matrix from
+        midnight lo
+        """
+        hi = lo + len(matrix)*MICROS_PER_DAY
+        for segment in self.segments:
+            if segment.first_ts >= hi or segment.end_ts < lo:
+                continue
+            for day, times in segment.days.items():
+                if lo <= day < hi:
+                    row = matrix[(day - lo) // MICROS_PER_DAY]
+                    for col, action_type in enumerate(categories):
+                        row[col] += times.get(action_type, 0)
+
+class OpenTaskIndex:
+    """
+    Ids of the tasks that are not completed, per task type and in order, so
+    that listing them does not go over every task ever added
+    """
+    def __init__(self):
+        self.build([])
+
+    def build(self, tasks):
+        self.open = {}
+        for task_id, task in enumerate(tasks):
+            if not task.completed:
+                self.open.setdefault(task.task_type, []).append(task_id)
+        self.stamp(tasks)
+
+    def stamp(self, tasks):
+        self.source = tasks
+        self.count = len(tasks)
+        self.generation = Task.generation
+
+    def is_current(self, tasks):
+        return self.source is tasks and self.count == len(tasks) and self.generation == Task.generation
+
+    def update(self, task_id, task):
+        """
+        Add or remove a task that was added or changed
+        """
+        ids = self.open.setdefault(task.task_type, [])
+        ix = bisect_left(ids, task_id)
+        is_open = ix < len(ids) and ids[ix] == task_id
+        if task.completed and is_open:
+            ids.pop(ix)
+        elif not task.completed and not is_open:
+            insort(ids, task_id)
+
+    def task_ids(self, task_type=None):
+        if task_type is not None:
+            return list(self.open.get(task_type, []))
+        return list(heapq.merge(*self.open.values()))
+
+class Journal:
+    # set while the actions covered by a snapshot are not loaded
+    checkpoint = None
+    # the months archived out of the live log, read by reload()
+    archive = Archive()
+    # start of the first action in the live log, None if not known
+    live_first_ts = None
+    # set by journal_stats when the journal is instrumented
+    stats = None
+    # report with the NumPy backend when it is installed
+    use_numpy = True
+    # the arrays of the NumPy backend, made on first use
+    arrays = None
+    # fewer actions than this are summed faster by the loops
+    numpy_min_actions = 500
+
+    def __init__(self, storage=None, snapshot_interval=1000, start=True, cache_bytes=64*1024*1024):
+        """
+        cache_bytes is about the memory kept for the archived actions that
+        queries reaching into the archived months page in
+        """
+        self.storage = storage if storage is not None else journal_storage.TextStorage()
         self.tasks = []
+        # rebuilt on demand when self.tasks is replaced
+        self.task_index = OpenTaskIndex()
         self.cur_action = TASK_ADD_TASKS
         self.cur_action_key = -1
-        self.actions = []
+        # time of the new actions, None for now
+        self.clock = None
+        self.snapshot_interval = snapshot_interval
+        self.cache_bytes = cache_bytes
+        self.since_snapshot = 0
+        self.in_batch = False
+        self.reload()
+
+        # a session starts by adding tasks
+        if start:
+            self.add_action(TASK_ADD_TASKS)
+            self.cur_action = TASK_ADD_TASKS
+            self.cur_action_key = -1
 
-        self.read_from_file()
-        self.add_action(TASK_ADD_TASKS)
+    def reload(self):
+        """
+        Read the tasks and actions again from the storage
+        """
+        self.storage.sync()
+        with self.storage.locked():
+            self.storage.refresh()
+            self.tasks = []
+            self.reset_actions()
+            self.read_from_file()
+            self.archive = Archive(self.storage, self.cache_bytes)
+            self.finish_rotation()
+        # the interval index is built by the first query that needs it
+        self.restore_current_action()
+
+    def restore_current_action(self):
+        """
+        Carry on with the last timed action of the log, as if this session
+        had made it.
+        Rotations and snapshots keep it in the live actions, it is where the
+        open intervals start.
+        """
+        self.cur_action = TASK_ADD_TASKS
+        self.cur_action_key = -1
+        for ix in range(len(self.actions)-1, -1, -1):
+            action = self.actions[ix]
+            if timed_tasks[action.action]:
+                self.cur_action = action.action
+                self.cur_action_key = action.task_id
+                return
+
+    def follow(self):
+        """
+        Merge what other processes appended to the journal since this one
+        last read or wrote it, reading only the new records
+        """
+        records = TaskRecords(self.tasks)
+        try:
+            actions = self.storage.follow(records)
+        except journal_storage.JournalChanged:
+            # the journal was rewritten, so it has to be read again
+            self.reload()
+            return
+        if actions is None:
+            return
+
+        records.apply()
+        if not self.storage.lazy:
+            index_current = self.index.is_current(self.actions)
+            for action, task_id, dt in actions:
+                new_action = Action(action, task_id, dt)
+                self.actions.append(new_action)
+                if index_current:
+                    self.index.append(new_action)
+            if index_current:
+                self.index.stamp(self.actions)
+        elif self.storage.keeps_intervals:
+            # the other process resolved the intervals that were open here
+            self.index = SqliteIndex(self.storage)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Gather the changes made inside and persist them once at the end
+        What other processes appended is merged first. If the block raises,
+        nothing it did is persisted and the journal is read back from the
+        storage. Batches nest into the outermost one.
+        """
+        if self.in_batch:
+            yield self
+            return
+        self.follow()
+        cur_action, cur_action_key = self.cur_action, self.cur_action_key
+        self.in_batch = True
+        try:
+            with self.storage.transaction():
+                yield self
+        except BaseException:
+            self.reload()
+            self.cur_action, self.cur_action_key = cur_action, cur_action_key
+            raise
+        finally:
+            self.in_batch = False
+        # a snapshot only covers whole batches
+        self.snapshot_if_due()
+        self.rotate_if_due()
+
+    def reset_actions(self):
+        self.checkpoint = None
+        self.live_first_ts = None
+        if not self.storage.lazy:
+            self.actions = []
+            self.index = IntervalIndex()
+        elif self.storage.keeps_intervals:
+            # the actions stay in the storage and are only read when needed
+            self.actions = StoredActions(self.storage)
+            self.index = SqliteIndex(self.storage)
+        else:
+            # the index is only built once a query needs it
+            self.actions = ActionStore(self.storage)
+            self.index = IntervalIndex()
 
     def write_to_file(self):
-        with open("journal_tasks.txt",'w') as f:
-            for task in self.tasks:
-                f.write("{0},{1},{2},{3}\n".format(task.name, task.time, task.task_type, task.completed))
-        with open("journal_actions.txt",'w') as f:
-            for action in self.actions:
-                f.write("{0},{1},{2}\n".format(action.action, action.task_id, action.dt))
+        """
+        Rewrite the storage from the in-memory state. Normal mutations only
+        append records, so this is used when compacting the journal.
+        """
+        self.load_history()
+        self.storage.rewrite(self.tasks, self.actions)
+
+    def append_task_record(self, task_id):
+        self.storage.append_task(task_id, self.tasks[task_id])
+
+    def append_task_update(self, task_id):
+        self.storage.update_task(task_id, self.tasks[task_id])
+
+    def append_action_record(self, action):
+        self.storage.append_action(action)
+
+    def compact(self):
+        """
+        Replace the append-only logs with a single record per task and action
+        """
+        self.storage.sync()
+        with self.storage.locked():
+            self.follow()
+            self.write_to_file()
+            self.rotate()
+
+    def rotate(self):
+        """
+        Archive every month before the month of the last action as a segment
+        of its own, as far as their intervals are all closed, and keep only
+        the rest in the live log. Older segments are then compressed.
+        The action that closes the last interval of a month is where the
+        archive ends and can no longer be changed, so a month is only archived
+        once the month of that action is over as well.
+        """
+        if not self.storage.segments:
+            return
+        self.storage.sync()
+        with self.storage.locked():
+            self.follow()
+            self.load_history()
+            index = self.interval_index()
+            # the actions from the last timed action on are still open
+            num_closed = index.open[0] if index.open else len(self.actions)
+            last_name = self.archive.segments[-1].name if self.archive.segments else ''
+            summaries = []
+            pos = 0
+            # months can only be told apart in a sorted log
+            while index.ordered and pos < num_closed:
+                month_start, month_end = month_bounds(index.starts[pos])
+                end = bisect_left(index.starts, month_end)
+                name = journal_storage.from_micros(month_start).strftime('%Y-%m')
+                if end == len(self.actions) or end > num_closed or name <= last_name:
+                    break
+                if month_bounds(index.ends[end-1])[1] > self.actions[-1].ts:
+                    break
+                summaries.append(segment_summary(name, index, pos, end))
+                pos = end
+            self.live_first_ts = self.actions[pos].ts if pos < len(self.actions) else None
+            if not summaries:
+                self.storage.compress_segments()
+                return
+
+            # until the live log is rewritten the archived actions are in
+            # both, finish_rotation() drops them if that never happens
+            self.storage.remove_snapshot()
+            pos = 0
+            for summary in summaries:
+                self.storage.write_segment(summary['name'], self.actions[pos:pos+summary['count']], summary)
+                pos = pos + summary['count']
+            self.actions = self.actions[pos:]
+            self.storage.rewrite(self.tasks, self.actions)
+            self.index.build(self.actions)
+            self.storage.compress_segments()
+            self.archive = Archive(self.storage, self.cache_bytes)
+
+    def rotate_if_due(self):
+        """
+        Rotate once the live log reaches two months past its first one, the
+        month before stays live, see rotate()
+        """
+        if not self.storage.segments or len(self.actions) == 0:
+            return
+        if self.live_first_ts is None or month_bounds(month_bounds(self.live_first_ts)[1])[1] <= self.actions[-1].ts:
+            self.rotate()
+
+    def finish_rotation(self):
+        """
+        Drop the actions that are still in the live log after a rotation was
+        interrupted before rewriting it
+        """
+        if self.checkpoint is not None or not self.archive.segments:
+            return
+        last_ts = self.archive.segments[-1].last_ts
+        count = 0
+        while count < len(self.actions) and self.actions[count].ts <= last_ts:
+            count = count + 1
+        if count == 0:
+            return
+        archived = self.archive.read(self.archive.count - count, self.archive.count)
+        if [(a.action, a.task_id, a.ts) for a in archived] == [(a.action, a.task_id, a.ts) for a in self.actions[:count]]:
+            self.actions = self.actions[count:]
+            if not self.storage.read_only:
+                self.storage.rewrite(self.tasks, self.actions)
 
     def read_from_file(self):
-        if not os.path.exists('journal_tasks.txt'):
-            with open("journal_tasks.txt", 'w') as f:
-                pass
-        if not os.path.exists('journal_actions.txt'):
-            with open("journal_actions.txt", 'w') as f:
-                pass
-        with open("journal_tasks.txt",'r') as f:
-            for task in f:
-                data = task.strip().split(',')
-                if len(data) == 4:
-                    self.tasks.append(Task(data[0], int(data[1]), int(data[2]), data[3]=='True'))
-        with open("journal_actions.txt",'r') as f:
-            for action in f:
-                data = action.strip().split(',')
-                if len(data) == 3:
-                    self.actions.append(Action(int(data[0]), int(data[1]), datetime.datetime.strptime(data[2], "%Y-%m-%d %H:%M:%S.%f")))
+        snapshot = self.storage.read_snapshot() if self.storage.snapshots else None
+        if snapshot is not None:
+            try:
+                self.load_snapshot(snapshot)
+                return
+            except journal_storage.JournalChanged:
+                # corrections written after the snapshot reach back before it
+                self.tasks = []
+                self.reset_actions()
+
+        for name, time, task_type, completed in self.storage.read_tasks():
+            self.tasks.append(Task(name, time, task_type, completed))
+        if not self.storage.lazy:
+            for action, task_id, dt in self.storage.read_actions():
+                self.actions.append(Action(action, task_id, dt))
+            if self.actions:
+                self.live_first_ts = self.actions[0].ts
+
+    def load_snapshot(self, snapshot):
+        """
+        Start from a snapshot and only read the records written after it
+        """
+        for name, time, task_type, completed in self.storage.read_tasks(snapshot['tasks_offset'], snapshot['tasks']):
+            self.tasks.append(Task(name, time, task_type, completed))
+
+        # the actions that were still open go in front of the new ones
+        for action, task_id, micros in snapshot['open']:
+            self.actions.append(Action(action, task_id, micros))
+        count = snapshot['count'] - len(self.actions)
+        for action, task_id, dt in self.storage.read_actions(snapshot['actions_offset']):
+            self.actions.append(Action(action, task_id, dt))
+
+        if count > 0:
+            self.checkpoint = Checkpoint(count, parse_totals(snapshot['totals']), self.actions[0].ts,
+                snapshot['actions_offset'], len(snapshot['open']))
+        self.live_first_ts = snapshot.get('first')
+
+    def write_snapshot(self):
+        """
+        Save the tasks, the open actions and the time spent in every closed
+        interval, so that the next start only reads what is written after
+        """
+        if not self.storage.snapshots:
+            return
+        # the snapshot covers the whole files, so it must know all they hold
+        self.storage.sync()
+        with self.storage.locked():
+            self.follow()
+            index = self.interval_index()
+            first_open = index.open[0] if index.open else len(self.actions)
+            totals = dict(self.checkpoint.totals) if self.checkpoint is not None else {}
+            for key, group in index.groups.items():
+                totals[key] = totals.get(key, 0) + group.prefix[-1]
+            self.storage.write_snapshot({
+                'count': (self.checkpoint.count if self.checkpoint is not None else 0) + len(self.actions),
+                'first': self.live_first_ts,
+                'tasks': [[task.name, task.time, task.task_type, task.completed] for task in self.tasks],
+                'open': [[action.action, action.task_id, action.ts] for action in self.actions[first_open:]],
+                'totals': format_totals(totals)})
+        self.since_snapshot = 0
+
+    def snapshot_if_due(self):
+        if self.storage.snapshots and self.since_snapshot >= self.snapshot_interval:
+            self.write_snapshot()
+
+    def load_history(self):
+        """
+        Replay the whole log when something needs the actions a snapshot covers
+        """
+        if self.checkpoint is None:
+            return
+        self.checkpoint = None
+        self.actions = [Action(action, task_id, dt) for action, task_id, dt in self.storage.read_actions()]
+
+    def checkpoint_tail(self, num):
+        """
+        The last num actions a snapshot covers, read back from where it was
+        taken, or None if only replaying the whole log gives them
+        """
+        if self.checkpoint is None or num > self.checkpoint.count:
+            return None
+        records = self.storage.read_actions_before(self.checkpoint.offset, num + self.checkpoint.num_open)
+        if records is None:
+            return None
+        return [Action(action, task_id, dt) for action, task_id, dt in records[:num]]
+
+    def ensure_history(self, lo):
+        """
+        Load the history if a query starting at lo reaches before the snapshot
+        """
+        if self.checkpoint is not None and (lo is None or lo < self.checkpoint.first_ts):
+            self.load_history()
+
+    def action_offset(self):
+        """
+        Number of actions before self.actions[0], archived or not loaded
+        """
+        return self.archive.count + (self.checkpoint.count if self.checkpoint is not None else 0)
+
+    def close(self):
+        self.write_snapshot()
+        self.storage.close()
 
     def add_task(self, name, num_minutes, task_type):
+        index_current = self.task_index.is_current(self.tasks)
         self.tasks.append(Task(name=name, time=num_minutes, task_type=task_type))
-        self.write_to_file()
+        self.append_task_record(len(self.tasks)-1)
+        if index_current:
+            self.task_index.update(len(self.tasks)-1, self.tasks[-1])
+            self.task_index.stamp(self.tasks)
         return len(self.tasks)-1
 
+    def set_task_completed(self, task_id, completed):
+        index_current = self.task_index.is_current(self.tasks)
+        self.tasks[task_id].completed = completed
+        self.append_task_update(task_id)
+        if index_current:
+            self.task_index.update(task_id, self.tasks[task_id])
+            self.task_index.stamp(self.tasks)
+
+    def open_task_index(self):
+        """
+        Return the index of the open tasks, rebuilding it first if the tasks
+        were changed other than through add_task or set_task_completed
+        """
+        if not self.task_index.is_current(self.tasks):
+            self.task_index.build(self.tasks)
+        return self.task_index
+
     def add_action(self, action, task_id=-1):
-        self.actions.append(Action(action=action, task_id=task_id))
-        self.write_to_file()
-        return len(self.actions)-1
+        index_current = self.index.is_current(self.actions)
+        new_action = Action(action=action, task_id=task_id, dt=self.clock)
+        if not self.storage.lazy:
+            self.actions.append(new_action)
+            if self.live_first_ts is None:
+                self.live_first_ts = new_action.ts
+        self.append_action_record(new_action)
+        if index_current:
+            self.index.append(new_action)
+            self.index.stamp(self.actions)
+
+        self.since_snapshot = self.since_snapshot + 1
+        if not self.in_batch:
+            self.snapshot_if_due()
+        return self.action_offset() + len(self.actions)-1
+
+    def pop_action(self):
+        if len(self.actions) > 0 and self.archive.reaches(self.actions[-1].ts):
+            raise ValueError("the last action ends the archived months")
+        self.load_history()
+        index_current = self.index.is_current(self.actions)
+        if index_current:
+            self.index.remove_last()
+        if not self.storage.lazy:
+            self.actions.pop()
+        self.storage.pop_action()
+        if index_current:
+            self.index.stamp(self.actions)
+
+    def move_action(self, ix, new_dt):
+        """
+        Change the time of an action, keeping the actions sorted by time, and
+        return its new position
+        The position is found by bisecting, and only the intervals from the
+        first position that changed on are resolved again.
+        """
+        self.load_history()
+        if self.archive.reaches(min(self.actions[ix].ts, journal_storage.to_micros(new_dt))):
+            raise ValueError("actions can not be moved into or out of the archived months")
+        index = self.interval_index()
+        if not index.ordered and not self.storage.lazy:
+            # positions can only be bisected in a sorted log
+            self.actions[ix].dt = new_dt
+            self.actions.sort(key=lambda x: x.ts)
+            self.index.build(self.actions)
+            self.compact()
+            return None
+
+        # like a stable sort, the action stays in front of the actions it
+        # ties with when moved forward, and behind them when moved back
+        old_ts = self.actions[ix].ts
+        new_ts = journal_storage.to_micros(new_dt)
+        if not index.ordered:
+            new_ix = self.unordered_position(ix, new_ts)
+        elif new_ts > old_ts:
+            new_ix = index.window(new_ts, None)[0] - 1
+        elif new_ts < old_ts:
+            new_ix = index.window(new_ts + 1, None)[0]
+        else:
+            new_ix = ix
+        if not self.storage.lazy:
+            action = self.actions.pop(ix)
+            action.dt = new_dt
+            self.actions.insert(new_ix, action)
+        self.storage.move_action(ix, new_ix, new_dt)
+        self.index.rebuild_from(self.actions, min(ix, new_ix))
+        return new_ix
+
+    def unordered_position(self, ix, new_ts):
+        """
+        The new position of the action at ix moved to new_ts when the log is
+        not sorted, and so can not be bisected: it only moves past the
+        actions next to it that it moves past in time, ties kept like in
+        move_action
+        """
+        new_ix = ix
+        if new_ts > self.actions[ix].ts:
+            while new_ix+1 < len(self.actions) and self.actions[new_ix+1].ts < new_ts:
+                new_ix = new_ix + 1
+        else:
+            while new_ix > 0 and self.actions[new_ix-1].ts > new_ts:
+                new_ix = new_ix - 1
+        return new_ix
+
+    def interval_index(self):
+        """
+        Return the interval index, rebuilding it first if the actions were
+        changed other than through add_action, remove_last_action or
+        adjust_timing
+        """
+        if not self.index.is_current(self.actions):
+            self.index.build(self.actions)
+        return self.index
+
+    def analytics(self, first, last):
+        """
+        Return the arrays of the NumPy backend, up to date with the interval
+        index, to report on the actions at [first, last), or None if the
+        reports should loop over the actions
+        """
+        if not self.use_numpy or not journal_analytics.available() or last-first < self.numpy_min_actions:
+            return None
+        index = self.interval_index()
+        if not isinstance(index, IntervalIndex):
+            # the SQLite index sums the intervals in the database
+            return None
+        if self.arrays is None:
+            self.arrays = journal_analytics.ActionArrays(timed_codes)
+        return self.arrays.update(index)
 
     def clear_data(self, ans):
         if 'y' not in ans:
@@ -99,14 +1393,16 @@ class Journal:
             confirm = 'y'
 
         if confirm == 'y':
-            os.remove('journal_tasks.txt')
-            os.remove('journal_actions.txt')
-            self.tasks = []
-            self.actions = []
-            self.cur_action = TASK_ADD_TASKS
-            self.actions = []
+            self.clear()
 
-            self.add_action(TASK_ADD_TASKS)
+    def clear(self):
+        self.storage.clear()
+        self.tasks = []
+        self.cur_action = TASK_ADD_TASKS
+        self.reset_actions()
+        self.archive = Archive(self.storage, self.cache_bytes)
+
+        self.add_action(TASK_ADD_TASKS)
 
     def remove_last_action(self, ans):
         if len(self.actions)>0:
@@ -124,8 +1420,10 @@ class Journal:
                 confirm = 'y'
 
             # remove it
-            if confirm=="y":
-                self.actions = self.actions[:-1]
+            if confirm=="y" and self.archive.reaches(action.ts):
+                print("Error: Action {0} ends the archived months and can not be removed.".format(action_name))
+            elif confirm=="y":
+                self.pop_action()
                 print("Action {0} removed.".format(action_name))
 
                 # reset cur_action and cur_action_key
@@ -145,11 +1443,22 @@ class Journal:
         value = self.tasks[task_id]
         return '{0}{1}.{2} {3}'.format(task_types[value.task_type][0], task_id, value.time, value.name)
 
-    def list_tasks(self, task_type=None):
-        for key, value in enumerate(self.tasks):
-            if task_type==None or value.task_type==task_type:
-                if not value.completed:
-                    print(self.task_str(key))
+    def list_tasks(self, task_type=None, page=None, page_size=20):
+        """
+        Print the open tasks of a type, or of any type, all of them or only
+        the given page of page_size tasks
+        """
+        task_ids = self.open_task_index().task_ids(task_type)
+        num_pages = max((len(task_ids)+page_size-1)//page_size, 1)
+        if page is not None and not 1 <= page <= num_pages:
+            print("Error: There is no page {0}, the tasks fill {1} pages.".format(page, num_pages))
+            return
+        if page is not None:
+            task_ids = task_ids[(page-1)*page_size:page*page_size]
+        for task_id in task_ids:
+            print(self.task_str(task_id))
+        if page is not None:
+            print("Page {0} of {1}".format(page, num_pages))
 
     def first_action(self, day_start=datetime.date.today(), num_days=1):
         """
@@ -157,13 +1466,18 @@ class Journal:
         Note that day_start and num_days may be None
         Default is to consider only today
         """
-        min_day = datetime.datetime.now()
-        for ix, action in enumerate(self.actions):
-            if (day_start and (action.dt.date() < day_start)) or (num_days and (action.dt.date() >= (day_start+datetime.timedelta(days=num_days)))):
-                continue
-            if action.dt < min_day:
-                min_day = action.dt
-        return min_day.time()
+        lo, hi = micro_bounds(day_start, num_days)
+        self.ensure_history(lo)
+        index = self.interval_index()
+        first, last = index.window(lo, hi)
+        first_ts = self.archive.first_ts(lo, hi)
+        for ix in range(first, last):
+            ts = self.actions[ix].ts
+            if (lo is None or ts >= lo) and (hi is None or ts < hi) and (first_ts is None or ts < first_ts):
+                first_ts = ts
+        if first_ts is None:
+            return datetime.datetime.now().time()
+        return journal_storage.from_micros(first_ts).time()
 
     def count_time_in_action(self, action_type, action_key=-1, day_start=datetime.date.today(), num_days=1):
         """
@@ -171,56 +1485,88 @@ class Journal:
         Note that day_start and num_days may be None
         Default is to consider only today
         """
-        total_time = 0
-        for ix, action in enumerate(self.actions):
-            if (day_start and (action.dt.date() < day_start)) or (num_days and (action.dt.date() >= (day_start+datetime.timedelta(days=num_days)))):
-                continue
-            if action.action==action_type and (action_key==-1 or action.task_id==action_key):
-                # find the next action that is not a TASK_NEW or TASK_COMPLETED (timed_tasks=True)
-                still_count = True
-                incr = 1
-                while still_count:
-                    if (ix+incr)<len(self.actions):
-                        a = self.actions[ix+incr].action
-                        if timed_tasks[a]:
-                            this_time = self.actions[ix+incr].dt - action.dt
-                            still_count = False
-                        else:
-                            incr = incr+1
-                    else:
-                        # we are still doing this action
-                        this_time = datetime.datetime.now() - action.dt
-                        still_count = False
-                total_time = total_time+this_time.seconds
-        return total_time
+        lo, hi = micro_bounds(day_start, num_days)
+        return self.total_time(action_type, action_key, lo, hi)
+
+    def total_time(self, action_type, action_key, lo, hi, now=None):
+        """
+        Seconds spent in an action between lo and hi, in microseconds since
+        the epoch
+        All-time totals of a snapshot come from the checkpoint, other windows
+        that reach before it need the history
+        """
+        if lo is None and hi is None:
+            # all-time totals are kept up to date as actions are added
+            total_time = self.interval_index().cumulative(action_type, action_key, now)
+            if self.checkpoint is not None:
+                total_time = total_time + self.checkpoint.total(action_type, action_key)
+            return total_time + self.archive.totals.get((action_type, action_key), 0)
+        self.ensure_history(lo)
+        return self.interval_index().total(action_type, action_key, lo, hi, now) + self.archive.total(action_type, action_key, lo, hi)
 
     def count_overtime(self, day_start=datetime.date.today(), num_days=1):
         """
         Counts time spent over the allocated time given for a task, over the period given
         Returns a tuple (number of tasks that went overtime, total time overspent)
         """
-        total_overtime = 0
-        num_overtime = 0
-        for ix, task in enumerate(self.tasks):
-            expected_sec = 60*self.tasks[ix].time
+        data = self.report_data(day_start, num_days)
+        return (data.num_overtime, data.overtime)
 
-            # Find out how much time has been spent on this action in all
-            total_sec = self.count_time_in_action(TASK_SWITCH, ix, None, None)
+    def report_data(self, day_start, num_days):
+        """
+        Sweep once over the actions in the period and gather the time spent per
+        task and per action type, the first action and the overtime
+        """
+        now = now_micros()
+        lo, hi = micro_bounds(day_start, num_days)
+        self.ensure_history(lo)
+        index = self.interval_index()
+        first, last = index.window(lo, hi)
+        arrays = self.analytics(first, last)
+        data = ReportData()
+        if arrays is not None:
+            first_ts, data.category_times, data.task_times = arrays.report(first, last, lo, hi, now, TASK_SWITCH, len(self.tasks))
+        else:
+            first_ts = sweep_intervals(data, index, self.actions, first, last, lo, hi, now, len(self.tasks))
+        # the archived months the period covers are answered by their summaries
+        archived_ts = self.archive.report(data, lo, hi, len(self.tasks))
+        if archived_ts is not None and (first_ts is None or archived_ts < first_ts):
+            first_ts = archived_ts
+        if first_ts is not None:
+            data.first_action = journal_storage.from_micros(first_ts)
+        if arrays is not None:
+            self.array_overtime(data, now)
+            return data
+
+        for task_id, today_sec in data.task_times.items():
+            expected_sec = 60*self.tasks[task_id].time
 
-            # Find out how much of that time was spent today
-            today_sec = self.count_time_in_action(TASK_SWITCH, ix, day_start, num_days)
+            # Find out how much time has been spent on this action in all
+            total_sec = self.total_time(TASK_SWITCH, task_id, None, None, now)
 
             # Find out how much is expected after work that wasn't done today
             adjusted_expected_sec = max(expected_sec - (total_sec - today_sec), 0)
 
             # Penalize only based on how much of that task was done today, only if it went over
             if total_sec > expected_sec and today_sec > adjusted_expected_sec:
-                num_overtime = num_overtime + 1
-                total_overtime = total_overtime + today_sec - adjusted_expected_sec
-        return (num_overtime, total_overtime)
+                data.num_overtime = data.num_overtime + 1
+                data.overtime = data.overtime + today_sec - adjusted_expected_sec
+        return data
+
+    def array_overtime(self, data, now):
+        """
+        The overtime of report_data with the NumPy backend
+        """
+        if data.task_times:
+            task_ids = list(data.task_times)
+            # the all-time totals are kept up to date by the interval index
+            total_seconds = [self.total_time(TASK_SWITCH, task_id, None, None, now) for task_id in task_ids]
+            data.num_overtime, data.overtime = journal_analytics.overtime([data.task_times[task_id] for task_id in task_ids],
+                total_seconds, [60*self.tasks[task_id].time for task_id in task_ids])
 
     def list_actions(self):
-        ans = input("How many actions would you like to see? (1-{0}) ".format(len(self.actions)))
+        num_total = self.action_offset() + len(self.actions)
+        ans = input("How many actions would you like to see? (1-{0}) ".format(num_total))
         if ans=='':
             ans='10'
         try:
@@ -229,15 +1575,27 @@ class Journal:
             print("Was unable to convert {0} to an integer".format(ans))
             return
 
-        if num_actions > len(self.actions):
-            num_actions = len(self.actions)
+        if num_actions > num_total:
+            num_actions = num_total
         if num_actions < 1:
             num_actions = 1
-
-        max_digits = len(str(len(self.actions)))
+        # the actions a snapshot covers are read back from it if they can be
+        earlier = []
+        if num_actions > len(self.actions) and self.checkpoint is not None:
+            earlier = self.checkpoint_tail(num_actions - len(self.actions))
+            if earlier is None:
+                earlier = []
+                self.load_history()
+        offset = self.action_offset()
+        shown = earlier + list(self.actions[max(len(self.actions)-num_actions, 0):])
+        if num_actions > len(shown):
+            # the oldest ones are in the archived segments
+            shown = self.archive.read(offset - (num_actions - len(shown)), offset) + shown
+
+        max_digits = len(str(num_total))
         print('{0}  DOW MON DY YEAR TIME     ACTION         TSK ESTIMTM ACTULTM'.format('#'*max_digits))
-        for ix, action in enumerate(reversed(self.actions[(len(self.actions)-num_actions):])):
-            realix = len(self.actions)-1-ix
+        for ix, action in enumerate(reversed(shown)):
+            realix = offset+len(self.actions)-1-ix
             if action.task_id != -1:
                 print('{0}{1}: {2} {3:<15}{4:>3} {5:>7} {6:>7}'.format(
                     ' '*(max_digits-len(str(realix))),
@@ -253,145 +1611,47 @@ class Journal:
                     action_codes[action.action]))
 
     def make_custom_report(self, day_start, num_days):
-        report=[]
-        longest_task_name = len("Adding new tasks")
-
-        total_time = 0
-        for ix, task in enumerate(self.tasks):
-            act_time = self.count_time_in_action(TASK_SWITCH, ix, day_start, num_days)
-            if act_time>0:
-                task_name = self.task_str(ix)
-                report.append((task_name,act_time))
-                total_time = total_time + act_time
-                if len(task_name)>longest_task_name:
-                    longest_task_name=len(task_name)
-
-        if longest_task_name > 100:
-            longest_task_name = 100
-
-        this_str = 'First action'
-        time = self.first_action(day_start, num_days).replace(microsecond=0)
-        print("{0}{1}{2}".format(this_str,
-            ' '*(longest_task_name-len(this_str)+2),
-            time.isoformat()))
-
-        for this_str, act_time in report:
-            print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
-                ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600), int(act_time / 60) % 60, act_time % 60))
-
-        this_str = 'In meetings'
-        act_time = self.count_time_in_action(TASK_MEETING, -1, day_start, num_days)
-        if act_time>0:
-            total_time = total_time + act_time
-            print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
-                ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600), int(act_time / 60) % 60, act_time % 60))
-
-        this_str = 'Adding new tasks'
-        act_time = self.count_time_in_action(TASK_ADD_TASKS, -1, day_start, num_days)
-        if act_time>0:
-            total_time = total_time + act_time
-            print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
-                ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600), int(act_time / 60) % 60, act_time % 60))
-
-        this_str = 'Walking'
-        act_time = self.count_time_in_action(TASK_WALK, -1, day_start, num_days)
-        if act_time>0:
-            total_time = total_time + act_time
-            print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
-                ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600), int(act_time / 60) % 60, act_time % 60))
-
-        this_str = 'Lunch'
-        act_time = self.count_time_in_action(TASK_LUNCH, -1, day_start, num_days)
-        if act_time>0:
-            print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
-                ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600),int(act_time / 60) % 60, act_time % 60))
+        print_custom_report(self.report_data(day_start, num_days), self.task_str)
 
-        num_overtime, act_time = self.count_overtime(day_start, num_days)
-        if act_time > 0 and num_overtime > 0:
-            this_str = 'Overtime: ({0}) tasks'.format(num_overtime)
-            print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
-                ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600),int(act_time / 60) % 60, act_time % 60))
-
-        print("Total working time: {0} hours, {1} minutes, {2} seconds".format(int(total_time / 3600),
-            int(total_time / 60) % 60, total_time % 60))
+    def day_matrix(self, first_day, num_days, categories=calendar_categories):
+        """
+        Seconds spent in each of the categories on each of num_days days from
+        first_day, as matrix[day][category]
+        Intervals that cross midnight are split between the days
+        """
+        now = now_micros()
+        lo, hi = micro_bounds(first_day, num_days)
+        self.ensure_history(lo)
+        index = self.interval_index()
+        # the action running at midnight of the first day started before it
+        first, last = index.window(lo, hi, lead=True)
+        arrays = self.analytics(first, last)
+        if arrays is not None:
+            matrix = arrays.day_matrix(first, last, lo, num_days, categories, now)
+        else:
+            columns = dict((action_type, col) for col, action_type in enumerate(categories))
+            matrix = [[0]*len(categories) for day in range(num_days)]
+            for action, end, duration in index.intervals(self.actions, first, last, now):
+                col = columns.get(action.action)
+                if col is None:
+                    continue
+                start = max(action.ts, lo)
+                end = min(end if end is not None else now, hi)
+                while start < end:
+                    day = (start - lo) // MICROS_PER_DAY
+                    piece_end = min(end, lo + (day+1)*MICROS_PER_DAY)
+                    matrix[day][col] += seconds_between(start, piece_end)
+                    start = piece_end
+        # the archived days are summed up in the summaries
+        self.archive.add_days(matrix, lo, categories)
+        return matrix
 
     def today_report(self):
         self.make_custom_report(datetime.date.today(), 1)
 
     def calendar_report(self, num_days):
-        data=[]
-        days = ['SUNDAY', 'MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY']
-
-        def print_str_13_chars(string, time):
-            time /= 60
-            if time > 60:
-                string += '{0}hr '.format(int(time/60))
-            string += '{0}min'.format(time%60)
-            sys.stdout.write(string)
-            sys.stdout.write(' '*(14-len(string)))
-
-        td = datetime.date.today()
-        num_days = ((((num_days+6)-1-(td.isoweekday() % 7))/7)*7)+1+(td.isoweekday() % 7)
-        #num_days = 21 + (td.isoweekday() % 7) + 1
-        for i in xrange(num_days):
-            this_entry = {}
-            day = datetime.date.today() - datetime.timedelta(days=num_days-i-1)
-            this_entry['day'] = day
-            this_entry['day_str'] = "{0} {1}".format(day.day, days[day.isoweekday() % 7])
-            this_entry['time_meet'] = self.count_time_in_action(TASK_MEETING, -1, day, 1)
-            this_entry['time_add'] = self.count_time_in_action(TASK_ADD_TASKS, -1, day, 1)
-            this_entry['time_walk'] = self.count_time_in_action(TASK_WALK, -1, day, 1)
-            this_entry['time_lunch'] = self.count_time_in_action(TASK_LUNCH, -1, day, 1)
-            this_entry['time_switch'] = self.count_time_in_action(TASK_SWITCH, -1, day, 1)
-            data.append(this_entry)
-
-        print('|-------------------------------------------------------------------------------------------------|')
-
-        it = 0
-        while it <= len(data):
-            # loop through each day and print day string
-            for day in range(7):
-                if (it+day)<len(data):
-                    day_str = data[it+day]['day_str']
-                    sys.stdout.write("| {0}{1}".format(day_str, (12-len(day_str))*' '))
-            print('|')
-
-            # loop through each day and print hours worked
-            for day in range(7):
-                if (it+day)<len(data):
-                    print_str_13_chars("| + ", data[it+day]['time_switch'])
-            print('|')
-
-            # loop through each day and print hours worked
-            for day in range(7):
-                if (it+day)<len(data):
-                    print_str_13_chars("| W ", data[it+day]['time_walk'])
-            print('|')
-
-            # loop through each day and print hours worked
-            for day in range(7):
-                if (it+day)<len(data):
-                    print_str_13_chars("| A ", data[it+day]['time_add'])
-            print('|')
-
-            # loop through each day and print hours worked
-            for day in range(7):
-                if (it+day)<len(data):
-                    print_str_13_chars("| L ", data[it+day]['time_lunch'])
-            print('|')
-
-            # loop through each day and print hours worked
-            for day in range(7):
-                if (it+day)<len(data):
-                    print_str_13_chars("| M ", data[it+day]['time_meet'])
-            print('|')
-
-            # print separator
-            sys.stdout.write('|_____________'*min(7, len(data)-it))
-            print('|')
-
-            # jump to next week
-            it += 7
+        first_day, num_days = calendar_window(num_days)
+        print_calendar(first_day, self.day_matrix(first_day, num_days))
 
     def custom_report(self):
         ans = input("Go back how many days? ")
@@ -408,6 +1668,7 @@ class Journal:
             self.calendar_report(num_days)
 
     def adjust_timing(self):
+        self.load_history()
         self.list_actions()
         which_ix = input("Which action would you like to adjust timing for? " )
         try:
@@ -416,9 +1677,14 @@ class Journal:
             print("Was unable to convert {0} to an integer".format(which_ix))
             return
 
-        if ix<0 or ix>=len(self.actions):
+        offset = self.action_offset()
+        if ix<0 or ix>=offset+len(self.actions):
             print("Action #{0} is an invalid action".format(ix))
             return
+        if ix<offset:
+            print("Action #{0} is archived and can not be adjusted".format(ix))
+            return
+        ix = ix - offset
 
         time = input("By how much time would you like to adjust this action? (+=forward, -=negative, format=[[HH:]MM:]SS: ")
 
@@ -452,6 +1718,11 @@ class Journal:
             print("You are trying to adjust timing into the future. Operation cancelled.")
             return
 
+        # nor change the intervals of the archived months
+        if self.archive.reaches(min(self.actions[ix].ts, journal_storage.to_micros(new_dt))):
+            print("You are trying to adjust timing into the archived months. Operation cancelled.")
+            return
+
         # count the number of actions that will be displaced by this action
         still_counting = True
         displaced_counted = 0
@@ -466,11 +1737,8 @@ class Journal:
         # confirm
         confirm = input("You will displace {0} actions if you continue. Continue? (y/n) ".format(displaced_counted))
         if confirm=='y':
-            # update the given datetime
-            self.actions[ix].dt = new_dt
-
-            # sort remaining list by dt
-            self.actions.sort(key=lambda x: x.dt)
+            # update the given datetime, keeping the list sorted by dt
+            self.move_action(ix, new_dt)
 
             # reset cur_action and cur_action_key
             if len(self.actions)>0:
@@ -484,6 +1752,138 @@ class Journal:
             print("Operation cancelled.")
 
 
+def print_custom_report(data, task_str):
+    """
+    Print the time spent per task and per category in a ReportData, with
+    task_str(task) naming its tasks
+    """
+    report=[]
+    longest_task_name = len("Adding new tasks")
+
+    total_time = 0
+    for ix in sorted(data.task_times):
+        act_time = data.task_times[ix]
+        if act_time>0:
+            task_name = task_str(ix)
+            report.append((task_name,act_time))
+            total_time = total_time + act_time
+            if len(task_name)>longest_task_name:
+                longest_task_name=len(task_name)
+
+    if longest_task_name > 100:
+        longest_task_name = 100
+
+    def print_time(this_str, act_time):
+        print("{0}{1}{2} hours, {3} minutes, {4} seconds".format(this_str,
+            ' '*(longest_task_name-len(this_str)+2), int(act_time / 3600), int(act_time / 60) % 60, act_time % 60))
+
+    this_str = 'First action'
+    time = (data.first_action or datetime.datetime.now()).time().replace(microsecond=0)
+    print("{0}{1}{2}".format(this_str,
+        ' '*(longest_task_name-len(this_str)+2),
+        time.isoformat()))
+
+    for this_str, act_time in report:
+        print_time(this_str, act_time)
+
+    for this_str, action_type, working in [('In meetings', TASK_MEETING, True),
+                                           ('Adding new tasks', TASK_ADD_TASKS, True),
+                                           ('Walking', TASK_WALK, True),
+                                           ('Lunch', TASK_LUNCH, False)]:
+        act_time = data.category_time(action_type)
+        if act_time>0:
+            if working:
+                total_time = total_time + act_time
+            print_time(this_str, act_time)
+
+    if data.overtime > 0 and data.num_overtime > 0:
+        print_time('Overtime: ({0}) tasks'.format(data.num_overtime), data.overtime)
+
+    print("Total working time: {0} hours, {1} minutes, {2} seconds".format(int(total_time / 3600),
+        int(total_time / 60) % 60, total_time % 60))
+
+def calendar_window(num_days, today=None):
+    """
+    (first day, number of days) of the whole weeks, from Sunday, that
+    cover the last num_days days up to today
+    """
+    td = today or datetime.date.today()
+    num_days = ((((num_days+6)-1-(td.isoweekday() % 7))//7)*7)+1+(td.isoweekday() % 7)
+    #num_days = 21 + (td.isoweekday() % 7) + 1
+    return td - datetime.timedelta(days=num_days-1), num_days
+
+def print_calendar(first_day, matrix):
+    """
+    Print the day_matrix of the weeks from first_day as a calendar
+    """
+    num_days = len(matrix)
+    data=[]
+    days = ['SUNDAY', 'MONDAY', 'TUESDAY', 'WEDNESDAY', 'THURSDAY', 'FRIDAY', 'SATURDAY']
+
+    def print_str_13_chars(string, time):
+        time //= 60
+        if time > 60:
+            string += '{0}hr '.format(int(time/60))
+        string += '{0}min'.format(time%60)
+        sys.stdout.write(string)
+        sys.stdout.write(' '*(14-len(string)))
+
+    for i in range(num_days):
+        this_entry = {}
+        day = first_day + datetime.timedelta(days=i)
+        this_entry['day'] = day
+        this_entry['day_str'] = "{0} {1}".format(day.day, days[day.isoweekday() % 7])
+        this_entry['time_switch'], this_entry['time_walk'], this_entry['time_add'], this_entry['time_lunch'], this_entry['time_meet'] = matrix[i]
+        data.append(this_entry)
+
+    print('|-------------------------------------------------------------------------------------------------|')
+
+    it = 0
+    while it < len(data):
+        # loop through each day and print day string
+        for day in range(7):
+            if (it+day)<len(data):
+                day_str = data[it+day]['day_str']
+                sys.stdout.write("| {0}{1}".format(day_str, (12-len(day_str))*' '))
+        print('|')
+
+        # loop through each day and print hours worked
+        for day in range(7):
+            if (it+day)<len(data):
+                print_str_13_chars("| + ", data[it+day]['time_switch'])
+        print('|')
+
+        # loop through each day and print hours worked
+        for day in range(7):
+            if (it+day)<len(data):
+                print_str_13_chars("| W ", data[it+day]['time_walk'])
+        print('|')
+
+        # loop through each day and print hours worked
+        for day in range(7):
+            if (it+day)<len(data):
+                print_str_13_chars("| A ", data[it+day]['time_add'])
+        print('|')
+
+        # loop through each day and print hours worked
+        for day in range(7):
+            if (it+day)<len(data):
+                print_str_13_chars("| L ", data[it+day]['time_lunch'])
+        print('|')
+
+        # loop through each day and print hours worked
+        for day in range(7):
+            if (it+day)<len(data):
+                print_str_13_chars("| M ", data[it+day]['time_meet'])
+        print('|')
+
+        # print separator
+        sys.stdout.write('|_____________'*min(7, len(data)-it))
+        print('|')
+
+        # jump to next week
+        it += 7
+
 def add_task(journal, ans_char):
     name = input("Give a name for the new task {0}: ".format(len(journal.tasks)))
     if len(name)>0:
@@ -508,7 +1908,7 @@ def complete_query(journal, ans):
         else:
             done = input("Did you complete the task {0}? (y/n) ".format(journal.task_str(journal.cur_action_key)))
         if done.lower() == 'y':
-            journal.tasks[journal.cur_action_key].completed = True
+            journal.set_task_completed(journal.cur_action_key, True)
             journal.add_action(TASK_COMPLETED, journal.cur_action_key)
             print("Congratulations for completing task {0}!".format(journal.task_str(journal.cur_action_key)))
             difference = 60*journal.tasks[journal.cur_action_key].time - journal.count_time_in_action(TASK_SWITCH, journal.cur_action_key, None, None)
@@ -565,7 +1965,7 @@ def switch_task(journal, ans):
                     print("Nothing was changed.")
                     return
                 else:
-                    journal.tasks[task_id].completed = False
+                    journal.set_task_completed(task_id, False)
             journal.add_action(TASK_SWITCH, task_id)
             journal.cur_action = TASK_SWITCH
             journal.cur_action_key = task_id
@@ -629,7 +2029,7 @@ def display_current_action(journal):
         print("In a meeting. That's what the 14th commandment is all about!")
     elif journal.cur_action == TASK_PAUSE:
         print("Paused.")
-    act_time = journal.count_time_in_action(journal.cur_action, journal.cur_action_key)
+    act_time = journal.count_time_in_action(journal.cur_action, journal.cur_action_key, datetime.date.today(), 1)
 
     # only print total time if it's TASK SWITCH and it's different from today time
     if total_time==0 or act_time==total_time:
@@ -638,54 +2038,325 @@ def display_current_action(journal):
         print("Time spent working on current task today: {0} hours, {1} minutes, {2} seconds".format(int(act_time/3600), int(act_time/60)%60, act_time%60))
         print("Time spent working on current task total: {0} hours, {1} minutes, {2} seconds".format(int(total_time/3600), int(total_time/60)%60, total_time%60))
 
-def main():
-    journal = Journal()
-
-    running = True
-    while running:
-        ans = input(">>> ")
-        if len(ans)>0:
-            ans_char=ans[0]
-        else:
-            continue
-
-        if ans_char=='l':
-            journal.list_tasks()
-        elif ans_char=='j':
-            journal.list_actions()
-        elif ans_char=='t':
-            journal.today_report()
-        elif ans_char=='r':
-            journal.custom_report()
-        elif ans_char=='w' or ans_char=='p':
+# the first letters of the commands at the prompt
+command_letters = 'ljtrwpsacvdzxohqi'
+
+def run_command(journal, ans):
+    """
+    Run one command typed at the prompt, return False when it was (q)uit
+    """
+    ans_char=ans[0]
+    if ans_char=='l':
+        # l2 shows the second page
+        page = ''.join(x for x in ans if x in '1234567890')
+        journal.list_tasks(page=int(page) if page else None)
+    elif ans_char=='j':
+        journal.list_actions()
+    elif ans_char=='t':
+        journal.today_report()
+    elif ans_char=='r':
+        journal.custom_report()
+    elif ans_char=='w' or ans_char=='p':
+        with journal.batch():
             add_task(journal, ans_char)
             if 's' in ans:
                 switch_task(journal, 's{0}{1}'.format(ans_char, len(journal.tasks)-1))
-        elif ans_char=='s':
-            switch_task(journal, ans)
-        elif ans_char=='a':
+    elif ans_char=='s':
+        switch_task(journal, ans)
+    elif ans_char=='a':
+        with journal.batch():
             switch_add_tasks(journal, ans)
             if 'w' in ans or 'p' in ans:
                 add_task(journal, ans)
                 if 's' in ans:
                     ans = ans + str((len(journal.tasks)-1))
                     switch_task(journal, ans)
-        elif ans_char=='c':
-            display_current_action(journal)
-        elif ans_char=='v':
-            journal.remove_last_action(ans)
-        elif ans_char=='d':
-            journal.adjust_timing()
-        elif ans_char=='z':
-            switch_pause(journal, ans)
-        elif ans_char=='x':
-            journal.clear_data(ans)
-        elif ans_char=='h':
-            print("MENU: \ntask (l)ist\nadd (w)ork task\nadd (p)ersonal task\n(s)witch task\na(d)just timing\nremo(v)e last action\nprint (c)urrent action\nprint (t)oday's report\nprint (j)ournal\nprint custom (r)eport\npau(z)e\n(X) data\n(q)uit")
-        elif ans_char=='q':
-            switch_pause(journal, ans)
-            running = False
+    elif ans_char=='c':
+        display_current_action(journal)
+    elif ans_char=='v':
+        journal.remove_last_action(ans)
+    elif ans_char=='d':
+        journal.adjust_timing()
+    elif ans_char=='z':
+        switch_pause(journal, ans)
+    elif ans_char=='x':
+        journal.clear_data(ans)
+    elif ans_char=='o':
+        journal.compact()
+        print("Journal files compacted.")
+    elif ans_char=='h':
+        print("MENU: \ntask (l)ist, lN for page N\nadd (w)ork task\nadd (p)ersonal task\n(s)witch task\na(d)just timing\nremo(v)e last action\nprint (c)urrent action\nprint (t)oday's report\nprint (j)ournal\nprint custom (r)eport\npau(z)e\nc(o)mpact journal files\n(X) data\n(q)uit")
+    elif ans_char=='q':
+        switch_pause(journal, ans)
+        return False
+    elif ans_char=='i':
+        # not in the menu, the stats are only there with --stats
+        if journal.stats is None:
+            print("Instrumentation is off, start the journal with --stats to turn it on.")
+        else:
+            print('\n'.join(journal.stats.report()))
+    return True
+
+def dispatch(journal, ans):
+    """
+    Run a command in a batch, so that everything it changes is written at once
+    """
+    try:
+        with journal.batch():
+            running = run_command(journal, ans)
+    except journal_storage.JournalChanged as e:
+        print("Error: {0} while this command ran. It was not saved, please run it again.".format(e))
+        return True
+    # quitting and clearing wait for the writes to be done
+    if ans[0] in 'qx':
+        journal.storage.sync()
+    return running
+
+def parse_timestamp(text):
+    """
+    Parse "YYYY-MM-DD HH:MM[:SS[.ffffff]]" (or with a T), None if it is not one
+    """
+    for fmt in ['%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M']:
+        try:
+            return datetime.datetime.strptime(text.replace('T', ' '), fmt)
+        except ValueError:
+            pass
+    return None
+
+def parse_script_line(line):
+    """
+    Split a script line into (dt, command, answers)
+    A line is an optional timestamp, a command as typed at the prompt and the
+    answers to the questions it asks, separated by |, e.g.
+    2019-03-04 09:30 w | Write the report | 30
+    """
+    fields = [field.strip() for field in line.split('|')]
+    words = fields[0].split()
+    dt = None
+    for num_words in [2, 1]:
+        if len(words) > num_words:
+            dt = parse_timestamp(' '.join(words[:num_words]))
+            if dt is not None:
+                words = words[num_words:]
+                break
+    return dt, ' '.join(words), fields[1:]
+
+class ReplaySummary:
+    def __init__(self):
+        self.num_commands = 0
+        # command letter -> number of commands
+        self.commands = {}
+        self.num_actions = 0
+        self.num_tasks = 0
+        self.first_dt = None
+        self.last_dt = None
+        self.seconds = 0
+
+    def __str__(self):
+        commands = ', '.join('{0} {1}'.format(self.commands[letter], letter) for letter in sorted(self.commands))
+        summary = "Replayed {0} commands ({1}) adding {2} actions and {3} tasks in {4:.2f} seconds.".format(
+            self.num_commands, commands, self.num_actions, self.num_tasks, self.seconds)
+        if self.first_dt is not None:
+            summary += "\nThe actions run from {0} to {1}.".format(self.first_dt, self.last_dt)
+        return summary
+
+@contextlib.contextmanager
+def scripted_input():
+    """
+    Answer the questions of the commands from the list this yields instead of
+    the keyboard, raising ValueError when it runs out
+    """
+    global input
+    prompt_input = input
+    answers = []
+    def script_input(prompt):
+        if len(answers) == 0:
+            raise ValueError("no answer given to '{0}'".format(prompt.strip()))
+        return answers.pop(0)
+    input = script_input
+    try:
+        yield answers
+    finally:
+        input = prompt_input
+
+def replay(journal, lines, echo=False):
+    """
+    Run script lines through the same handlers as the prompt, all in a single
+    batch, and return a ReplaySummary
+    Questions are answered from the line instead of the keyboard. If a line
+    fails, a ValueError naming it is raised and nothing is applied.
+    """
+    summary = ReplaySummary()
+    num_actions = journal.action_offset() + len(journal.actions)
+    num_tasks = len(journal.tasks)
+    last_dt = journal.actions[-1].dt if len(journal.actions) > 0 else None
+    start = datetime.datetime.now()
+    saved_stdout = sys.stdout
+    try:
+        if not echo:
+            sys.stdout = open(os.devnull, 'w')
+        with scripted_input() as answers, journal.batch():
+            for line_number, line in enumerate(lines, 1):
+                line = line.strip()
+                if len(line) == 0 or line.startswith('#'):
+                    continue
+                dt, command, line_answers = parse_script_line(line)
+                answers[:] = line_answers
+                if len(command) == 0 or command[0] not in command_letters:
+                    raise ValueError("line {0}: unknown command '{1}'".format(line_number, command))
+                if dt is not None and last_dt is not None and dt < last_dt:
+                    raise ValueError("line {0}: {1} is before the last action at {2}".format(line_number, dt, last_dt))
+
+                journal.clock = dt
+                try:
+                    running = run_command(journal, command)
+                except Exception as e:
+                    raise ValueError("line {0}: {1}".format(line_number, e))
+                if len(answers) > 0:
+                    raise ValueError("line {0}: unused answers {1}".format(line_number, ', '.join(answers)))
+
+                summary.num_commands = summary.num_commands + 1
+                summary.commands[command[0]] = summary.commands.get(command[0], 0) + 1
+                total_actions = journal.action_offset() + len(journal.actions)
+                if total_actions > num_actions:
+                    last_dt = journal.actions[-1].dt
+                    summary.num_actions = summary.num_actions + total_actions - num_actions
+                    summary.first_dt = summary.first_dt or journal.actions[num_actions - journal.action_offset()].dt
+                    summary.last_dt = last_dt
+                num_actions = total_actions
+                if not running:
+                    break
+    finally:
+        journal.clock = None
+        if sys.stdout is not saved_stdout:
+            sys.stdout.close()
+            sys.stdout = saved_stdout
+
+    summary.num_tasks = len(journal.tasks) - num_tasks
+    summary.seconds = (datetime.datetime.now() - start).total_seconds()
+    return summary
+
+def migrate_to_sqlite(directory, db_path):
+    """
+    Copy the text journal in directory into a new SQLite journal at db_path
+    """
+    text = journal_storage.TextStorage(directory)
+    storage = journal_storage.SqliteStorage(db_path)
+    if storage.count > 0 or len(storage.read_tasks()) > 0:
+        storage.close()
+        raise ValueError("{0} already holds a journal".format(db_path))
+
+    with storage.transaction():
+        for task_id, (name, time, task_type, completed) in enumerate(text.read_tasks()):
+            storage.append_task(task_id, Task(name, time, task_type, completed))
+        for action, task_id, dt in text.read_actions():
+            storage.append_action(Action(action, task_id, dt))
+        SqliteIndex(storage).build(StoredActions(storage))
+    return storage
+
+def migrate_to_binary(directory):
+    """
+    Copy journal_actions.txt in directory into journal_actions.bin, the task
+    file is shared by both storages
+    """
+    storage = journal_storage.BinaryStorage(directory)
+    if storage.count > 0:
+        storage.close()
+        raise ValueError("{0} already holds actions".format(storage.actions_path))
+    storage.write_actions(journal_storage.TextStorage(directory).read_actions())
+    return storage
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Keep a journal of the time spent on tasks.")
+    parser.add_argument('--db', help="keep the journal in this SQLite database instead of the text files")
+    parser.add_argument('--binary', action='store_true', help="keep the actions in the binary journal_actions.bin instead of journal_actions.txt")
+    parser.add_argument('--migrate', action='store_true', help="copy the text files in the current directory into the new --db or --binary journal first")
+    parser.add_argument('--script', help="run the commands in this file (- for stdin) instead of prompting, one per line as [YYYY-MM-DD HH:MM[:SS]] COMMAND [| ANSWER]...")
+    parser.add_argument('--echo', action='store_true', help="show the output of the --script commands")
+    parser.add_argument('--background', action='store_true', help="write the text journal from a background thread")
+    parser.add_argument('--stats', action='store_true', help="time the commands and journal operations and count the bytes read and written, shown by the i command")
+    parser.add_argument('--stats-file', help="like --stats, and write the stats to this JSON file when quitting")
+    parser.add_argument('--cache-mb', type=float, default=64, help="memory for the archived months that reports page in, in MB")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    storage = None
+    if args.db:
+        if args.migrate:
+            try:
+                storage = migrate_to_sqlite('.', args.db)
+            except ValueError as e:
+                print("Error: {0}. Nothing was migrated.".format(e))
+                return
+            print("Migrated {0} tasks and {1} actions into {2}.".format(len(storage.read_tasks()), storage.count, args.db))
+        else:
+            storage = journal_storage.SqliteStorage(args.db)
+    elif args.binary:
+        if args.migrate:
+            try:
+                storage = migrate_to_binary('.')
+            except ValueError as e:
+                print("Error: {0}. Nothing was migrated.".format(e))
+                return
+            print("Migrated {0} actions into {1}.".format(storage.count, storage.actions_path))
+        else:
+            storage = journal_storage.BinaryStorage('.')
+    storage = storage if storage is not None else journal_storage.TextStorage()
+    if args.background:
+        if args.db:
+            print("Error: --background does not work with --db, SQLite writes in its own transactions.")
+            return
+        if args.binary:
+            print("Error: --background does not work with --binary, the actions are written in place.")
+            return
+        storage.start_writer()
+
+    stats = None
+    if args.stats or args.stats_file:
+        stats = journal_stats.Stats()
+        storage.stats = stats
+
+    if args.script:
+        journal = Journal(storage, start=False, cache_bytes=int(args.cache_mb*1024*1024))
+        if stats is not None:
+            stats.instrument(journal)
+        script = sys.stdin if args.script == '-' else open(args.script, 'r')
+        try:
+            print(replay(journal, script, args.echo))
+        except ValueError as e:
+            print("Error: {0}. Nothing was changed.".format(e))
+        finally:
+            if script is not sys.stdin:
+                script.close()
+            journal.close()
+            if args.stats_file:
+                stats.dump(args.stats_file)
+        return
+
+    run = dispatch
+    if stats is not None:
+        with stats.timed('startup'):
+            journal = Journal(storage, cache_bytes=int(args.cache_mb*1024*1024))
+        stats.instrument(journal)
+        run = stats.wrap_command(dispatch)
+    else:
+        journal = Journal(storage, cache_bytes=int(args.cache_mb*1024*1024))
+
+    running = True
+    while running:
+        for error in storage.write_errors():
+            print("Error: {0}. The journal files may be missing changes.".format(error))
+        for error in storage.read_errors():
+            print("Error: {0}. The line was skipped.".format(error))
+        ans = input(">>> ")
+        if len(ans)==0:
+            continue
+        running = run(journal, ans)
         print('')
+    journal.close()
+    if args.stats_file:
+        stats.dump(args.stats_file)
 
 if __name__ == '__main__':
     main()
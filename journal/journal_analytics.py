@@ -0,0 +1,158 @@
+#!/usr/bin/python
+"""
+NumPy backend for reports over long histories
+
+ActionArrays holds the actions of an interval index as arrays: the action
+codes, the task ids and the starts in microseconds since the epoch. The end of every action,
+the start of the next timed action, is found for all of them at once with a
+searchsorted, and the reports are grouped sums over the durations instead
+of a loop over the actions.
+
+NumPy is optional. Without it available() is false and the journal reports
+with its own loops.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MICROS_PER_SECOND = 1000000
+SECONDS_PER_DAY = 86400
+MICROS_PER_DAY = SECONDS_PER_DAY*MICROS_PER_SECOND
+
+def available():
+    return numpy is not None
+
+class ActionArrays:
+    """
+    The actions of an interval index as arrays, kept in step with it: only
+    the actions appended since the last update are converted, anything else
+    that changes the index converts them all again
+    """
+    def __init__(self, timed_codes):
+        self.timed_codes = timed_codes
+        self.index = None
+        self.rewrites = None
+        self.clear()
+
+    def clear(self):
+        self.codes = numpy.zeros(0, dtype=numpy.int8)
+        self.task_ids = numpy.zeros(0, dtype=numpy.int64)
+        self.starts = numpy.zeros(0, dtype=numpy.int64)
+        self.timed = numpy.zeros(0, dtype=bool)
+
+    def update(self, index):
+        if index is not self.index or index.rewrites != self.rewrites:
+            self.clear()
+            self.index = index
+            self.rewrites = index.rewrites
+        count = len(self.codes)
+        if len(index.starts) > count:
+            keys = index.keys[count:]
+            codes = numpy.array([action_keys[0][0] for action_keys in keys], dtype=numpy.int8)
+            self.codes = numpy.concatenate([self.codes, codes])
+            self.task_ids = numpy.concatenate([self.task_ids, numpy.array([action_keys[-1][1] for action_keys in keys], dtype=numpy.int64)])
+            self.starts = numpy.concatenate([self.starts, numpy.frombuffer(index.starts[count:], dtype=numpy.int64)])
+            self.timed = numpy.concatenate([self.timed, numpy.isin(codes, self.timed_codes)])
+        return self
+
+    def intervals(self, first, last, now):
+        """
+        (codes, task_ids, starts, ends) of the actions at positions
+        [first, last), the actions after the last timed action end now
+        """
+        # only the timed actions from first on can end these
+        timed_positions = first + numpy.flatnonzero(self.timed[first:])
+        following = numpy.searchsorted(timed_positions, numpy.arange(first, last), side='right')
+        ends = numpy.full(last-first, now, dtype=numpy.int64)
+        closed = following < len(timed_positions)
+        ends[closed] = self.starts[timed_positions[following[closed]]]
+        return self.codes[first:last], self.task_ids[first:last], self.starts[first:last], ends
+
+    def report(self, first, last, lo, hi, now, task_code, num_tasks):
+        """
+        The first start, the seconds per action code and the seconds per task
+        of the task_code actions, for the actions at [first, last) that start
+        in [lo, hi)
+        """
+        codes, task_ids, starts, ends = self.intervals(first, last, now)
+        selected = numpy.ones(len(codes), dtype=bool)
+        if lo is not None:
+            selected &= starts >= lo
+        if hi is not None:
+            selected &= starts < hi
+        codes, task_ids, starts, seconds = codes[selected], task_ids[selected], starts[selected], seconds_between(starts[selected], ends[selected])
+        if len(codes) == 0:
+            return None, {}, {}
+        category_times = grouped_sums(codes, seconds)
+        on_task = (codes == task_code) & (task_ids >= 0) & (task_ids < num_tasks)
+        task_times = grouped_sums(task_ids[on_task], seconds[on_task])
+        return int(starts.min()), category_times, task_times
+
+    def day_matrix(self, first, last, lo, num_days, categories, now):
+        """
+        Seconds spent in each of the categories on each of num_days days from
+        midnight lo for the actions at [first, last), as matrix[day][category]
+        """
+        codes, task_ids, starts, ends = self.intervals(first, last, now)
+        hi = lo + num_days*MICROS_PER_DAY
+        matrix = numpy.zeros((num_days, len(categories)), dtype=numpy.int64)
+        for col, code in enumerate(categories):
+            selected = codes == code
+            start = numpy.maximum(starts[selected], lo) - lo
+            end = numpy.minimum(ends[selected], hi) - lo
+            running = start < end
+            add_day_pieces(matrix[:, col], start[running], end[running])
+        return matrix.tolist()
+
+def seconds_between(starts, ends):
+    """
+    Whole seconds from starts to ends, like journal.seconds_between
+    """
+    return (ends - starts) // MICROS_PER_SECOND
+
+def grouped_sums(keys, values):
+    """
+    {key: sum of its values} for the keys that occur
+    """
+    if len(keys) == 0:
+        return {}
+    unique_keys, groups = numpy.unique(keys, return_inverse=True)
+    sums = numpy.zeros(len(unique_keys), dtype=numpy.int64)
+    numpy.add.at(sums, groups, values)
+    return dict(zip(unique_keys.tolist(), sums.tolist()))
+
+def add_day_pieces(column, start, end):
+    """
+    Add the whole seconds of the intervals [start, end), in microseconds
+    from the first midnight, to the days of column they fall on
+    An interval that crosses midnight is cut there, like the calendar does.
+    """
+    first_day = start // MICROS_PER_DAY
+    last_day = (end-1) // MICROS_PER_DAY
+    one_day = first_day == last_day
+    numpy.add.at(column, first_day[one_day], (end[one_day] - start[one_day]) // MICROS_PER_SECOND)
+
+    first_day, last_day, start, end = first_day[~one_day], last_day[~one_day], start[~one_day], end[~one_day]
+    numpy.add.at(column, first_day, ((first_day+1)*MICROS_PER_DAY - start) // MICROS_PER_SECOND)
+    numpy.add.at(column, last_day, (end - last_day*MICROS_PER_DAY) // MICROS_PER_SECOND)
+    # the days in between are spent whole
+    steps = numpy.zeros(len(column)+1, dtype=numpy.int64)
+    numpy.add.at(steps, first_day+1, 1)
+    numpy.add.at(steps, last_day, -1)
+    column += numpy.cumsum(steps[:-1])*SECONDS_PER_DAY
+
+def overtime(task_seconds, total_seconds, expected_seconds):
+    """
+    (number of tasks that went overtime, seconds overspent) for tasks that
+    took task_seconds in the report, total_seconds in all and were expected
+    to take expected_seconds
+    """
+    task_seconds = numpy.asarray(task_seconds, dtype=numpy.int64)
+    total_seconds = numpy.asarray(total_seconds, dtype=numpy.int64)
+    expected_seconds = numpy.asarray(expected_seconds, dtype=numpy.int64)
+    # only what is left of the expected time after the work outside the report
+    adjusted = numpy.maximum(expected_seconds - (total_seconds - task_seconds), 0)
+    over = (total_seconds > expected_seconds) & (task_seconds > adjusted)
+    return int(over.sum()), int((task_seconds - adjusted)[over].sum())
@@ -0,0 +1,267 @@
+#!/usr/bin/python
+"""
+Benchmarks for the journal
+
+generate_history makes a deterministic, realistic journal of several years of
+workdays, and run_benchmarks times the common operations on it.
+measure_memory tells what the journal takes in memory once all of it is
+loaded. The results are JSON, so that runs from different commits can be
+compared with --compare.
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import journal
+import journal_analytics
+import journal_storage
+
+def generate_history(years=3, num_tasks=1500, actions_per_day=16, meeting_share=0.1, walk_share=0.1, lunch_share=0.8, seed=0, end=None):
+    """
+    Return (tasks, actions) for the workdays of the given number of years
+    before end (default today)
+    Every day starts by adding tasks, then switches between the open tasks,
+    meetings and walks, has lunch on lunch_share of the days and ends with a
+    pause. The same arguments always give the same history.
+    """
+    rand = random.Random(seed)
+    end = end or datetime.date.today()
+    days = [end - datetime.timedelta(days=num_days) for num_days in range(int(years*365), 0, -1)]
+    workdays = [day for day in days if day.weekday() < 5]
+    tasks_per_day = float(num_tasks) / max(len(workdays), 1)
+
+    tasks = []
+    actions = []
+    open_tasks = []
+    for day_ix, day in enumerate(workdays):
+        dt = datetime.datetime.combine(day, datetime.time(8)) + datetime.timedelta(minutes=rand.randint(0, 60))
+        day_end = datetime.datetime.combine(day, datetime.time(18))
+        lunch = rand.random() < lunch_share
+
+        def add(action, task_id=-1):
+            actions.append(journal.Action(action, task_id, dt))
+
+        # start the day by adding the tasks that came in
+        add(journal.TASK_ADD_TASKS)
+        while len(tasks) < int(round(tasks_per_day*(day_ix+1))) or len(open_tasks) == 0:
+            task_type = journal.TASK_WORK_TYPE if rand.random() < 0.85 else journal.TASK_PERS_TYPE
+            tasks.append(journal.Task('task{0}'.format(len(tasks)), rand.choice([15, 30, 60, 120, 240]), task_type))
+            open_tasks.append(len(tasks)-1)
+            dt = dt + datetime.timedelta(seconds=rand.randint(10, 120))
+            add(journal.TASK_NEW, len(tasks)-1)
+
+        num_actions = 0
+        while num_actions < actions_per_day and dt < day_end:
+            choice = rand.random()
+            if lunch and dt.hour >= 12:
+                lunch = False
+                add(journal.TASK_LUNCH)
+                dt = dt + datetime.timedelta(minutes=rand.randint(30, 60))
+            elif choice < meeting_share:
+                add(journal.TASK_MEETING)
+                dt = dt + datetime.timedelta(minutes=rand.randint(30, 90))
+            elif choice < meeting_share + walk_share:
+                add(journal.TASK_WALK)
+                dt = dt + datetime.timedelta(minutes=rand.randint(5, 20))
+            elif len(open_tasks) > 0:
+                task_id = rand.choice(open_tasks)
+                add(journal.TASK_SWITCH, task_id)
+                dt = dt + datetime.timedelta(minutes=rand.randint(10, 90), seconds=rand.randint(0, 59))
+                # the last open task stays open until new tasks come in
+                if rand.random() < 0.3 and len(open_tasks) > 1:
+                    add(journal.TASK_COMPLETED, task_id)
+                    tasks[task_id].completed = True
+                    open_tasks.remove(task_id)
+                    num_actions = num_actions + 1
+            num_actions = num_actions + 1
+        add(journal.TASK_PAUSE)
+    return tasks, actions
+
+def write_history(directory, tasks, actions, storage='text'):
+    """
+    Write a generated history into directory as a text, binary or sqlite journal
+    """
+    journal_storage.TextStorage(directory).rewrite(tasks, actions)
+    if storage == 'sqlite':
+        journal.migrate_to_sqlite(directory, os.path.join(directory, 'journal.db')).close()
+    elif storage == 'binary':
+        journal.migrate_to_binary(directory).close()
+
+@contextlib.contextmanager
+def quiet(answer):
+    """
+    Answer every question with answer and hide what is printed
+    """
+    saved_input = journal.input
+    saved_stdout = sys.stdout
+    journal.input = lambda prompt: answer
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = saved_stdout
+        journal.input = saved_input
+
+def add_actions(j, num_actions=100):
+    for ix in range(num_actions):
+        if ix % 2 == 0:
+            j.add_action(journal.TASK_SWITCH, len(j.tasks)-1)
+        else:
+            j.add_action(journal.TASK_WALK)
+
+def scan_actions(j):
+    """
+    Go over every action once, like the reports without an index do
+    """
+    j.load_history()
+    total = 0
+    for action in j.actions:
+        if action.task_id >= 0:
+            total = total + action.ts
+    return total
+
+# (name, what to time, answer to the questions it asks), in the order they
+# run; add_action comes last because it changes the journal
+scenarios = [
+    ('read_from_file', lambda j: j.reload(), ''),
+    ('today_report', lambda j: j.today_report(), ''),
+    ('calendar_report', lambda j: j.calendar_report(28), ''),
+    ('year_report', lambda j: j.make_custom_report(datetime.date.today() - datetime.timedelta(days=365), 365), ''),
+    ('year_calendar', lambda j: j.calendar_report(365), ''),
+    ('list_actions', lambda j: j.list_actions(), '100'),
+    ('count_overtime', lambda j: j.count_overtime(None, None), ''),
+    ('scan_actions', scan_actions, ''),
+    ('add_action', add_actions, ''),
+]
+
+def time_scenario(j, function, answer, repeat):
+    times = []
+    for ix in range(repeat):
+        with quiet(answer):
+            start = timeit.default_timer()
+            function(j)
+            times.append(timeit.default_timer() - start)
+    times.sort()
+    return {'repeat': repeat,
+            'best': times[0],
+            'median': times[len(times)//2],
+            'mean': sum(times)/len(times)}
+
+def run_benchmarks(directory, storage='text', repeat=5, names=None, use_numpy=True, segments=False):
+    """
+    Time the scenarios on the journal in directory, return them by name
+    With segments, the months before the current one are archived first.
+    """
+    results = {}
+    j = journal.Journal(journal_storage.open_storage(directory, storage))
+    j.use_numpy = use_numpy
+    if segments:
+        j.rotate()
+    try:
+        for name, function, answer in scenarios:
+            if names is None or name in names:
+                results[name] = time_scenario(j, function, answer, repeat)
+    finally:
+        j.storage.close()
+    return results
+
+def measure_memory(directory, storage='text'):
+    """
+    Bytes allocated by a journal with its whole history loaded, and by each
+    of its actions on average
+    """
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        j = journal.Journal(journal_storage.open_storage(directory, storage), start=False)
+        j.load_history()
+        j.interval_index()
+        used = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    j.storage.close()
+    return {'journal_bytes': used, 'bytes_per_action': used // max(len(j.actions), 1)}
+
+def compare(old, new):
+    """
+    Lines comparing the best times of two benchmark results
+    """
+    lines = ['{0:<16}{1:>12}{2:>12}{3:>9}'.format('SCENARIO', 'OLD (ms)', 'NEW (ms)', 'RATIO')]
+    for name in sorted(new['results']):
+        if name in old['results']:
+            old_best = old['results'][name]['best']
+            new_best = new['results'][name]['best']
+            lines.append('{0:<16}{1:>12.3f}{2:>12.3f}{3:>9.2f}'.format(name, 1000*old_best, 1000*new_best, new_best/old_best if old_best else 0))
+    return lines
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Time journal operations on a generated history.")
+    parser.add_argument('--years', type=float, default=3, help="years of history to generate")
+    parser.add_argument('--tasks', type=int, default=1500, help="number of tasks in the history")
+    parser.add_argument('--actions-per-day', type=int, default=16, help="actions on a workday, besides adding tasks")
+    parser.add_argument('--meetings', type=float, default=0.1, help="share of the actions that are meetings")
+    parser.add_argument('--walks', type=float, default=0.1, help="share of the actions that are walks")
+    parser.add_argument('--lunch', type=float, default=0.8, help="share of the days with a lunch break")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--storage', choices=['text', 'binary', 'sqlite'], default='text')
+    parser.add_argument('--no-numpy', action='store_true', help="report without the NumPy backend even if it is installed")
+    parser.add_argument('--segments', action='store_true', help="archive the months before the current one as segments first")
+    parser.add_argument('--repeat', type=int, default=5, help="times to run every scenario")
+    parser.add_argument('--scenario', action='append', help="only run this scenario, may be given more than once")
+    parser.add_argument('--output', help="write the JSON results to this file instead of stdout")
+    parser.add_argument('--compare', help="also compare the results with an earlier JSON result file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {'years': args.years,
+              'tasks': args.tasks,
+              'actions_per_day': args.actions_per_day,
+              'meetings': args.meetings,
+              'walks': args.walks,
+              'lunch': args.lunch,
+              'seed': args.seed}
+    tasks, actions = generate_history(args.years, args.tasks, args.actions_per_day, args.meetings, args.walks, args.lunch, args.seed)
+
+    directory = tempfile.mkdtemp()
+    try:
+        write_history(directory, tasks, actions, args.storage)
+        memory = measure_memory(directory, args.storage)
+        results = run_benchmarks(directory, args.storage, args.repeat, args.scenario, not args.no_numpy, args.segments)
+    finally:
+        shutil.rmtree(directory)
+
+    report = {'python': platform.python_version(),
+              'storage': args.storage,
+              'numpy': journal_analytics.available() and not args.no_numpy,
+              'segments': args.segments,
+              'params': params,
+              'num_tasks': len(tasks),
+              'num_actions': len(actions),
+              'memory': memory,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        for line in compare(old, report):
+            sys.stderr.write(line + '\n')
+
+if __name__ == '__main__':
+    main()
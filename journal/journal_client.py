@@ -0,0 +1,66 @@
+#!/usr/bin/python
+"""
+A thin client for the journal daemon
+
+It only sends a request to journal_daemon over its socket and prints the
+answer, so it starts without reading the journal. For example
+
+    journal_client.py sw3 y
+    journal_client.py --json '{"op": "current"}'
+
+runs the s command with the answer y, and asks for the current action.
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+def request(message, path='journal.sock'):
+    """
+    Send a request to the daemon on the socket at path, return its response
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        f = sock.makefile('rb')
+        line = f.readline()
+        f.close()
+    finally:
+        sock.close()
+    if not line:
+        raise IOError("the journal daemon closed the connection")
+    return json.loads(line.decode('utf-8'))
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Run a journal command on the journal daemon.")
+    parser.add_argument('--socket', default='journal.sock', help="path of the daemon socket")
+    parser.add_argument('--json', help="send this JSON request instead of a command")
+    parser.add_argument('command', nargs='?', help="the command, as typed at the journal prompt")
+    parser.add_argument('answers', nargs='*', help="the answers to the questions the command asks")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.json:
+        message = json.loads(args.json)
+    elif args.command:
+        message = {'op': 'command', 'command': args.command, 'answers': args.answers}
+    else:
+        message = {'op': 'current'}
+    try:
+        response = request(message, args.socket)
+    except (IOError, socket.error) as e:
+        print("Error: could not reach the journal daemon on {0}: {1}".format(args.socket, e))
+        return 2
+    sys.stdout.write(response.get('output', ''))
+    if args.json:
+        print(json.dumps(response, indent=2, sort_keys=True))
+    if not response['ok']:
+        print("Error: {0}.".format(response['error']))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+"""
+The journal as a long-running service
+
+serve() keeps one Journal in memory and answers clients on a Unix domain
+socket, so that a client never reads the journal files itself. Every request
+is a JSON object on one line and gets a JSON object on one line back:
+
+    {"op": "command", "command": "sw3", "answers": ["y"]}
+    {"op": "switch", "action": "w", "task_id": 3, "completed": true}
+    {"op": "add_task", "name": "Write report", "minutes": 30, "type": "work", "switch": true}
+    {"op": "report"} or {"op": "report", "days": 7, "kind": "calendar"}
+    {"op": "current"}
+    {"op": "stop"}
+
+Responses have "ok", the printed "output" of the command and, if ok is
+false, the "error". The requests run through the same handlers as the
+prompt, one at a time, so the journal never sees two commands at once.
+Needs Python 3.
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import io
+import json
+import os
+import signal
+import socket
+
+import journal
+import journal_storage
+
+# the letters of the switch request, as in the s command
+switch_actions = 'wpmkla'
+
+def command_for(j, request):
+    """
+    The prompt command and the answers to its questions for a request
+    """
+    op = request.get('op')
+    if op == 'command':
+        command = request.get('command', '')
+        if len(command) == 0 or command[0] not in journal.command_letters:
+            raise ValueError("unknown command '{0}'".format(command))
+        if command[0] == 'q':
+            raise ValueError("the daemon does not quit, pause with z or send stop")
+        return command, [str(answer) for answer in request.get('answers', [])]
+    elif op == 'switch':
+        action = request.get('action', '')
+        if len(action) != 1 or action not in switch_actions:
+            raise ValueError("unknown action '{0}', use one of {1}".format(action, switch_actions))
+        command = 's' + action
+        if action in 'wp':
+            command = command + str(int(request['task_id']))
+        # only asked if a task is being worked on
+        if 'completed' in request:
+            command = command + ('y' if request['completed'] else 'n')
+        answers = []
+        if 'uncomplete' in request:
+            answers.append('y' if request['uncomplete'] else 'n')
+        return command, answers
+    elif op == 'add_task':
+        command = 'p' if request.get('type') == 'personal' else 'w'
+        answers = [request['name'], str(int(request['minutes']))]
+        if request.get('switch'):
+            command = command + 's'
+            if j.cur_action == journal.TASK_SWITCH and 'completed' in request:
+                answers.append('y' if request['completed'] else 'n')
+        return command, answers
+    elif op == 'report':
+        if 'days' not in request:
+            return 't', []
+        return 'r', [str(int(request['days'])), 'c' if request.get('kind') == 'calendar' else 't']
+    elif op == 'current':
+        return 'c', []
+    raise ValueError("unknown op '{0}'".format(op))
+
+# the tasks of a DryRun, which unlike journal.Task do not touch the caches
+DryTask = collections.namedtuple('DryTask', ['name', 'time', 'task_type', 'completed'])
+
+class DryRun(journal.Journal):
+    """
+    A journal that reads the tasks and actions of j but keeps what a command
+    changes to itself, and writes and reports nothing, so that a command can
+    be run against it to see which questions it asks
+    """
+    def __init__(self, j):
+        self.__dict__.update(j.__dict__)
+        self.shared_tasks = j.tasks
+
+    def own_tasks(self):
+        if self.tasks is self.shared_tasks:
+            self.tasks = list(self.tasks)
+
+    @contextlib.contextmanager
+    def batch(self):
+        yield self
+
+    def add_task(self, name, num_minutes, task_type):
+        self.own_tasks()
+        self.tasks.append(DryTask(name, num_minutes, task_type, False))
+        return len(self.tasks)-1
+
+    def set_task_completed(self, task_id, completed):
+        self.own_tasks()
+        task = self.tasks[task_id]
+        self.tasks[task_id] = DryTask(task.name, task.time, task.task_type, completed)
+
+    def add_action(self, action, task_id=-1):
+        pass
+
+    def pop_action(self):
+        pass
+
+    def move_action(self, ix, new_dt):
+        pass
+
+    def clear(self):
+        pass
+
+    def compact(self):
+        pass
+
+    def list_tasks(self, task_type=None, page=None, page_size=20):
+        pass
+
+    def today_report(self):
+        pass
+
+    def make_custom_report(self, day_start, num_days):
+        pass
+
+    def calendar_report(self, num_days):
+        pass
+
+def num_questions(j, command, answers):
+    """
+    How many questions command asks in the current state of the journal
+    when given answers, and empty answers past them, so that a request short
+    of answers can be turned down before it changes anything
+    The command is run against a DryRun of j to find out.
+    """
+    asked = []
+    def recording_input(prompt):
+        asked.append(prompt)
+        return answers[len(asked)-1] if len(asked) <= len(answers) else ''
+    prompt_input = journal.input
+    journal.input = recording_input
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            journal.run_command(DryRun(j), command)
+    finally:
+        journal.input = prompt_input
+    return len(asked)
+
+def current_action(j):
+    """
+    The current action and the seconds spent in it, as the c command shows it
+    """
+    current = {'action': journal.action_codes[j.cur_action],
+               'task_id': j.cur_action_key,
+               'task': None,
+               'today': j.count_time_in_action(j.cur_action, j.cur_action_key, datetime.date.today(), 1)}
+    if j.cur_action == journal.TASK_SWITCH:
+        current['task'] = j.task_str(j.cur_action_key)
+        current['total'] = j.count_time_in_action(j.cur_action, j.cur_action_key, None, None)
+    return current
+
+def handle(j, request):
+    """
+    Run a request on the journal j and return the response
+    """
+    output = io.StringIO()
+    try:
+        if not isinstance(request, dict):
+            raise ValueError("a request must be a JSON object")
+        command, answers = command_for(j, request)
+        needed = num_questions(j, command, answers)
+        if len(answers) < needed:
+            raise ValueError("'{0}' asks {1} questions but {2} answers were given".format(command, needed, len(answers)))
+        with journal.scripted_input() as script_answers, contextlib.redirect_stdout(output):
+            for error in j.storage.write_errors():
+                print("Error: {0}. The journal files may be missing changes.".format(error))
+            for error in j.storage.read_errors():
+                print("Error: {0}. The line was skipped.".format(error))
+            script_answers[:] = answers
+            journal.dispatch(j, command)
+        response = {'ok': True, 'output': output.getvalue()}
+        if request['op'] == 'current':
+            response['current'] = current_action(j)
+        return response
+    except (ValueError, KeyError, TypeError) as e:
+        return {'ok': False, 'error': str(e), 'output': output.getvalue()}
+    except Exception as e:
+        # a failing command is rolled back by its batch, the daemon goes on
+        return {'ok': False, 'error': "{0}: {1}".format(type(e).__name__, e), 'output': output.getvalue()}
+
+class JournalServer:
+    # connections waiting to be accepted, enough for bursts of short clients
+    backlog = 1024
+
+    def __init__(self, j, path):
+        self.journal = j
+        self.path = path
+        self.server = None
+        self.stopped = None
+        self.num_requests = 0
+
+    def respond(self, line):
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError as e:
+            return {'ok': False, 'error': "not a JSON request: {0}".format(e)}
+        self.num_requests = self.num_requests + 1
+        if isinstance(request, dict) and request.get('op') == 'stop':
+            self.stopped.set()
+            return {'ok': True, 'output': "Stopping the journal daemon.\n"}
+        # runs without yielding to the loop, so requests never interleave
+        return handle(self.journal, request)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write((json.dumps(self.respond(line)) + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # the client went away, or the daemon is stopping
+            pass
+        finally:
+            writer.close()
+
+    async def run(self):
+        if is_running(self.path):
+            raise ValueError("a journal daemon is already listening on {0}".format(self.path))
+        if os.path.exists(self.path):
+            # left behind by a daemon that did not stop cleanly
+            os.remove(self.path)
+        self.stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(signum, self.stopped.set)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path, backlog=self.backlog)
+        try:
+            await self.stopped.wait()
+        finally:
+            self.server.close()
+            for signum in [signal.SIGINT, signal.SIGTERM]:
+                loop.remove_signal_handler(signum)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+def is_running(path):
+    """
+    Whether a daemon is listening on the socket at path
+    """
+    if not os.path.exists(path):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+def serve(j, path='journal.sock'):
+    """
+    Answer requests for the journal j on the socket at path until a stop
+    request or a signal, then close the journal
+    """
+    try:
+        asyncio.run(JournalServer(j, path).run())
+    finally:
+        j.close()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Serve the journal in the current directory on a Unix domain socket.")
+    parser.add_argument('--socket', default='journal.sock', help="path of the socket to listen on")
+    parser.add_argument('--db', help="serve the journal in this SQLite database instead of the text files")
+    parser.add_argument('--binary', action='store_true', help="serve the binary journal_actions.bin instead of journal_actions.txt")
+    parser.add_argument('--background', action='store_true', help="write the text or binary journal from a background thread")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if is_running(args.socket):
+        print("Error: a journal daemon is already listening on {0}.".format(args.socket))
+        return
+    if args.db:
+        if args.background:
+            print("Error: --background does not work with --db, SQLite writes in its own transactions.")
+            return
+        storage = journal_storage.SqliteStorage(args.db)
+    elif args.binary:
+        storage = journal_storage.BinaryStorage('.')
+    else:
+        storage = journal_storage.TextStorage()
+    if args.background:
+        storage.start_writer()
+    try:
+        serve(journal.Journal(storage), args.socket)
+    except ValueError as e:
+        print("Error: {0}.".format(e))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+"""
+Opt-in instrumentation for the journal
+
+A Stats object records the wall time and number of calls of named
+operations, and the bytes the storage reads and writes. Nothing is measured
+until instrument() wraps the methods of a journal, so a journal without
+stats runs the plain methods.
+"""
+
+import contextlib
+import functools
+import json
+import timeit
+
+# the Journal methods that instrument() wraps
+journal_methods = ['reload', 'read_from_file', 'write_to_file', 'compact', 'rotate',
+    'load_history', 'write_snapshot', 'add_task', 'set_task_completed',
+    'add_action', 'pop_action', 'move_action', 'interval_index',
+    'count_time_in_action', 'total_time', 'report_data', 'day_matrix',
+    'list_actions', 'make_custom_report', 'calendar_report']
+
+class Stats:
+    def __init__(self):
+        # name -> [calls, seconds]
+        self.calls = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def record(self, name, seconds):
+        entry = self.calls.setdefault(name, [0, 0.0])
+        entry[0] = entry[0] + 1
+        entry[1] = entry[1] + seconds
+
+    def read(self, num_bytes):
+        self.bytes_read = self.bytes_read + num_bytes
+
+    def written(self, num_bytes):
+        self.bytes_written = self.bytes_written + num_bytes
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.record(name, timeit.default_timer() - start)
+
+    def wrap(self, name, function):
+        """
+        function, recording its time under name
+        Calls that are nested in other recorded calls count for both.
+        """
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            start = timeit.default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(name, timeit.default_timer() - start)
+        return timed_function
+
+    def wrap_command(self, function):
+        """
+        function(journal, ans), recording its time under the command letter
+        """
+        @functools.wraps(function)
+        def timed_command(journal, ans):
+            with self.timed('command {0}'.format(ans[0])):
+                return function(journal, ans)
+        return timed_command
+
+    def instrument(self, journal):
+        """
+        Record the calls to the core methods of journal and the bytes moved by
+        its storage, from now on
+        """
+        for name in journal_methods:
+            setattr(journal, name, self.wrap(name, getattr(journal, name)))
+        journal.stats = self
+        journal.storage.stats = self
+
+    def to_dict(self):
+        return {'calls': dict((name, {'calls': calls, 'seconds': seconds}) for name, (calls, seconds) in self.calls.items()),
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written}
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+
+    def report(self):
+        """
+        Lines of a table of the recorded calls, slowest first
+        """
+        lines = ['{0:<22}{1:>8}{2:>13}{3:>12}'.format('NAME', 'CALLS', 'TOTAL (ms)', 'MEAN (ms)')]
+        for name, (calls, seconds) in sorted(self.calls.items(), key=lambda item: -item[1][1]):
+            lines.append('{0:<22}{1:>8}{2:>13.3f}{3:>12.3f}'.format(name, calls, 1000*seconds, 1000*seconds/calls))
+        lines.append('Bytes read: {0}, bytes written: {1}'.format(self.bytes_read, self.bytes_written))
+        return lines
@@ -0,0 +1,1457 @@
+#!/usr/bin/python
+"""
+Persistence for the journal
+
+TextStorage keeps the journal in journal_tasks.txt and journal_actions.txt,
+which are append-only logs that are only rewritten when compacting. Lines
+of them that can not be read are skipped and reported by read_errors().
+BinaryStorage keeps the actions as fixed-width records in
+journal_actions.bin, which are read through mmap.
+SqliteStorage keeps it in an SQLite database.
+Both of the latter are lazy: a journal can run on them without loading the
+whole history into memory.
+
+Storages only deal in records: tasks are (name, time, task_type, completed)
+and actions are (action, task_id, dt). What the records mean is up to the
+journal.
+
+Every storage groups the writes made inside transaction(): they are
+persisted together at the end, or not at all if the block raises.
+TextStorage can leave its appends to a BackgroundWriter thread, so that
+writing never holds up the prompt.
+
+TextStorage can also keep a snapshot of the journal in journal_snapshot.json,
+so that only the records written after it have to be read at startup, and
+archive old months of actions as segments in journal_segments, each with a
+summary the journal can answer queries from without reading the segment.
+All but the newest segments are kept compressed, see SegmentFile.
+
+Several processes can share a text or binary journal: writes are made under
+an advisory lock on journal.lock, and follow() reads only what the other
+processes appended since. An append on top of records this process has not
+read raises JournalChanged instead of writing.
+"""
+
+import atexit
+import binascii
+import contextlib
+import datetime
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from six.moves import queue
+from six.moves.urllib.request import pathname2url
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locks, a journal is then only safe for one process
+    fcntl = None
+
+try:
+    import lzma
+except ImportError:
+    # Python built without it, segments are compressed with zlib only
+    lzma = None
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def to_micros(dt):
+    """ Microseconds between the (naive) epoch and dt """
+    delta = dt - EPOCH
+    return (delta.days*86400 + delta.seconds)*1000000 + delta.microseconds
+
+def from_micros(micros):
+    return EPOCH + datetime.timedelta(microseconds=micros)
+
+def parse_dt_fields(text):
+    """
+    The datetime of "%Y-%m-%d %H:%M:%S" with an optional ".%f", read from
+    the fixed offsets of the fields
+    """
+    if len(text) not in (19, 26) or text[4] != '-' or text[7] != '-' or text[10] != ' ' or text[13] != ':' or text[16] != ':' or text[19:20] not in ('', '.'):
+        raise ValueError("invalid time {0!r}".format(text))
+    return datetime.datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]), int(text[11:13]), int(text[14:16]), int(text[17:19]), int(text[20:26] or 0))
+
+# Python 3.7 on, it is many times faster than strptime
+fromisoformat = getattr(datetime.datetime, 'fromisoformat', None)
+
+def parse_dt(text):
+    """
+    The datetime of an action record
+    The records hold "%Y-%m-%d %H:%M:%S.%f", or no ".%f" when they were
+    written by str() of a time without microseconds.
+    """
+    if fromisoformat is None:
+        return parse_dt_fields(text)
+    # fromisoformat also takes other ISO forms, like dates without a time
+    dt = fromisoformat(text) if len(text) in (19, 26) else None
+    if dt is None or dt.tzinfo is not None:
+        raise ValueError("invalid time {0!r}, the journal keeps local times".format(text))
+    return dt
+
+def parse_action_chunk(job):
+    """
+    Parse job, a (text, line number) chunk of whole lines of the action log
+    Returns the records as lists of (action, task_id, dt) with the correction
+    records in between them, as ('P',) or ('M', old_ix, new_ix, dt), and the
+    (line number, message) of every line that could not be read.
+    """
+    text, line_no = job
+    pieces = []
+    run = []
+    errors = []
+    for line_no, line in enumerate(text.splitlines(), line_no):
+        data = line.strip().split(',')
+        try:
+            if len(data) == 3:
+                run.append((int(data[0]), int(data[1]), parse_dt(data[2])))
+            elif data[0] == 'P' and len(data) == 1:
+                pieces.extend([run, ('P',)])
+                run = []
+            elif data[0] == 'M' and len(data) == 4:
+                pieces.extend([run, ('M', int(data[1]), int(data[2]), parse_dt(data[3]))])
+                run = []
+            elif data != ['']:
+                raise ValueError("expected 3 fields, found {0}".format(len(data)))
+        except ValueError as e:
+            errors.append((line_no, str(e)))
+    pieces.append(run)
+    return pieces, errors
+
+def read_chunks(f, size):
+    """
+    The (text, line number) chunks of about size characters of whole lines
+    from the position of f on, the lines numbered from 1 there
+    """
+    line_no = 1
+    while True:
+        text = f.read(size)
+        if not text:
+            return
+        text = text + f.readline()
+        yield (text, line_no)
+        line_no = line_no + text.count('\n')
+
+def lines_before(path, offset):
+    with open(path, 'rb') as f:
+        return f.read(offset).count(b'\n')
+
+def action_line(action, task_id, dt):
+    return "{0},{1},{2:%Y-%m-%d %H:%M:%S.%f}\n".format(action, task_id, dt)
+
+SNAPSHOT_VERSION = 1
+
+class JournalChanged(IOError):
+    """
+    Another process changed the journal since this one last read it
+    """
+    pass
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive advisory lock on path, if there is one
+    """
+    if fcntl is None or path is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def file_state(path):
+    """
+    (inode, size) of path, None if it does not exist
+    A file that was replaced has a new inode even if the size matches.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size)
+
+class BackgroundWriter:
+    """
+    Appends text to files from a worker thread. Whatever is queued while the
+    worker is busy is grouped into one write per file, followed by an fsync.
+    Errors are kept until take_errors() is called.
+    With known, the file_state() of every path as its storage last saw it,
+    a file another process appended to is not written on top of, like
+    TextStorage.check_known() does, and take_changed() tells so.
+    """
+    def __init__(self, lock_path=None, known=None):
+        self.lock_path = lock_path
+        self.known = known
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.errors = []
+        # the paths that were not written as others changed them
+        self.changed = []
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        # write what is left when the interpreter exits
+        atexit.register(self.close)
+
+    def put(self, path, text):
+        self.queue.put((path, text))
+
+    def run(self):
+        running = True
+        while running:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None asks the worker to stop
+            running = None not in items
+            self.write([item for item in items if item is not None])
+            for item in items:
+                self.queue.task_done()
+
+    def write(self, items):
+        paths = []
+        texts = {}
+        for path, text in items:
+            if path not in texts:
+                paths.append(path)
+                texts[path] = []
+            texts[path].append(text)
+        for path in paths:
+            try:
+                with file_lock(self.lock_path):
+                    if self.known is not None and path in self.known and file_state(path) != self.known[path]:
+                        raise JournalChanged("{0} was changed by another process".format(path))
+                    with open(path, 'a') as f:
+                        f.write(''.join(texts[path]))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    if self.known is not None:
+                        self.known[path] = file_state(path)
+            except JournalChanged as e:
+                with self.lock:
+                    self.errors.append("could not write {0}: {1}".format(path, e))
+                    self.changed.append(path)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append("could not write {0}: {1}".format(path, e))
+
+    def wait(self):
+        """
+        Return once everything queued so far is written
+        """
+        self.queue.join()
+
+    def take_errors(self):
+        with self.lock:
+            errors = self.errors
+            self.errors = []
+        return errors
+
+    def take_changed(self):
+        with self.lock:
+            changed = self.changed
+            self.changed = []
+        return changed
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+# the method byte of a segment file is the position in this list
+COMPRESSION_METHODS = ['zlib', 'lzma']
+# method -> (compress, decompress), for the methods this Python has
+compressors = {'zlib': (lambda data: zlib.compress(data, 9), zlib.decompress)}
+if lzma is not None:
+    compressors['lzma'] = (lzma.compress, lzma.decompress)
+
+class SegmentFile:
+    """
+    A segment of the compressed tier: the records in blocks that are each
+    compressed on their own, the compressed summary, and an index of the
+    blocks at the end
+    A block holds the action codes, the task ids and the start of every
+    action as the microseconds since the previous one, column by column, so
+    that they compress well. The index gives the offset, size, number of
+    records and first start of every block, so reading a few records only
+    decompresses the blocks they are in, and reading the summary none.
+    """
+    magic = b'JSEG'
+    header = struct.Struct('<4sB')
+    entry = struct.Struct('<QIIq')
+    footer = struct.Struct('<QIQI4s')
+
+    def __init__(self, path, stats=None):
+        self.path = path
+        self.stats = stats
+        with open(path, 'rb') as f:
+            magic, method = self.header.unpack(f.read(self.header.size))
+            f.seek(-self.footer.size, os.SEEK_END)
+            index_offset, num_blocks, self.summary_offset, self.summary_size, end_magic = self.footer.unpack(f.read(self.footer.size))
+            if magic != self.magic or end_magic != self.magic or method >= len(COMPRESSION_METHODS):
+                raise ValueError("{0} is not a segment file".format(path))
+            self.method = COMPRESSION_METHODS[method]
+            if self.method not in compressors:
+                raise ValueError("{0} is compressed with {1}, which is not available".format(path, self.method))
+            f.seek(index_offset)
+            index = f.read(num_blocks*self.entry.size)
+        self.blocks = list(self.entry.iter_unpack(index))
+        self.count = sum(count for offset, size, count, first_ts in self.blocks)
+        if self.stats is not None:
+            self.stats.read(self.header.size + len(index) + self.footer.size)
+
+    @classmethod
+    def write(cls, path, records, summary, method='zlib', block_size=4096):
+        """
+        Write (action, task_id, micros) records and their summary as a
+        segment file
+        """
+        if method not in compressors:
+            raise ValueError("{0} compression is not available".format(method))
+        compress = compressors[method][0]
+        blocks = []
+        with open(path, 'wb') as f:
+            f.write(cls.header.pack(cls.magic, COMPRESSION_METHODS.index(method)))
+            for start in range(0, len(records), block_size):
+                block = records[start:start+block_size]
+                deltas = []
+                previous = block[0][2]
+                for action, task_id, micros in block:
+                    deltas.append(micros - previous)
+                    previous = micros
+                n = len(block)
+                data = compress(struct.pack('<{0}B{0}i{0}q'.format(n), *([record[0] for record in block] + [record[1] for record in block] + deltas)))
+                blocks.append((f.tell(), len(data), n, block[0][2]))
+                f.write(data)
+            summary_offset = f.tell()
+            f.write(compress(json.dumps(summary, sort_keys=True).encode('utf-8')))
+            index_offset = f.tell()
+            for block in blocks:
+                f.write(cls.entry.pack(*block))
+            f.write(cls.footer.pack(index_offset, len(blocks), summary_offset, index_offset - summary_offset, cls.magic))
+
+    def summary(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.summary_offset)
+            data = f.read(self.summary_size)
+        if self.stats is not None:
+            self.stats.read(self.summary_size)
+        return json.loads(compressors[self.method][1](data).decode('utf-8'))
+
+    def records(self, first=0, last=None):
+        """
+        The (action, task_id, micros) records at positions [first, last)
+        """
+        if last is None:
+            last = self.count
+        decompress = compressors[self.method][1]
+        records = []
+        pos = 0
+        with open(self.path, 'rb') as f:
+            for offset, size, n, first_ts in self.blocks:
+                if pos < last and pos + n > first:
+                    f.seek(offset)
+                    data = decompress(f.read(size))
+                    if self.stats is not None:
+                        self.stats.read(size)
+                    values = struct.unpack('<{0}B{0}i{0}q'.format(n), data)
+                    micros = first_ts
+                    for ix in range(n):
+                        micros = micros + values[2*n+ix]
+                        if first <= pos+ix < last:
+                            records.append((values[ix], values[n+ix], micros))
+                pos = pos + n
+        return records
+
+class TextStorage:
+    lazy = False
+    keeps_intervals = False
+    snapshots = True
+    segments = True
+    # the newest segments stay plain text, the older ones are compressed
+    plain_segments = 2
+    compression = 'zlib'
+    # the action log is parsed in chunks of this many characters, in a pool
+    # of parse_processes processes if there is at least parallel_bytes of it
+    chunk_size = 1024*1024
+    parse_processes = None
+    parallel_bytes = 64*1024*1024
+    # set by journal_stats to count the bytes read and written
+    stats = None
+
+    def __init__(self, directory='.', read_only=False):
+        """
+        A read_only storage never writes to the directory: it takes no lock
+        and does not create the logs, which have to be there
+        """
+        self.directory = directory
+        self.read_only = read_only
+        self.tasks_path = os.path.join(directory, 'journal_tasks.txt')
+        self.actions_path = os.path.join(directory, 'journal_actions.txt')
+        self.snapshot_path = os.path.join(directory, 'journal_snapshot.json')
+        self.segments_path = os.path.join(directory, 'journal_segments')
+        # records held by the current transaction, and the log sizes to cut
+        # back to if it fails
+        self.pending = None
+        self.sizes = None
+        # BackgroundWriter doing the appends, if any
+        self.writer = None
+        self.lock_path = os.path.join(directory, 'journal.lock') if not read_only else None
+        self.lock_depth = 0
+        self.lock = None
+        # path -> file_state() as this process last read or wrote it
+        self.known = {}
+        # the lines that could not be read, see read_errors()
+        self.read_problems = []
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Hold the journal lock, which every process takes to write; nests
+        """
+        if self.lock_depth == 0:
+            self.lock = file_lock(self.lock_path)
+            self.lock.__enter__()
+        self.lock_depth = self.lock_depth + 1
+        try:
+            yield
+        finally:
+            self.lock_depth = self.lock_depth - 1
+            if self.lock_depth == 0:
+                lock, self.lock = self.lock, None
+                lock.__exit__(None, None, None)
+
+    def check_known(self, path):
+        """
+        Raise JournalChanged if another process wrote path since this one
+        last read or wrote it
+        """
+        if path in self.known and file_state(path) != self.known[path]:
+            raise JournalChanged("{0} was changed by another process".format(path))
+
+    def remember(self, path, f):
+        """
+        Note that this process has seen path up to the position of f
+        """
+        self.known[path] = (os.fstat(f.fileno()).st_ino, f.tell())
+
+    def create_files(self):
+        for path in [self.tasks_path, self.actions_path]:
+            if not os.path.exists(path) and self.read_only:
+                raise ValueError("{0} does not exist".format(path))
+            if not os.path.exists(path):
+                with open(path, 'w') as f:
+                    pass
+
+    def read_tasks(self, offset=0, tasks=None):
+        """
+        Return the task records with their update records applied
+        Reading can start at a byte offset, on top of the tasks read before it
+        """
+        self.create_files()
+        self.sync()
+        tasks = [] if tasks is None else tasks
+        errors = []
+        with open(self.tasks_path, 'r') as f:
+            f.seek(offset)
+            for line_no, task in enumerate(f, 1):
+                data = task.strip().split(',')
+                try:
+                    if len(data) == 4:
+                        tasks.append([data[0], int(data[1]), int(data[2]), data[3]=='True'])
+                    elif len(data) == 2:
+                        # update record for a task that was already read
+                        task_id = int(data[0])
+                        if task_id>=0 and task_id<len(tasks):
+                            tasks[task_id][3] = data[1]=='True'
+                    elif data != ['']:
+                        raise ValueError("expected 4 fields, found {0}".format(len(data)))
+                except ValueError as e:
+                    errors.append((line_no, str(e)))
+            self.remember(self.tasks_path, f)
+        self.bad_lines(self.tasks_path, offset, errors)
+        if self.stats is not None:
+            self.stats.read(self.known[self.tasks_path][1] - offset)
+        return tasks
+
+    def read_actions(self, offset=0):
+        """
+        Return the (action, task_id, dt) records from a byte offset on, with
+        the correction records applied
+        Corrections can move or remove any earlier action, so reading from
+        anywhere but the start raises JournalChanged if it meets one. Lines
+        that can not be read are skipped and left for read_errors().
+        """
+        self.create_files()
+        self.sync()
+        actions = []
+        with open(self.actions_path, 'r') as f:
+            f.seek(offset)
+            for pieces, errors in self.parse_chunks(f):
+                for piece in pieces:
+                    if isinstance(piece, list):
+                        actions.extend(piece)
+                    elif offset > 0:
+                        raise JournalChanged("{0} has corrections to actions before the ones read".format(self.actions_path))
+                    else:
+                        self.apply_correction(actions, piece)
+                self.bad_lines(self.actions_path, offset, errors)
+            self.remember(self.actions_path, f)
+        if self.stats is not None:
+            self.stats.read(self.known[self.actions_path][1] - offset)
+        return actions
+
+    def read_actions_before(self, offset, num):
+        """
+        The last num (action, task_id, dt) records before a byte offset, read
+        back from it a chunk at a time, or None if that does not give them:
+        there are fewer, or a correction comes after one of them and only
+        reading from the start applies it
+        """
+        self.sync()
+        with open(self.actions_path, 'rb') as f:
+            start = offset
+            data = b''
+            while True:
+                first = max(start - self.chunk_size, 0)
+                f.seek(first)
+                data = f.read(start - first) + data
+                start = first
+                # the first line is only whole at the start of the file
+                text = data if start == 0 else data[data.index(b'\n')+1:] if b'\n' in data else b''
+                pieces, errors = parse_action_chunk((text.decode('utf-8'), 1))
+                # corrections only change the records before them
+                if len(pieces[-1]) >= num:
+                    return pieces[-1][len(pieces[-1])-num:]
+                if start == 0 or len(pieces) > 1:
+                    return None
+
+    def parse_chunks(self, f):
+        """
+        The parse_action_chunk() results of f from its position on, parsed in
+        a pool of parse_processes processes if that is at least parallel_bytes
+        """
+        chunks = read_chunks(f, self.chunk_size)
+        if not self.parse_processes or os.fstat(f.fileno()).st_size - f.tell() < self.parallel_bytes:
+            for chunk in chunks:
+                yield parse_action_chunk(chunk)
+            return
+        chunks = list(chunks)
+        pool = multiprocessing.Pool(self.parse_processes)
+        try:
+            for result in pool.imap(parse_action_chunk, chunks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def apply_correction(self, actions, correction):
+        if correction[0] == 'P' and len(actions) > 0:
+            actions.pop()
+        elif correction[0] == 'M':
+            old_ix, new_ix, dt = correction[1:]
+            if 0 <= old_ix < len(actions) and 0 <= new_ix < len(actions):
+                action, task_id, old_dt = actions.pop(old_ix)
+                actions.insert(new_ix, (action, task_id, dt))
+
+    def bad_lines(self, path, offset, errors):
+        """
+        Keep the (line number, message) errors of reading path from offset
+        for read_errors()
+        """
+        if errors:
+            first = lines_before(path, offset)
+            self.read_problems.extend("{0} line {1}: {2}".format(path, first + line_no, message) for line_no, message in errors)
+
+    def read_errors(self):
+        """
+        The lines of the logs that could not be read since the last call
+        """
+        errors, self.read_problems = self.read_problems, []
+        return errors
+
+    def tail_offset(self, path):
+        """
+        Offset of what other processes appended to path since this one last
+        read or wrote it, None if nothing was
+        """
+        known = self.known.get(path)
+        state = file_state(path)
+        if known is None or state == known:
+            return None
+        if state is None or state[0] != known[0] or state[1] < known[1]:
+            raise JournalChanged("{0} was rewritten by another process".format(path))
+        return known[1]
+
+    def follow_actions(self):
+        offset = self.tail_offset(self.actions_path)
+        return [] if offset is None else list(self.read_actions(offset))
+
+    def follow(self, tasks):
+        """
+        Read what other processes appended since this one last read or wrote
+        the logs. The task records are applied to tasks and the new action
+        records are returned, or None if nothing changed. If the logs were
+        rewritten, JournalChanged is raised and they have to be read again.
+        """
+        self.sync()
+        changed = self.writer.take_changed() if self.writer is not None else []
+        if changed:
+            # what the writer left out is only in memory
+            raise JournalChanged("{0} could not be written, it was changed by another process".format(changed[0]))
+        with self.locked():
+            offset = self.tail_offset(self.tasks_path)
+            if offset is not None:
+                self.read_tasks(offset, tasks)
+            actions = self.follow_actions()
+        if offset is None and len(actions) == 0:
+            return None
+        return actions
+
+    def refresh(self):
+        # every read goes to the files
+        pass
+
+    def start_writer(self):
+        """
+        Leave the appends to a BackgroundWriter from now on
+        """
+        if self.writer is None:
+            self.writer = BackgroundWriter(self.lock_path, self.known)
+
+    def append_text(self, path, text):
+        if self.writer is not None:
+            # the writer checks for appends of others and keeps known
+            self.writer.put(path, text)
+        else:
+            with self.locked():
+                self.check_known(path)
+                with open(path, 'a') as f:
+                    f.write(text)
+                self.known[path] = file_state(path)
+        if self.stats is not None:
+            self.stats.written(len(text.encode('utf-8')))
+
+    def write_record(self, path, record):
+        if self.pending is not None:
+            self.pending.append((path, record))
+        else:
+            self.append_text(path, record)
+
+    def flush(self):
+        """
+        Write the records held by the current transaction, each log at once
+        """
+        if not self.pending:
+            return
+        for path in [self.tasks_path, self.actions_path]:
+            records = [record for record_path, record in self.pending if record_path == path]
+            if records:
+                self.append_text(path, ''.join(records))
+        self.pending = []
+
+    def sync(self):
+        """
+        Make sure that everything written so far is in the files, before they
+        are read or measured
+        """
+        self.flush()
+        if self.writer is not None:
+            self.writer.wait()
+
+    def write_errors(self):
+        """
+        The errors of the background writer since the last call
+        """
+        return self.writer.take_errors() if self.writer is not None else []
+
+    def append_task(self, task_id, task):
+        self.write_record(self.tasks_path, "{0},{1},{2},{3}\n".format(task.name, task.time, task.task_type, task.completed))
+
+    def update_task(self, task_id, task):
+        # update records only carry the task id and the completed flag
+        self.write_record(self.tasks_path, "{0},{1}\n".format(task_id, task.completed))
+
+    def append_action(self, action):
+        self.write_record(self.actions_path, action_line(action.action, action.task_id, action.dt))
+
+    def pop_action(self):
+        # a correction record removing the last action, the snapshot can not
+        # be used any more
+        self.remove_snapshot()
+        self.write_record(self.actions_path, "P\n")
+
+    def move_action(self, old_ix, new_ix, dt):
+        """
+        Append a correction record giving the action at old_ix the time dt,
+        which puts it at new_ix
+        """
+        self.remove_snapshot()
+        self.write_record(self.actions_path, "M,{0},{1},{2:%Y-%m-%d %H:%M:%S.%f}\n".format(old_ix, new_ix, dt))
+
+    def rewrite(self, tasks, actions):
+        """
+        Replace both logs with a single record per task and action
+        """
+        self.supersede()
+        with self.locked():
+            self.check_known(self.tasks_path)
+            self.check_known(self.actions_path)
+            self.remove_snapshot()
+            self.write_tasks(tasks)
+            # a new file, so that other processes see it was rewritten
+            with open(self.actions_path+'.tmp', 'w') as f:
+                for action in actions:
+                    f.write(action_line(action.action, action.task_id, action.dt))
+            os.rename(self.actions_path+'.tmp', self.actions_path)
+            self.known[self.actions_path] = file_state(self.actions_path)
+        if self.stats is not None:
+            self.stats.written(os.path.getsize(self.tasks_path) + os.path.getsize(self.actions_path))
+
+    def write_tasks(self, tasks):
+        with open(self.tasks_path+'.tmp', 'w') as f:
+            for task in tasks:
+                f.write("{0},{1},{2},{3}\n".format(task.name, task.time, task.task_type, task.completed))
+        os.rename(self.tasks_path+'.tmp', self.tasks_path)
+        self.known[self.tasks_path] = file_state(self.tasks_path)
+
+    def clear(self):
+        self.supersede()
+        with self.locked():
+            os.remove(self.tasks_path)
+            os.remove(self.actions_path)
+            self.remove_snapshot()
+            for summary in self.read_segment_summaries():
+                for path in self.segment_paths(summary['name']):
+                    if os.path.exists(path):
+                        os.remove(path)
+        self.known = {}
+
+    def segment_paths(self, name):
+        """
+        The plain action records, the summary and the compressed action
+        records of the segment called name
+        """
+        path = os.path.join(self.segments_path, name)
+        return (path + '.txt', path + '.json', path + '.seg')
+
+    def write_segment(self, name, actions, summary):
+        """
+        Archive actions as the segment called name with its summary
+        The summary is written last, a segment without one does not exist.
+        """
+        if not os.path.isdir(self.segments_path):
+            os.mkdir(self.segments_path)
+        actions_path, summary_path, compressed_path = self.segment_paths(name)
+        with open(actions_path+'.tmp', 'w') as f:
+            for action in actions:
+                f.write(action_line(action.action, action.task_id, action.dt))
+        os.rename(actions_path+'.tmp', actions_path)
+        with open(summary_path+'.tmp', 'w') as f:
+            json.dump(summary, f, sort_keys=True)
+        os.rename(summary_path+'.tmp', summary_path)
+        if self.stats is not None:
+            self.stats.written(os.path.getsize(actions_path) + os.path.getsize(summary_path))
+
+    def read_segment_summaries(self):
+        """
+        The summaries of the archived segments, oldest first
+        """
+        if not os.path.isdir(self.segments_path):
+            return []
+        file_names = set(os.listdir(self.segments_path))
+        summaries = []
+        for file_name in sorted(file_names):
+            name, extension = os.path.splitext(file_name)
+            path = os.path.join(self.segments_path, file_name)
+            if extension == '.seg':
+                summaries.append(SegmentFile(path, self.stats).summary())
+            elif extension == '.json' and name + '.seg' not in file_names:
+                with open(path, 'r') as f:
+                    summaries.append(json.load(f))
+                if self.stats is not None:
+                    self.stats.read(os.path.getsize(path))
+        return summaries
+
+    def read_segment(self, name, first=0, last=None):
+        """
+        Return the (action, task_id, micros) records of a segment at
+        positions [first, last), only the blocks they are in are
+        decompressed if it is compressed
+        """
+        actions_path, summary_path, compressed_path = self.segment_paths(name)
+        if os.path.exists(compressed_path):
+            return SegmentFile(compressed_path, self.stats).records(first, last)
+        with open(actions_path, 'r') as f:
+            pieces, errors = parse_action_chunk((f.read(), 1))
+        # segments are written without corrections
+        actions = [(action, task_id, to_micros(dt)) for piece in pieces if isinstance(piece, list) for action, task_id, dt in piece]
+        self.bad_lines(actions_path, 0, errors)
+        if self.stats is not None:
+            self.stats.read(os.path.getsize(actions_path))
+        return actions[first:last]
+
+    def compress_segments(self):
+        """
+        Move all but the newest plain_segments segments to the compressed
+        tier, their summaries go into the segment files
+        """
+        if not os.path.isdir(self.segments_path):
+            return
+        names = sorted(os.path.splitext(file_name)[0] for file_name in os.listdir(self.segments_path) if file_name.endswith('.json'))
+        for name in names[:max(len(names) - self.plain_segments, 0)]:
+            actions_path, summary_path, compressed_path = self.segment_paths(name)
+            if not os.path.exists(compressed_path):
+                with open(summary_path, 'r') as f:
+                    summary = json.load(f)
+                SegmentFile.write(compressed_path+'.tmp', self.read_segment(name), summary, self.compression)
+                os.rename(compressed_path+'.tmp', compressed_path)
+                if self.stats is not None:
+                    self.stats.written(os.path.getsize(compressed_path))
+            for path in (actions_path, summary_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def file_check(self, path, offset, size=64):
+        """
+        The bytes just before offset, which must not change for a snapshot
+        taken at offset to stay valid
+        """
+        with open(path, 'rb') as f:
+            f.seek(max(offset-size, 0))
+            return binascii.hexlify(f.read(min(offset, size))).decode('ascii')
+
+    def snapshot_checksum(self, snapshot):
+        content = dict((key, value) for key, value in snapshot.items() if key != 'checksum')
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def write_snapshot(self, snapshot):
+        """
+        Save the snapshot as covering both files up to their current end
+        """
+        self.sync()
+        snapshot = dict(snapshot)
+        snapshot['version'] = SNAPSHOT_VERSION
+        for name, path in [('tasks', self.tasks_path), ('actions', self.actions_path)]:
+            offset = os.path.getsize(path)
+            snapshot[name+'_offset'] = offset
+            snapshot[name+'_check'] = self.file_check(path, offset)
+        snapshot['checksum'] = self.snapshot_checksum(snapshot)
+
+        # write a new file and move it over the old one, so that a crash
+        # never leaves half a snapshot behind
+        with open(self.snapshot_path+'.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.rename(self.snapshot_path+'.tmp', self.snapshot_path)
+        if self.stats is not None:
+            self.stats.written(os.path.getsize(self.snapshot_path))
+
+    def read_snapshot(self):
+        """
+        Return the snapshot, or None if there is none or it does not match the
+        files any more
+        """
+        self.sync()
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != SNAPSHOT_VERSION or snapshot.get('checksum') != self.snapshot_checksum(snapshot):
+                return None
+            for name, path in [('tasks', self.tasks_path), ('actions', self.actions_path)]:
+                offset = snapshot[name+'_offset']
+                if os.path.getsize(path) < offset or self.file_check(path, offset) != snapshot[name+'_check']:
+                    return None
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if self.stats is not None:
+            self.stats.read(os.path.getsize(self.snapshot_path))
+        return snapshot
+
+    def remove_snapshot(self):
+        if os.path.exists(self.snapshot_path):
+            os.remove(self.snapshot_path)
+
+    def supersede(self):
+        """
+        The logs are about to be replaced, so the held records are no longer
+        needed and a failing transaction can not cut the logs back any more
+        """
+        if self.pending is not None:
+            self.pending = []
+            self.sizes = None
+        if self.writer is not None:
+            self.writer.wait()
+
+    def truncate(self):
+        if self.sizes is None:
+            return
+        if self.writer is not None:
+            self.writer.wait()
+        with self.locked():
+            for path, size in self.sizes:
+                # what other processes appended since can not be cut off
+                if path in self.known and file_state(path) != self.known[path]:
+                    continue
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+                if path in self.known:
+                    self.known[path] = file_state(path)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Hold the records appended inside and write each log once at the end.
+        If the block raises, the records are dropped and the logs are cut back
+        to their size at the start. Only the outermost transaction writes.
+        """
+        if self.pending is not None:
+            yield
+            return
+        self.create_files()
+        self.sync()
+        self.sizes = [(path, os.path.getsize(path)) for path in [self.tasks_path, self.actions_path]]
+        self.pending = []
+        try:
+            yield
+            self.flush()
+        except BaseException:
+            self.pending = None
+            self.truncate()
+            raise
+        finally:
+            self.pending = None
+            self.sizes = None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class BinaryStorage(TextStorage):
+    """
+    Tasks in journal_tasks.txt like TextStorage, actions in journal_actions.bin
+    as packed (action, task_id, epoch microseconds) records. The records are
+    read through mmap, so only the ones asked for are unpacked.
+    """
+    lazy = True
+    snapshots = False
+    segments = False
+    record = struct.Struct('<Biq')
+
+    def __init__(self, directory='.', read_only=False):
+        TextStorage.__init__(self, directory, read_only)
+        self.actions_path = os.path.join(directory, 'journal_actions.bin')
+        self.map = None
+        self.create_files()
+        self.count = os.path.getsize(self.actions_path) // self.record.size
+        self.known[self.actions_path] = file_state(self.actions_path)
+
+    def buffer(self):
+        """
+        The mapped records, mapped again if records were appended since
+        """
+        size = self.count * self.record.size
+        if self.map is None or len(self.map) < size:
+            self.unmap()
+            with open(self.actions_path, 'rb') as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.map
+
+    def unmap(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def records(self, first, last, chunk=4096):
+        """
+        Yield the raw (action, task_id, micros) records at positions [first, last)
+        """
+        size = self.record.size
+        for start in range(first, last, chunk):
+            buf = self.buffer()
+            if self.stats is not None:
+                self.stats.read((min(start+chunk, last)-start)*size)
+            for record in self.record.iter_unpack(buf[start*size:min(start+chunk, last)*size]):
+                yield record
+
+    def read_actions(self):
+        for action, task_id, micros in self.records(0, self.count):
+            yield (action, task_id, from_micros(micros))
+
+    def record_at(self, ix):
+        """
+        The raw (action, task_id, micros) record at position ix
+        """
+        record = self.record.unpack_from(self.buffer(), ix*self.record.size)
+        if self.stats is not None:
+            self.stats.read(self.record.size)
+        return record
+
+    def action_at(self, ix):
+        action, task_id, micros = self.record_at(ix)
+        return (action, task_id, from_micros(micros))
+
+    def interval_records(self, first, last):
+        """
+        Like actions_between, with the times in microseconds
+        """
+        return [(action, task_id, micros, None) for action, task_id, micros in self.records(first, last)]
+
+    def actions_between(self, first, last):
+        return [(action, task_id, from_micros(micros), None) for action, task_id, micros in self.records(first, last)]
+
+    def pack(self, action):
+        return self.record.pack(action.action, action.task_id, to_micros(action.dt))
+
+    def follow_actions(self):
+        offset = self.tail_offset(self.actions_path)
+        if offset is None:
+            return []
+        first = self.count
+        self.unmap()
+        self.count = os.path.getsize(self.actions_path) // self.record.size
+        self.known[self.actions_path] = file_state(self.actions_path)
+        return [(action, task_id, from_micros(micros)) for action, task_id, micros in self.records(first, self.count)]
+
+    def start_writer(self):
+        # the action records are written, moved and popped in place
+        raise ValueError("the binary journal can not be written from a background thread")
+
+    def refresh(self):
+        """
+        Count the action records again, when the journal is read again
+        """
+        self.unmap()
+        self.count = os.path.getsize(self.actions_path) // self.record.size
+        self.known[self.actions_path] = file_state(self.actions_path)
+
+    def append_action(self, action):
+        with self.locked():
+            self.check_known(self.actions_path)
+            with open(self.actions_path, 'ab') as f:
+                f.write(self.pack(action))
+            self.known[self.actions_path] = file_state(self.actions_path)
+        self.count = self.count + 1
+        if self.stats is not None:
+            self.stats.written(self.record.size)
+
+    def pop_action(self):
+        # the map must not reach past the end of the file
+        self.unmap()
+        if self.sizes is not None and self.count*self.record.size <= dict(self.sizes)[self.actions_path]:
+            self.sizes = None
+        with self.locked():
+            self.check_known(self.actions_path)
+            self.count = self.count - 1
+            with open(self.actions_path, 'r+b') as f:
+                f.truncate(self.count * self.record.size)
+            self.known[self.actions_path] = file_state(self.actions_path)
+
+    def move_action(self, old_ix, new_ix, dt):
+        first = min(old_ix, new_ix)
+        last = max(old_ix, new_ix)
+        rows = list(self.records(first, last+1))
+        moved = rows.pop(old_ix-first)
+        rows.insert(new_ix-first, (moved[0], moved[1], to_micros(dt)))
+        # records are changed in place, which a transaction can not undo
+        self.sizes = None
+        with self.locked():
+            self.check_known(self.actions_path)
+            with open(self.actions_path, 'r+b') as f:
+                f.seek(first * self.record.size)
+                f.write(b''.join(self.record.pack(*row) for row in rows))
+        if self.stats is not None:
+            self.stats.written(len(rows) * self.record.size)
+
+    def rewrite(self, tasks, actions):
+        # action records have a fixed width and are never superseded, so
+        # only the task log needs compacting
+        self.supersede()
+        with self.locked():
+            self.check_known(self.tasks_path)
+            self.write_tasks(tasks)
+        if self.stats is not None:
+            self.stats.written(os.path.getsize(self.tasks_path))
+
+    def write_actions(self, actions):
+        """
+        Replace all action records with (action, task_id, dt) tuples
+        """
+        self.supersede()
+        self.unmap()
+        with self.locked():
+            with open(self.actions_path+'.tmp', 'wb') as f:
+                for action, task_id, dt in actions:
+                    f.write(self.record.pack(action, task_id, to_micros(dt)))
+            os.rename(self.actions_path+'.tmp', self.actions_path)
+            self.known[self.actions_path] = file_state(self.actions_path)
+        self.count = os.path.getsize(self.actions_path) // self.record.size
+        if self.stats is not None:
+            self.stats.written(self.count * self.record.size)
+
+    def truncate(self):
+        # action records are written at once, so cut them back as well
+        self.unmap()
+        TextStorage.truncate(self)
+        self.count = os.path.getsize(self.actions_path) // self.record.size
+
+    def clear(self):
+        self.unmap()
+        TextStorage.clear(self)
+        self.count = 0
+
+    def close(self):
+        self.unmap()
+        TextStorage.close(self)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    task_type INTEGER NOT NULL,
+    completed INTEGER NOT NULL,
+    changed INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS actions (
+    id INTEGER PRIMARY KEY,
+    action INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    dt INTEGER NOT NULL,
+    end_dt INTEGER,
+    duration INTEGER);
+CREATE INDEX IF NOT EXISTS actions_dt ON actions (dt);
+CREATE INDEX IF NOT EXISTS actions_task_dt ON actions (task_id, dt);
+'''
+
+# the number a task write gets in the changed column
+NEXT_CHANGE = '(SELECT COALESCE(MAX(changed), 0) + 1 FROM tasks)'
+
+def upgrade_schema(conn):
+    """
+    Add the columns of SCHEMA that a database made by an older version
+    does not have yet
+    """
+    if 'changed' not in [row[1] for row in conn.execute('PRAGMA table_info(tasks)')]:
+        conn.execute('ALTER TABLE tasks ADD COLUMN changed INTEGER NOT NULL DEFAULT 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS tasks_changed ON tasks (changed)')
+
+class SqliteStorage:
+    """
+    Tasks and actions in an SQLite database. The id of an action is its
+    position in the journal. Besides the records, every action stores the
+    end and duration of its interval once the journal has resolved them,
+    so that totals are a single indexed query. Every write to a task numbers
+    it in the changed column, so that follow() only reads the tasks changed
+    since.
+    Timestamps are stored as microseconds since the epoch.
+    """
+    lazy = True
+    keeps_intervals = True
+    snapshots = False
+    segments = False
+    # set by journal_stats, but SQLite does its own page I/O, so no bytes are
+    # counted
+    stats = None
+
+    def __init__(self, path='journal.db', read_only=False):
+        """
+        A read_only storage opens the database read only, it has to exist
+        """
+        self.path = path
+        self.read_only = read_only
+        if read_only:
+            if not os.path.exists(path):
+                raise ValueError("{0} does not exist".format(path))
+            self.conn = sqlite3.connect('file:{0}?mode=ro'.format(pathname2url(os.path.abspath(path))), isolation_level=None, uri=True)
+        else:
+            self.conn = sqlite3.connect(path, isolation_level=None)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript(SCHEMA)
+            upgrade_schema(self.conn)
+        self.depth = 0
+        # the highest changed number of the tasks read so far
+        self.tasks_seen = 0
+        # whether the outermost transaction has taken the write lock yet
+        self.begun = False
+        self.count, self.num_tasks = self.counts()
+
+    def counts(self):
+        """
+        The number of actions and of tasks in the database
+        """
+        return self.conn.execute('SELECT (SELECT COALESCE(MAX(id)+1, 0) FROM actions), (SELECT COALESCE(MAX(id)+1, 0) FROM tasks)').fetchone()
+
+    @contextlib.contextmanager
+    def conflicts(self):
+        """
+        Raise JournalChanged for a database that another process holds locked
+        or wrote rows to that this one was about to write
+        """
+        try:
+            yield
+        except sqlite3.IntegrityError as e:
+            raise JournalChanged("{0} was changed by another process ({1})".format(self.path, e))
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            raise JournalChanged("{0} was locked by another process".format(self.path))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Group everything written inside into one transaction, nesting is
+        allowed and only the outermost transaction commits
+        The write lock is only taken by the first write, see begin(), so a
+        command that is still prompting does not hold up other processes.
+        """
+        self.depth = self.depth + 1
+        try:
+            yield
+        except BaseException:
+            self.depth = self.depth - 1
+            if self.depth == 0 and self.begun:
+                self.rollback()
+            raise
+        self.depth = self.depth - 1
+        if self.depth == 0 and self.begun:
+            try:
+                with self.conflicts():
+                    self.conn.execute('COMMIT')
+            except JournalChanged:
+                self.rollback()
+                raise
+            self.begun = False
+
+    def begin(self):
+        """
+        Start writing the transaction: take the write lock, and make sure no
+        other process added rows since this one last read, as the ids of the
+        new ones are their positions
+        """
+        if self.depth == 0 or self.begun:
+            return
+        with self.conflicts():
+            self.conn.execute('BEGIN IMMEDIATE')
+        self.begun = True
+        if self.counts() != (self.count, self.num_tasks):
+            raise JournalChanged("{0} was changed by another process".format(self.path))
+
+    def rollback(self):
+        self.conn.execute('ROLLBACK')
+        self.begun = False
+        self.count, self.num_tasks = self.counts()
+
+    def read_tasks(self):
+        rows = self.conn.execute('SELECT name, time, task_type, completed, changed FROM tasks ORDER BY id').fetchall()
+        self.num_tasks = len(rows)
+        self.tasks_seen = max([changed for name, time, task_type, completed, changed in rows] + [0])
+        return [[name, time, task_type, bool(completed)] for name, time, task_type, completed, changed in rows]
+
+    def read_actions(self):
+        for action, task_id, dt in self.conn.execute('SELECT action, task_id, dt FROM actions ORDER BY id'):
+            yield (action, task_id, from_micros(dt))
+
+    def append_task(self, task_id, task):
+        self.begin()
+        with self.conflicts():
+            self.conn.execute('INSERT INTO tasks (id, name, time, task_type, completed, changed) VALUES (?, ?, ?, ?, ?, ' + NEXT_CHANGE + ')',
+                (task_id, task.name, task.time, task.task_type, task.completed))
+        self.num_tasks = max(self.num_tasks, task_id + 1)
+
+    def update_task(self, task_id, task):
+        self.begin()
+        self.conn.execute('UPDATE tasks SET completed = ?, changed = ' + NEXT_CHANGE + ' WHERE id = ?', (task.completed, task_id))
+
+    def append_action(self, action):
+        self.begin()
+        with self.conflicts():
+            self.conn.execute('INSERT INTO actions (id, action, task_id, dt) VALUES (?, ?, ?, ?)',
+                (self.count, action.action, action.task_id, to_micros(action.dt)))
+        self.count = self.count + 1
+
+    def pop_action(self):
+        self.begin()
+        self.conn.execute('DELETE FROM actions WHERE id = ?', (self.count-1,))
+        self.count = self.count - 1
+
+    def move_action(self, old_ix, new_ix, dt):
+        """
+        Give the action at old_ix a new time, and renumber the actions in
+        between so that it ends up at new_ix
+        """
+        self.begin()
+        first = min(old_ix, new_ix)
+        last = max(old_ix, new_ix)
+        rows = self.conn.execute('SELECT action, task_id, dt FROM actions WHERE id >= ? AND id <= ? ORDER BY id',
+            (first, last)).fetchall()
+        moved = rows.pop(old_ix-first)
+        rows.insert(new_ix-first, (moved[0], moved[1], to_micros(dt)))
+        self.conn.execute('DELETE FROM actions WHERE id >= ? AND id <= ?', (first, last))
+        self.conn.executemany('INSERT INTO actions (id, action, task_id, dt) VALUES (?, ?, ?, ?)',
+            [(first+ix, action, task_id, dt) for ix, (action, task_id, dt) in enumerate(rows)])
+
+    def interval_records(self, first, last):
+        """
+        Return (action, task_id, micros, end micros) for the actions at
+        positions [first, last), the end is None while the interval is open
+        """
+        return self.conn.execute('SELECT action, task_id, dt, end_dt FROM actions WHERE id >= ? AND id < ? ORDER BY id',
+            (first, last)).fetchall()
+
+    def actions_between(self, first, last):
+        """
+        Like interval_records, with the times as datetimes
+        """
+        return [(action, task_id, from_micros(dt), None if end_dt is None else from_micros(end_dt))
+            for action, task_id, dt, end_dt in self.interval_records(first, last)]
+
+    def position(self, micros):
+        """
+        Position of the first action at or after micros
+        """
+        row = self.conn.execute('SELECT id FROM actions WHERE dt >= ? ORDER BY dt, id LIMIT 1', (micros,)).fetchone()
+        return self.count if row is None else row[0]
+
+    def last_position(self, codes, before):
+        """
+        Position of the last action before position `before` whose action is
+        in codes, or None
+        """
+        row = self.conn.execute('SELECT id FROM actions WHERE id < ? AND action IN ({0}) ORDER BY id DESC LIMIT 1'.format(
+            ','.join('?'*len(codes))), [before] + list(codes)).fetchone()
+        return None if row is None else row[0]
+
+    def set_intervals(self, intervals):
+        """
+        Store (position, end micros, duration) for actions whose interval is
+        resolved
+        """
+        self.begin()
+        self.conn.executemany('UPDATE actions SET end_dt = ?, duration = ? WHERE id = ?',
+            [(end, duration, ix) for ix, end, duration in intervals])
+
+    def clear_intervals(self, first):
+        """
+        Mark the intervals of the actions from position first on as open
+        """
+        self.begin()
+        self.conn.execute('UPDATE actions SET end_dt = NULL, duration = NULL WHERE id >= ?', (first,))
+
+    def query_filter(self, action_type, task_id, lo, hi):
+        query = 'action = ?'
+        params = [action_type]
+        if task_id != -1:
+            query += ' AND task_id = ?'
+            params.append(task_id)
+        if lo is not None:
+            query += ' AND dt >= ?'
+            params.append(lo)
+        if hi is not None:
+            query += ' AND dt < ?'
+            params.append(hi)
+        return (query, params)
+
+    def sum_durations(self, action_type, task_id, lo, hi):
+        """
+        Sum of the resolved durations of an action (for one task, or any task
+        if task_id is -1) starting in [lo, hi), in whole seconds
+        """
+        query, params = self.query_filter(action_type, task_id, lo, hi)
+        return self.conn.execute('SELECT COALESCE(SUM(duration), 0) FROM actions WHERE ' + query, params).fetchone()[0]
+
+    def closed_totals(self):
+        """
+        The resolved durations summed per (action, task_id), and per
+        (action, -1) over all tasks
+        """
+        totals = {}
+        for action, task_id, duration in self.conn.execute(
+                'SELECT action, task_id, SUM(duration) FROM actions WHERE duration IS NOT NULL GROUP BY action, task_id'):
+            totals[(action, -1)] = totals.get((action, -1), 0) + duration
+            if task_id != -1:
+                totals[(action, task_id)] = duration
+        return totals
+
+    def rewrite(self, tasks, actions):
+        # every record is updated in place, so there is nothing to compact
+        pass
+
+    def clear(self):
+        with self.transaction():
+            self.begin()
+            self.conn.execute('DELETE FROM tasks')
+            self.conn.execute('DELETE FROM actions')
+        self.count = 0
+        self.num_tasks = 0
+        self.tasks_seen = 0
+
+    @contextlib.contextmanager
+    def locked(self):
+        # SQLite locks the database itself
+        yield
+
+    def sync(self):
+        # a commit is written by the time it returns
+        pass
+
+    def refresh(self):
+        self.count, self.num_tasks = self.counts()
+
+    def follow(self, tasks):
+        """
+        Read what other processes added since this one last looked, like
+        TextStorage.follow. Only the tasks changed since are read.
+        """
+        changed = self.conn.execute('SELECT id, name, time, task_type, completed, changed FROM tasks WHERE changed > ? ORDER BY id',
+            (self.tasks_seen,)).fetchall()
+        count = self.conn.execute('SELECT COALESCE(MAX(id)+1, 0) FROM actions').fetchone()[0]
+        if count < self.count:
+            raise JournalChanged("{0} was changed by another process".format(self.path))
+        # the tasks this process wrote itself are among them too
+        updated = False
+        for task_id, name, time, task_type, completed, seen in changed:
+            if task_id > len(tasks):
+                raise JournalChanged("{0} was changed by another process".format(self.path))
+            record = [name, time, task_type, bool(completed)]
+            if tasks[task_id:task_id+1] != [record]:
+                tasks[task_id:task_id+1] = [record]
+                updated = True
+            self.tasks_seen = max(self.tasks_seen, seen)
+        self.num_tasks = len(tasks)
+        if not updated and count == self.count:
+            return None
+        first = self.count
+        self.count = count
+        return [(action, task_id, dt) for action, task_id, dt, end in self.actions_between(first, count)]
+
+    def write_errors(self):
+        return []
+
+    def read_errors(self):
+        return []
+
+    def close(self):
+        self.conn.close()
+
+def open_storage(directory='.', kind='text', read_only=False):
+    """
+    The text, binary or sqlite storage of the journal in directory
+    """
+    if kind == 'sqlite':
+        return SqliteStorage(os.path.join(directory, 'journal.db'), read_only)
+    elif kind == 'binary':
+        return BinaryStorage(directory, read_only)
+    return TextStorage(directory, read_only)
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+"""
+Reports over the journals of a whole team
+
+Every engineer keeps a journal in a directory of their own. aggregate()
+reads the journals in parallel with a process pool, one report per person,
+and folds each into the team report as soon as it comes in, in whatever
+order the workers finish. The calendar rows of all the people are merged on
+their days at the end, in a single k-way merge.
+"""
+
+import argparse
+import datetime
+import heapq
+import itertools
+import multiprocessing
+import os
+from operator import itemgetter
+
+import journal
+import journal_storage
+
+class PersonReport:
+    """
+    The report of one journal, or of the team: a ReportData whose tasks are
+    named instead of numbered, and the calendar as (day, seconds per
+    calendar category) rows for the days with any time in them
+    """
+    def __init__(self, name):
+        self.name = name
+        self.data = journal.ReportData()
+        self.days = []
+
+def person_name(directory):
+    return os.path.basename(os.path.normpath(directory)) or directory
+
+def read_person(job):
+    """
+    Read one journal and gather its report, in a worker process
+    """
+    name, directory, kind, day_start, num_days, calendar = job
+    if not os.path.isdir(directory):
+        raise ValueError("{0} is not a directory".format(directory))
+    # nothing is written to the directories that are read
+    j = journal.Journal(journal_storage.open_storage(directory, kind, read_only=True), start=False)
+    report = PersonReport(name)
+    try:
+        if calendar:
+            matrix = j.day_matrix(day_start, num_days)
+            report.days = [(day_start + datetime.timedelta(days=ix), row) for ix, row in enumerate(matrix) if any(row)]
+        else:
+            report.data = j.report_data(day_start, num_days)
+            # task ids only mean something in their own journal
+            report.data.task_times = dict((j.task_str(task_id), seconds) for task_id, seconds in report.data.task_times.items())
+    finally:
+        j.storage.close()
+    return report
+
+def merge_days(*day_lists):
+    """
+    Merge (day, row) lists that are sorted by day into one, adding up the
+    rows of the same day
+    """
+    merged = heapq.merge(*day_lists, key=itemgetter(0))
+    for day, rows in itertools.groupby(merged, key=itemgetter(0)):
+        yield day, [sum(column) for column in zip(*[row for row_day, row in rows])]
+
+def combine(team, person):
+    """
+    Add the report of a person to the team report
+    """
+    data = person.data
+    for task, seconds in data.task_times.items():
+        task = '{0}: {1}'.format(person.name, task)
+        team.data.task_times[task] = team.data.task_times.get(task, 0) + seconds
+    for action_type, seconds in data.category_times.items():
+        team.data.category_times[action_type] = team.data.category_time(action_type) + seconds
+    if data.first_action is not None and (team.data.first_action is None or data.first_action < team.data.first_action):
+        team.data.first_action = data.first_action
+    team.data.num_overtime = team.data.num_overtime + data.num_overtime
+    team.data.overtime = team.data.overtime + data.overtime
+
+def aggregate(directories, day_start, num_days, calendar=False, kind='text', processes=None, on_person=None):
+    """
+    Return the team report of the journals in directories over num_days days
+    from day_start: the task report, or the calendar rows if calendar is set
+    on_person(report) is called with the report of every person as soon as
+    it is read, which need not be in the order of directories.
+    """
+    jobs = [(person_name(directory), directory, kind, day_start, num_days, calendar) for directory in directories]
+    team = PersonReport('TEAM')
+    day_lists = []
+    pool = multiprocessing.Pool(processes)
+    try:
+        for person in pool.imap_unordered(read_person, jobs):
+            combine(team, person)
+            day_lists.append(person.days)
+            if on_person is not None:
+                on_person(person)
+    finally:
+        pool.close()
+        pool.join()
+    team.days = list(merge_days(*day_lists))
+    return team
+
+def calendar_matrix(days, first_day, num_days):
+    """
+    The day_matrix of num_days days from first_day for (day, row) rows
+    """
+    matrix = [[0]*len(journal.calendar_categories) for day in range(num_days)]
+    for day, row in days:
+        matrix[(day - first_day).days] = row
+    return matrix
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Report on the journals of a team, one directory per person.")
+    parser.add_argument('directories', nargs='+', help="the journal directories")
+    parser.add_argument('--days', type=int, default=1, help="report on the last DAYS days, today included")
+    parser.add_argument('--calendar', action='store_true', help="print calendars instead of task reports")
+    parser.add_argument('--storage', choices=['text', 'binary', 'sqlite'], default='text')
+    parser.add_argument('--processes', type=int, help="number of worker processes, one per CPU by default")
+    parser.add_argument('--team-only', action='store_true', help="only print the report of the whole team")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.calendar:
+        day_start, num_days = journal.calendar_window(args.days)
+    else:
+        num_days = args.days
+        day_start = datetime.date.today() - datetime.timedelta(days=num_days-1)
+
+    def print_report(report):
+        print("==== {0} ====".format(report.name))
+        if args.calendar:
+            journal.print_calendar(day_start, calendar_matrix(report.days, day_start, num_days))
+        else:
+            journal.print_custom_report(report.data, lambda task: task)
+        print('')
+
+    try:
+        team = aggregate(args.directories, day_start, num_days, args.calendar, args.storage, args.processes,
+            None if args.team_only else print_report)
+    except ValueError as e:
+        print("Error: {0}.".format(e))
+        return
+    print_report(team)
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,11 @@ except ModuleNotFoundError:
 from contextlib import contextmanager
 
 import journal
+import journal_storage
 import datetime
+import random
+import shutil
+import tempfile
 
 # override print
 class writer :
@@ -71,6 +75,32 @@ def mockRawInput(mock):
     yield
     __builtins__.raw_input = original_raw_input
 
+def scan_time_in_action(actions, action_type, action_key, day_start, num_days, now):
+    """ Reference implementation: the linear scan count_time_in_action used to do """
+    total_time = 0
+    for ix, action in enumerate(actions):
+        if (day_start and (action.dt.date() < day_start)) or (num_days and (action.dt.date() >= (day_start+datetime.timedelta(days=num_days)))):
+            continue
+        if action.action==action_type and (action_key==-1 or action.task_id==action_key):
+            this_time = now - action.dt
+            for next_action in actions[ix+1:]:
+                if journal.timed_tasks[next_action.action]:
+                    this_time = next_action.dt - action.dt
+                    break
+            total_time = total_time+this_time//datetime.timedelta(seconds=1)
+    return total_time
+
+def random_actions(num_actions, num_tasks, seed):
+    rand = random.Random(seed)
+    dt = datetime.datetime.now() - datetime.timedelta(days=10)
+    actions = []
+    for ix in range(num_actions):
+        dt += datetime.timedelta(minutes=rand.randint(0, 120), seconds=rand.randint(0, 59))
+        code = rand.choice(range(len(journal.action_codes)))
+        task_id = rand.randrange(num_tasks) if code in (journal.TASK_NEW, journal.TASK_SWITCH, journal.TASK_COMPLETED) else -1
+        actions.append(journal.Action(action=code, task_id=task_id, dt=dt))
+    return actions
+
 class JournalController(unittest.TestCase):
     def setUp(self):
         # mock input
@@ -149,6 +179,34 @@ class JournalController(unittest.TestCase):
         self.assertEqual(1, len(printed_lines))
         self.assertTrue("test_task" in printed_lines[0])
 
+    def test_list_tasks_paging(self):
+        for ix in range(45):
+            self.journal.tasks.append(journal.Task(name='task{0}'.format(ix), time=10, task_type=ix % 2, completed=ix % 3 == 0))
+        journal.run_command(self.journal, 'l2')
+        printed_lines = printed.getvalue().replace('\x00', '').strip().split('\n')
+        open_ids = [ix for ix in range(45) if ix % 3 != 0]
+        self.assertEqual([self.journal.task_str(ix) for ix in open_ids[20:]] + ['Page 2 of 2'], printed_lines[-11:])
+        for page in [0, -1, 3]:
+            self.journal.list_tasks(page=page)
+            self.assertEqual("Error: There is no page {0}, the tasks fill 2 pages.".format(page), printed.getvalue().replace('\x00', '').strip().split('\n')[-1])
+
+    def test_open_task_index_kept(self):
+        self.journal.add_task('work', 10, journal.TASK_WORK_TYPE)
+        self.journal.add_task('pers', 10, journal.TASK_PERS_TYPE)
+        self.journal.add_task('more work', 10, journal.TASK_WORK_TYPE)
+        index = self.journal.open_task_index()
+        index.build = lambda tasks: self.fail("the index should be kept up to date")
+        self.journal.set_task_completed(0, True)
+        self.assertEqual([1, 2], self.journal.open_task_index().task_ids())
+        self.journal.set_task_completed(0, False)
+        self.journal.set_task_completed(2, True)
+        self.assertEqual([0], self.journal.open_task_index().task_ids(journal.TASK_WORK_TYPE))
+        self.assertEqual([0, 1], self.journal.open_task_index().task_ids())
+        # changing a task directly is noticed
+        del index.build
+        self.journal.tasks[1].completed = True
+        self.assertEqual([0], self.journal.open_task_index().task_ids())
+
     def test_count_time_in_action_switch_noprevious_nocurrent_today(self):
         self.journal.actions[0].dt -= datetime.timedelta(minutes=10)
         self.journal.tasks.append(journal.Task(name='test_task', time=10, task_type=journal.TASK_WORK_TYPE, completed=False))
@@ -449,8 +507,1012 @@ class JournalController(unittest.TestCase):
         self.assertEqual(journal.TASK_ADD_TASKS, self.journal.cur_action)
         self.assertEqual(-1, self.journal.cur_action_key)
 
+    def test_add_action_appends_record(self):
+        with open("journal_actions.txt", 'r') as f:
+            before = f.read()
+        self.journal.add_action(journal.TASK_WALK)
+        with open("journal_actions.txt", 'r') as f:
+            after = f.read()
+        self.assertTrue(after.startswith(before))
+        self.assertEqual(1, len(after[len(before):].strip().split('\n')))
+
+    def test_complete_task_appends_update_record(self):
+        self.journal.add_task("Hello!", 5, journal.TASK_WORK_TYPE)
+        self.journal.set_task_completed(0, True)
+        with open("journal_tasks.txt", 'r') as f:
+            lines = f.read().strip().split('\n')
+        self.assertEqual(["Hello!,5,0,False", "0,True"], lines)
+
+        reloaded = journal.Journal()
+        self.assertEqual(1, len(reloaded.tasks))
+        self.assertTrue(reloaded.tasks[0].completed)
+
+    def test_compact_rewrites_files(self):
+        self.journal.add_task("Hello!", 5, journal.TASK_WORK_TYPE)
+        self.journal.set_task_completed(0, True)
+        self.journal.set_task_completed(0, False)
+        self.journal.compact()
+        with open("journal_tasks.txt", 'r') as f:
+            lines = f.read().strip().split('\n')
+        self.assertEqual(["Hello!,5,0,False"], lines)
+        with open("journal_actions.txt", 'r') as f:
+            lines = f.read().strip().split('\n')
+        self.assertEqual(len(self.journal.actions), len(lines))
+
+class IntervalIndexController(unittest.TestCase):
+    def assertMatchesScan(self, index, actions):
+        now = datetime.datetime.now()
+        for day_start, num_days in [(None, None), (datetime.date.today(), 1), (datetime.date.today()-datetime.timedelta(days=4), 3), (datetime.date.today()-datetime.timedelta(days=8), None)]:
+            lo, hi = journal.micro_bounds(day_start, num_days)
+            for action_type in range(len(journal.action_codes)):
+                for action_key in range(-1, 4):
+                    self.assertEqual(scan_time_in_action(actions, action_type, action_key, day_start, num_days, now),
+                        index.total(action_type, action_key, lo, hi, journal_storage.to_micros(now)))
+
+    def test_build_matches_scan(self):
+        actions = random_actions(300, 4, 1)
+        index = journal.IntervalIndex()
+        index.build(actions)
+        self.assertMatchesScan(index, actions)
+
+    def test_build_unordered_matches_scan(self):
+        actions = random_actions(100, 4, 2)
+        actions[10], actions[50] = actions[50], actions[10]
+        index = journal.IntervalIndex()
+        index.build(actions)
+        self.assertFalse(index.ordered)
+        self.assertMatchesScan(index, actions)
+
+    def test_append_and_remove_last(self):
+        actions = random_actions(200, 4, 3)
+        index = journal.IntervalIndex()
+        for ix, action in enumerate(actions):
+            index.append(action)
+            if ix % 7 == 3:
+                index.remove_last()
+                index.append(action)
+        self.assertMatchesScan(index, actions)
+        for ix in range(50):
+            actions.pop()
+            index.remove_last()
+        self.assertMatchesScan(index, actions)
+
+    def test_rebuild_from(self):
+        actions = random_actions(200, 4, 6)
+        index = journal.IntervalIndex()
+        index.build(actions)
+        moved = actions.pop(150)
+        moved.dt = actions[40].dt
+        actions.insert(41, moved)
+        index.rebuild_from(actions, 41)
+        self.assertTrue(index.is_current(actions))
+        self.assertMatchesScan(index, actions)
+
+    def test_cumulative(self):
+        now = datetime.datetime.now()
+        for actions in [random_actions(200, 4, 9), random_actions(100, 4, 10)[::-1]]:
+            index = journal.IntervalIndex()
+            index.build(actions)
+            for ix in range(20):
+                actions.pop()
+                index.remove_last()
+            for action_type in range(len(journal.action_codes)):
+                for action_key in range(-1, 4):
+                    self.assertEqual(scan_time_in_action(actions, action_type, action_key, None, None, now),
+                        index.cumulative(action_type, action_key, journal_storage.to_micros(now)))
+
+    def test_interval_longer_than_a_day(self):
+        start = datetime.datetime(2019, 3, 4, 9)
+        actions = [journal.Action(journal.TASK_SWITCH, 0, start),
+            journal.Action(journal.TASK_PAUSE, -1, start + datetime.timedelta(days=1, hours=2, microseconds=500))]
+        index = journal.IntervalIndex()
+        index.build(actions)
+        self.assertEqual(26*3600, index.cumulative(journal.TASK_SWITCH, 0))
+        lo, hi = journal.micro_bounds(start.date(), 1)
+        self.assertEqual(26*3600, index.total(journal.TASK_SWITCH, -1, lo, hi))
+        self.assertEqual(start + datetime.timedelta(days=1, hours=2, microseconds=500), journal_storage.from_micros(index.ends[0]))
+
+    def test_journal_rebuilds_after_direct_change(self):
+        j = journal.Journal.__new__(journal.Journal)
+        j.tasks = []
+        j.actions = random_actions(50, 4, 4)
+        j.index = journal.IntervalIndex()
+        j.index.build(j.actions)
+        j.actions[20].dt -= datetime.timedelta(minutes=30)
+        self.assertFalse(j.index.is_current(j.actions))
+        self.assertEqual(scan_time_in_action(j.actions, journal.TASK_SWITCH, -1, None, None, datetime.datetime.now()),
+            j.count_time_in_action(journal.TASK_SWITCH, -1, None, None))
+
+class ReportController(unittest.TestCase):
+    def make_journal(self, seed):
+        j = journal.Journal.__new__(journal.Journal)
+        j.tasks = [journal.Task(name='task{0}'.format(ix), time=30) for ix in range(4)]
+        j.actions = random_actions(300, 4, seed)
+        j.index = journal.IntervalIndex()
+        return j
+
+    def test_report_data_matches_scan(self):
+        j = self.make_journal(5)
+        day_start = datetime.date.today()-datetime.timedelta(days=4)
+        data = j.report_data(day_start, 3)
+        now = datetime.datetime.now()
+        for task_id in range(4):
+            self.assertEqual(scan_time_in_action(j.actions, journal.TASK_SWITCH, task_id, day_start, 3, now),
+                data.task_times.get(task_id, 0))
+        for action_type in (journal.TASK_MEETING, journal.TASK_ADD_TASKS, journal.TASK_WALK, journal.TASK_LUNCH):
+            self.assertEqual(scan_time_in_action(j.actions, action_type, -1, day_start, 3, now),
+                data.category_time(action_type))
+        lo, hi = journal.day_bounds(day_start, 3)
+        self.assertEqual(min(a.dt for a in j.actions if lo <= a.dt < hi), data.first_action)
+
+    def test_report_data_empty_window(self):
+        j = self.make_journal(6)
+        data = j.report_data(datetime.date.today()+datetime.timedelta(days=60), 1)
+        self.assertEqual({}, data.task_times)
+        self.assertEqual(None, data.first_action)
+        self.assertEqual((0, 0), (data.num_overtime, data.overtime))
+
+class DayMatrixController(unittest.TestCase):
+    def make_journal(self, actions):
+        j = journal.Journal.__new__(journal.Journal)
+        j.tasks = [journal.Task(name='test_task', time=30)]
+        j.actions = actions
+        j.index = journal.IntervalIndex()
+        return j
+
+    def test_split_at_midnight(self):
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        j = self.make_journal([
+            journal.Action(action=journal.TASK_SWITCH, task_id=0, dt=today - datetime.timedelta(hours=1)),
+            journal.Action(action=journal.TASK_COMPLETED, task_id=0, dt=today - datetime.timedelta(minutes=30)),
+            journal.Action(action=journal.TASK_WALK, task_id=-1, dt=today + datetime.timedelta(hours=2)),
+            journal.Action(action=journal.TASK_PAUSE, task_id=-1, dt=today + datetime.timedelta(hours=2, minutes=15))])
+        matrix = j.day_matrix(datetime.date.today()-datetime.timedelta(days=1), 2)
+        self.assertEqual([3600, 0, 0, 0, 0], matrix[0])
+        self.assertEqual([2*3600, 15*60, 0, 0, 0], matrix[1])
+
+    def test_interval_starting_before_first_day(self):
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        j = self.make_journal([
+            journal.Action(action=journal.TASK_MEETING, task_id=-1, dt=today - datetime.timedelta(days=1, hours=2)),
+            journal.Action(action=journal.TASK_NEW, task_id=0, dt=today - datetime.timedelta(hours=5)),
+            journal.Action(action=journal.TASK_LUNCH, task_id=-1, dt=today + datetime.timedelta(minutes=10)),
+            journal.Action(action=journal.TASK_PAUSE, task_id=-1, dt=today + datetime.timedelta(minutes=40))])
+        matrix = j.day_matrix(datetime.date.today(), 1)
+        self.assertEqual([[0, 0, 0, 30*60, 10*60]], matrix)
+
+    def test_days_sum_to_totals(self):
+        actions = random_actions(300, 4, 7)
+        j = self.make_journal(actions)
+        first_day = actions[0].dt.date()
+        num_days = (datetime.date.today() - first_day).days + 1
+        matrix = j.day_matrix(first_day, num_days)
+        for col, action_type in enumerate(journal.calendar_categories):
+            expected = 0
+            for ix, action in enumerate(actions):
+                if action.action != action_type or action.dt.date() > datetime.date.today():
+                    continue
+                end = journal_storage.from_micros(j.index.ends[ix]) if j.index.ends[ix] is not None else datetime.datetime.now()
+                end = min(end, datetime.datetime.combine(datetime.date.today()+datetime.timedelta(days=1), datetime.time()))
+                expected += (end - action.dt).total_seconds()
+            self.assertTrue(abs(expected - sum(row[col] for row in matrix)) < 2*num_days + len(actions))
+
+class SqliteJournalController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = journal_storage.SqliteStorage(os.path.join(self.directory, 'journal.db'))
+        actions = random_actions(300, 4, 8)
+        with self.storage.transaction():
+            for task_id in range(4):
+                self.storage.append_task(task_id, journal.Task(name='task{0}'.format(task_id), time=30))
+            for action in actions:
+                if action.dt < datetime.datetime.now():
+                    self.storage.append_action(action)
+            journal.SqliteIndex(self.storage).build(journal.StoredActions(self.storage))
+        self.journal = journal.Journal(self.storage)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+
+    def assertMatchesScan(self):
+        actions = list(self.journal.actions)
+        now = datetime.datetime.now()
+        for day_start, num_days in [(None, None), (datetime.date.today(), 1), (datetime.date.today()-datetime.timedelta(days=4), 3)]:
+            for action_type in (journal.TASK_SWITCH, journal.TASK_WALK, journal.TASK_NEW):
+                for action_key in range(-1, 4):
+                    expected = scan_time_in_action(actions, action_type, action_key, day_start, num_days, now)
+                    actual = self.journal.count_time_in_action(action_type, action_key, day_start, num_days)
+                    self.assertTrue(abs(expected - actual) <= 1)
+
+    def test_actions_are_not_loaded(self):
+        self.assertTrue(isinstance(self.journal.actions, journal.StoredActions))
+        self.assertEqual(journal.TASK_ADD_TASKS, self.journal.actions[-1].action)
+        self.assertEqual(self.storage.count, len(list(self.journal.actions)))
+
+    def test_totals_match_scan(self):
+        self.journal.add_action(journal.TASK_SWITCH, 2)
+        self.journal.add_action(journal.TASK_COMPLETED, 2)
+        self.assertMatchesScan()
+
+    def test_pop_action(self):
+        self.journal.add_action(journal.TASK_WALK)
+        self.journal.pop_action()
+        self.journal.pop_action()
+        self.assertMatchesScan()
+        reopened = journal.Journal(journal_storage.SqliteStorage(self.storage.path))
+        self.assertEqual(len(self.journal.actions)+1, len(reopened.actions))
+
+    def test_move_action(self):
+        ix = len(self.journal.actions)-5
+        self.journal.move_action(ix, self.journal.actions[ix].dt - datetime.timedelta(hours=5))
+        actions = list(self.journal.actions)
+        self.assertEqual(sorted(action.dt for action in actions), [action.dt for action in actions])
+        self.assertMatchesScan()
+
+    def test_cumulative_totals_kept(self):
+        self.journal.count_time_in_action(journal.TASK_SWITCH, 0, None, None)
+        self.journal.add_action(journal.TASK_SWITCH, 1)
+        self.journal.add_action(journal.TASK_WALK)
+        self.journal.add_action(journal.TASK_NEW, 2)
+        self.journal.add_action(journal.TASK_LUNCH)
+        self.journal.pop_action()
+        self.assertEqual(self.storage.closed_totals(), self.journal.index.totals)
+        # all-time totals do not query the durations
+        self.storage.sum_durations = lambda *args: self.fail("all-time totals should be kept")
+        self.journal.interval_index().total = self.storage.sum_durations
+        for action_key in range(-1, 4):
+            self.journal.count_time_in_action(journal.TASK_SWITCH, action_key, None, None)
+
+    def test_report_matches_text_journal(self):
+        memory = journal.Journal.__new__(journal.Journal)
+        memory.tasks = self.journal.tasks
+        memory.actions = list(self.journal.actions)
+        memory.index = journal.IntervalIndex()
+        day_start = datetime.date.today()-datetime.timedelta(days=5)
+        expected = memory.report_data(day_start, 4)
+        actual = self.journal.report_data(day_start, 4)
+        self.assertEqual(expected.task_times, actual.task_times)
+        self.assertEqual(expected.category_times, actual.category_times)
+        self.assertEqual(expected.first_action, actual.first_action)
+        self.assertEqual(memory.day_matrix(day_start, 4), self.journal.day_matrix(day_start, 4))
+
+    def test_migrate_from_text(self):
+        text = journal_storage.TextStorage(self.directory)
+        text.rewrite(self.journal.tasks, self.journal.actions)
+        migrated = journal.migrate_to_sqlite(self.directory, os.path.join(self.directory, 'migrated.db'))
+        self.assertEqual(len(self.journal.actions), migrated.count)
+        self.assertEqual(self.storage.read_tasks(), migrated.read_tasks())
+        self.assertEqual(self.journal.count_time_in_action(journal.TASK_SWITCH, 1, None, None),
+            journal.SqliteIndex(migrated).total(journal.TASK_SWITCH, 1, None, None))
+        self.assertRaises(ValueError, journal.migrate_to_sqlite, self.directory, migrated.path)
+        migrated.close()
+
+class BinaryJournalController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = journal_storage.BinaryStorage(self.directory)
+        self.storage.write_actions((action.action, action.task_id, action.dt) for action in random_actions(300, 4, 9)
+            if action.dt < datetime.datetime.now())
+        for task_id in range(4):
+            self.storage.append_task(task_id, journal.Task(name='task{0}'.format(task_id), time=30))
+        self.journal = journal.Journal(self.storage)
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.directory)
+
+    def test_index_built_on_demand(self):
+        self.assertTrue(isinstance(self.journal.actions, journal.ActionStore))
+        self.assertEqual(0, len(self.journal.index.starts))
+        self.assertEqual(journal.TASK_ADD_TASKS, self.journal.actions[-1].action)
+        self.journal.count_time_in_action(journal.TASK_SWITCH, 0, None, None)
+        self.assertEqual(len(self.journal.actions), len(self.journal.index.starts))
+
+    def test_totals_match_scan(self):
+        self.journal.count_time_in_action(journal.TASK_SWITCH, 0, None, None)
+        self.journal.add_action(journal.TASK_SWITCH, 1)
+        self.journal.add_action(journal.TASK_WALK)
+        self.journal.pop_action()
+        ix = len(self.journal.actions)-10
+        self.journal.move_action(ix, self.journal.actions[ix].dt - datetime.timedelta(hours=3))
+        self.assertTrue(self.journal.index.is_current(self.journal.actions))
+
+        actions = list(self.journal.actions)
+        self.assertEqual(sorted(action.dt for action in actions), [action.dt for action in actions])
+        now = datetime.datetime.now()
+        for action_key in range(-1, 4):
+            self.assertTrue(abs(scan_time_in_action(actions, journal.TASK_SWITCH, action_key, None, None, now) -
+                self.journal.count_time_in_action(journal.TASK_SWITCH, action_key, None, None)) <= 1)
+
+    def test_move_action_unordered(self):
+        # the clocks went back an hour at the 200th action
+        actions = list(self.journal.actions)
+        for action in actions[200:]:
+            action.dt = action.dt - datetime.timedelta(hours=1)
+        self.storage.clear()
+        self.storage.write_actions((action.action, action.task_id, action.dt) for action in actions)
+        self.journal.reload()
+        self.assertFalse(self.journal.interval_index().ordered)
+        times = [action.dt for action in actions]
+
+        # moved past the next actions, not to the start of the log
+        new_dt = times[213] + datetime.timedelta(microseconds=1)
+        new_ix = self.journal.move_action(210, new_dt)
+        self.assertTrue(213 <= new_ix < 220)
+        self.assertEqual(new_dt, self.journal.actions[new_ix].dt)
+        self.assertEqual(times[211], self.journal.actions[210].dt)
+        self.assertEqual(len(actions), len(self.journal.actions))
+        self.assertEqual(0, self.journal.move_action(1, times[0] - datetime.timedelta(minutes=1)))
+        moved = [action.dt for action in self.journal.actions]
+        self.assertEqual(times[0] - datetime.timedelta(minutes=1), moved[0])
+        self.assertEqual(times[0], moved[1])
+
+    def test_reopen(self):
+        self.journal.add_action(journal.TASK_SWITCH, 1)
+        self.storage.close()
+        reopened = journal.Journal(journal_storage.BinaryStorage(self.directory))
+        self.assertEqual(journal.TASK_SWITCH, reopened.actions[-2].action)
+        self.assertEqual(1, reopened.actions[-2].task_id)
+        self.assertEqual(4, len(reopened.tasks))
+        reopened.storage.close()
+
+    def test_migrate_from_text(self):
+        directory = tempfile.mkdtemp()
+        try:
+            journal_storage.TextStorage(directory).rewrite(self.journal.tasks, self.journal.actions)
+            migrated = journal.migrate_to_binary(directory)
+            self.assertEqual([(a.action, a.task_id, a.dt) for a in self.journal.actions], list(migrated.read_actions()))
+            self.assertRaises(ValueError, journal.migrate_to_binary, directory)
+            migrated.close()
+        finally:
+            shutil.rmtree(directory)
+
+class SnapshotJournalController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        tasks = [journal.Task(name='task{0}'.format(task_id), time=30) for task_id in range(4)]
+        actions = [action for action in random_actions(300, 4, 10) if action.dt < datetime.datetime.now()]
+        journal_storage.TextStorage(self.directory).rewrite(tasks, actions)
+        self.journal = journal.Journal(journal_storage.TextStorage(self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        return journal.Journal(journal_storage.TextStorage(self.directory))
+
+    def assertTotalsMatch(self, reopened):
+        for action_type in (journal.TASK_SWITCH, journal.TASK_WALK, journal.TASK_ADD_TASKS):
+            for action_key in range(-1, 4):
+                self.assertTrue(abs(self.journal.count_time_in_action(action_type, action_key, None, None) -
+                    reopened.count_time_in_action(action_type, action_key, None, None)) <= 1)
+
+    def test_snapshot_replays_tail(self):
+        self.journal.add_action(journal.TASK_SWITCH, 1)
+        self.journal.close()
+        self.journal.add_action(journal.TASK_SWITCH, 2)
+        self.journal.add_task('task4', 10, journal.TASK_WORK_TYPE)
+        self.journal.set_task_completed(1, True)
+
+        reopened = self.reopen()
+        self.assertTrue(reopened.checkpoint is not None)
+        self.assertTrue(len(reopened.actions) < 10)
+        self.assertEqual(len(self.journal.actions)+1, reopened.action_offset()+len(reopened.actions))
+        self.assertEqual([(t.name, t.time, t.completed) for t in self.journal.tasks], [(t.name, t.time, t.completed) for t in reopened.tasks])
+        self.assertTotalsMatch(reopened)
+        self.assertTrue(reopened.checkpoint is not None)
+
+    def test_history_loaded_for_old_windows(self):
+        self.journal.close()
+        reopened = self.reopen()
+        day_start = datetime.date.today()-datetime.timedelta(days=8)
+        self.assertEqual(self.journal.count_time_in_action(journal.TASK_SWITCH, -1, day_start, 3),
+            reopened.count_time_in_action(journal.TASK_SWITCH, -1, day_start, 3))
+        self.assertTrue(reopened.checkpoint is None)
+        self.assertEqual(len(self.journal.actions)+1, len(reopened.actions))
+
+    def listed_actions(self, j, num_actions):
+        save_input = journal.input
+        journal.input = lambda s: str(num_actions)
+        printed.truncate(0)
+        printed.seek(0)
+        try:
+            j.list_actions()
+        finally:
+            journal.input = save_input
+        return printed.getvalue()
+
+    def test_list_actions_pages_history(self):
+        self.journal.close()
+        reopened = self.reopen()
+        full = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        full.load_history()
+        # the actions before the snapshot are read back from it
+        reopened.storage.chunk_size = 256
+        for num_actions in [100, 1000]:
+            self.assertEqual(self.listed_actions(full, num_actions), self.listed_actions(reopened, num_actions))
+            self.assertTrue(reopened.checkpoint is not None)
+
+    def test_list_actions_after_correction(self):
+        self.journal.add_action(journal.TASK_WALK)
+        self.journal.pop_action()
+        self.journal.close()
+        reopened = self.reopen()
+        full = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        full.load_history()
+        self.assertEqual(self.listed_actions(full, 5), self.listed_actions(reopened, 5))
+        # the correction is only applied by reading from the start
+        self.assertTrue(reopened.checkpoint is None)
+
+    def test_compact_drops_snapshot(self):
+        self.journal.close()
+        reopened = self.reopen()
+        reopened.compact()
+        self.assertEqual(None, reopened.storage.read_snapshot())
+        self.assertTrue(self.reopen().checkpoint is None)
+        self.assertTotalsMatch(self.reopen())
+
+    def test_periodic_snapshot(self):
+        periodic = journal.Journal(journal_storage.TextStorage(self.directory), snapshot_interval=3)
+        periodic.add_action(journal.TASK_SWITCH, 0)
+        self.assertEqual(None, periodic.storage.read_snapshot())
+        periodic.add_action(journal.TASK_WALK)
+        snapshot = periodic.storage.read_snapshot()
+        self.assertEqual(len(periodic.actions), snapshot['count'])
+        self.assertEqual([[journal.TASK_WALK, -1, journal_storage.to_micros(periodic.actions[-1].dt)]], snapshot['open'])
+        # not in the middle of a batch
+        with periodic.batch():
+            for action in [journal.TASK_LUNCH, journal.TASK_WALK, journal.TASK_PAUSE, journal.TASK_WALK]:
+                periodic.add_action(action)
+            self.assertEqual(snapshot, periodic.storage.read_snapshot())
+        self.assertEqual(len(periodic.actions), periodic.storage.read_snapshot()['count'])
+
+class SegmentController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rand = random.Random(21)
+        self.tasks = [journal.Task(name='task{0}'.format(task_id), time=600) for task_id in range(4)]
+        # about four and a half months, the last two stay live
+        dt = datetime.datetime(2019, 1, 20, 9)
+        self.actions = []
+        while dt < datetime.datetime(2019, 6, 3):
+            code = rand.choice(range(len(journal.action_codes)))
+            task_id = rand.randrange(len(self.tasks)) if code in (journal.TASK_NEW, journal.TASK_SWITCH, journal.TASK_COMPLETED) else -1
+            self.actions.append(journal.Action(code, task_id, dt))
+            dt += datetime.timedelta(hours=rand.randint(0, 9), minutes=rand.randint(0, 59), seconds=rand.randint(0, 59))
+        self.actions.append(journal.Action(journal.TASK_SWITCH, 0, dt))
+        self.now = journal_storage.to_micros(dt + datetime.timedelta(hours=1))
+
+        full_directory = os.path.join(self.directory, 'full')
+        os.mkdir(full_directory)
+        journal_storage.TextStorage(full_directory).rewrite(self.tasks, self.actions)
+        self.full = journal.Journal(journal_storage.TextStorage(full_directory), start=False)
+        journal_storage.TextStorage(self.directory).rewrite(self.tasks, self.actions)
+        self.journal = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.journal.rotate()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reopen(self):
+        return journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+
+    def report(self, j, day_start, num_days):
+        data = j.report_data(day_start, num_days)
+        return (data.first_action, data.category_times, data.task_times, data.num_overtime, data.overtime)
+
+    def test_rotate(self):
+        self.assertEqual(['2019-01', '2019-02', '2019-03', '2019-04'], [segment.name for segment in self.journal.archive.segments])
+        self.assertEqual(datetime.date(2019, 5, 1), self.journal.actions[0].dt.date())
+        self.assertEqual(len(self.actions), self.journal.action_offset() + len(self.journal.actions))
+        # all but the newest two are compressed
+        self.assertEqual([True, True, False, False], [os.path.exists(self.journal.storage.segment_paths(segment.name)[2]) for segment in self.journal.archive.segments])
+        reopened = self.reopen()
+        self.assertEqual(len(self.journal.actions), len(reopened.actions))
+        self.assertEqual(4, len(reopened.archive.segments))
+        # nothing left to rotate
+        reopened.rotate()
+        self.assertEqual(4, len(self.reopen().archive.segments))
+
+    def test_totals_match_full_log(self):
+        for action_type in (journal.TASK_SWITCH, journal.TASK_WALK, journal.TASK_NEW):
+            for action_key in range(-1, 4):
+                self.assertEqual(self.full.total_time(action_type, action_key, None, None, self.now),
+                    self.journal.total_time(action_type, action_key, None, None, self.now))
+                for day_start, num_days in [(datetime.date(2019, 2, 1), 28), (datetime.date(2019, 2, 10), 40), (datetime.date(2019, 4, 25), 10)]:
+                    lo, hi = journal.micro_bounds(day_start, num_days)
+                    self.assertEqual(self.full.total_time(action_type, action_key, lo, hi, self.now),
+                        self.journal.total_time(action_type, action_key, lo, hi, self.now))
+
+    def test_covered_segments_are_not_read(self):
+        reopened = self.reopen()
+        # nor is the live log indexed before a query needs it
+        self.assertEqual(0, len(reopened.index.starts))
+        self.assertEqual(self.report(self.full, datetime.date(2019, 2, 1), 59), self.report(reopened, datetime.date(2019, 2, 1), 59))
+        self.assertEqual(self.full.first_action(datetime.date(2019, 2, 12), 3), reopened.first_action(datetime.date(2019, 2, 12), 3))
+        self.assertEqual(self.full.day_matrix(datetime.date(2019, 1, 15), 100), reopened.day_matrix(datetime.date(2019, 1, 15), 100))
+        self.assertEqual({}, reopened.archive.loaded)
+        self.assertEqual(len(reopened.actions), len(reopened.index.starts))
+
+        # only the edges of the period are read
+        self.assertEqual(self.report(self.full, datetime.date(2019, 2, 10), 40), self.report(reopened, datetime.date(2019, 2, 10), 40))
+        self.assertEqual(['2019-02', '2019-03'], sorted(reopened.archive.loaded))
+
+    def test_cache_is_capped(self):
+        segments = self.journal.archive.segments
+        cache_bytes = max(segment.count for segment in segments[:3]) * 2 * journal.Archive.action_bytes
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False, cache_bytes=cache_bytes)
+        self.assertEqual(self.report(self.full, datetime.date(2019, 2, 10), 40), self.report(reopened, datetime.date(2019, 2, 10), 40))
+        self.assertEqual(['2019-02', '2019-03'], list(reopened.archive.loaded))
+        # the least recently used segment makes room
+        self.assertEqual(self.report(self.full, datetime.date(2019, 1, 25), 3), self.report(reopened, datetime.date(2019, 1, 25), 3))
+        self.assertEqual(['2019-03', '2019-01'], list(reopened.archive.loaded))
+        self.assertTrue(reopened.archive.loaded_bytes <= cache_bytes)
+        self.assertEqual(self.report(self.full, datetime.date(2019, 2, 10), 40), self.report(reopened, datetime.date(2019, 2, 10), 40))
+
+    def test_list_actions(self):
+        save_input = journal.input
+        journal.input = lambda s: str(len(self.actions))
+        printed.truncate(0)
+        printed.seek(0)
+        try:
+            self.journal.list_actions()
+        finally:
+            journal.input = save_input
+        lines = printed.getvalue().splitlines()
+        self.assertEqual(len(self.actions)+1, len(lines))
+        self.assertTrue(lines[-1].strip().startswith('0: Sun Jan 20 2019 09:00:00'))
+
+    def test_archived_actions_are_not_changed(self):
+        self.assertRaises(ValueError, self.journal.move_action, len(self.journal.actions)-1, datetime.datetime(2019, 4, 30))
+        self.assertRaises(ValueError, self.journal.move_action, 0, self.journal.actions[0].dt + datetime.timedelta(minutes=1))
+        self.journal.move_action(len(self.journal.actions)-1, self.journal.actions[-1].dt - datetime.timedelta(minutes=1))
+
+    def test_rotate_after_command(self):
+        actions = self.journal.archive.read(0, self.journal.archive.count) + self.journal.actions
+        storage = journal_storage.TextStorage(self.directory)
+        storage.clear()
+        storage.rewrite(self.tasks, actions[:-1])
+        j = journal.Journal(storage, start=False)
+        self.assertEqual([], j.archive.segments)
+        j.clock = actions[-1].dt
+        save_input = journal.input
+        journal.input = lambda s: 'n'
+        try:
+            journal.dispatch(j, 'z')
+        finally:
+            journal.input = save_input
+        self.assertEqual(4, len(j.archive.segments))
+        self.assertEqual(len(self.journal.actions), len(j.actions))
+
+    def test_first_action_of_month_stays_live(self):
+        # the first command of a month archives May but not June, whose
+        # last interval it closes
+        self.journal.clock = datetime.datetime(2019, 7, 1, 9)
+        self.journal.add_action(journal.TASK_SWITCH, 1)
+        self.journal.rotate_if_due()
+        self.assertEqual('2019-05', self.journal.archive.segments[-1].name)
+        self.assertEqual(datetime.date(2019, 6, 1), self.journal.actions[0].dt.date())
+        self.journal.remove_last_action('y')
+        self.assertEqual(datetime.date(2019, 6, 3), self.journal.actions[-1].dt.date())
+
+    def test_interrupted_rotation(self):
+        # the segments were written but the live log was not cut
+        self.journal.storage.rewrite(self.tasks, self.actions)
+        size = os.path.getsize(self.journal.storage.actions_path)
+        read_only = journal.Journal(journal_storage.TextStorage(self.directory, read_only=True), start=False)
+        self.assertEqual(len(self.journal.actions), len(read_only.actions))
+        self.assertEqual(size, os.path.getsize(self.journal.storage.actions_path))
+        reopened = self.reopen()
+        self.assertEqual(len(self.journal.actions), len(reopened.actions))
+        self.assertEqual(len(self.journal.actions), len(self.reopen().actions))
+
+class CountingStorage(journal_storage.TextStorage):
+    """ TextStorage that remembers how many records every write carried """
+    def __init__(self, directory):
+        journal_storage.TextStorage.__init__(self, directory)
+        self.writes = []
+
+    def write_record(self, path, record):
+        if self.pending is None:
+            self.writes.append(1)
+        journal_storage.TextStorage.write_record(self, path, record)
+
+    def flush(self):
+        if self.pending:
+            self.writes.append(len(self.pending))
+        journal_storage.TextStorage.flush(self)
+
+class BatchController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_values = []
+        self.save_input = journal.input
+        def mock_input(s):
+            return self.input_values.pop(0)
+        journal.input = mock_input
+
+    def tearDown(self):
+        journal.input = self.save_input
+        shutil.rmtree(self.directory)
+
+    def sizes(self, storage):
+        return [os.path.getsize(path) for path in [storage.tasks_path, storage.actions_path]]
+
+    def test_batch_persists_at_end(self):
+        j = journal.Journal(journal_storage.TextStorage(self.directory))
+        before = self.sizes(j.storage)
+        with j.batch():
+            task_id = j.add_task('test_task', 10, journal.TASK_WORK_TYPE)
+            j.add_action(journal.TASK_SWITCH, task_id)
+            with j.batch():
+                j.add_action(journal.TASK_WALK)
+            self.assertEqual(before, self.sizes(j.storage))
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory))
+        self.assertEqual(1, len(reopened.tasks))
+        self.assertEqual([journal.TASK_SWITCH, journal.TASK_WALK], [action.action for action in reopened.actions[-3:-1]])
+
+    def assertRollsBack(self, make_storage):
+        j = journal.Journal(make_storage())
+        j.add_task('test_task', 10, journal.TASK_WORK_TYPE)
+        j.add_action(journal.TASK_SWITCH, 0)
+        j.cur_action, j.cur_action_key = journal.TASK_SWITCH, 0
+        num_actions = len(j.actions)
+        total = j.count_time_in_action(journal.TASK_SWITCH, 0, None, None)
+        try:
+            with j.batch():
+                j.add_task('other_task', 10, journal.TASK_WORK_TYPE)
+                j.set_task_completed(0, True)
+                j.add_action(journal.TASK_WALK)
+                j.cur_action = journal.TASK_WALK
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(1, len(j.tasks))
+        self.assertFalse(j.tasks[0].completed)
+        self.assertEqual(num_actions, len(j.actions))
+        self.assertEqual((journal.TASK_SWITCH, 0), (j.cur_action, j.cur_action_key))
+        self.assertTrue(j.count_time_in_action(journal.TASK_SWITCH, 0, None, None) >= total)
+        j.add_action(journal.TASK_LUNCH)
+        self.assertEqual(journal.TASK_LUNCH, j.actions[num_actions].action)
+        j.storage.close()
+
+        reopened = journal.Journal(make_storage())
+        self.assertEqual(1, len(reopened.tasks))
+        self.assertFalse(reopened.tasks[0].completed)
+        self.assertEqual([journal.TASK_SWITCH, journal.TASK_LUNCH], [action.action for action in reopened.actions[num_actions-1:num_actions+1]])
+        reopened.storage.close()
+
+    def test_text_rollback(self):
+        self.assertRollsBack(lambda: journal_storage.TextStorage(self.directory))
+
+    def test_binary_rollback(self):
+        self.assertRollsBack(lambda: journal_storage.BinaryStorage(self.directory))
+
+    def test_sqlite_rollback(self):
+        self.assertRollsBack(lambda: journal_storage.SqliteStorage(os.path.join(self.directory, 'journal.db')))
+
+    def test_background_writes_before_quit(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.start_writer()
+        j = journal.Journal(storage)
+        self.input_values = ['test_task', '10']
+        journal.dispatch(j, 'ws')
+        self.assertTrue(journal.dispatch(j, 'zn'))
+        self.assertFalse(journal.dispatch(j, 'qn'))
+        self.assertEqual(0, storage.writer.queue.unfinished_tasks)
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory))
+        self.assertEqual([journal.TASK_NEW, journal.TASK_SWITCH, journal.TASK_PAUSE, journal.TASK_PAUSE],
+            [action.action for action in reopened.actions[-5:-1]])
+        storage.close()
+
+    def test_combined_command_writes_once(self):
+        j = journal.Journal(CountingStorage(self.directory))
+        j.storage.writes = []
+        self.input_values = ['test_task', '10']
+        journal.run_command(j, 'aws')
+        self.assertEqual([4], j.storage.writes)
+        self.assertEqual(journal.TASK_SWITCH, j.cur_action)
+        self.assertEqual(0, j.cur_action_key)
+
+class SharedJournalController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.save_input = journal.input
+
+    def tearDown(self):
+        journal.input = self.save_input
+        shutil.rmtree(self.directory)
+
+    def test_follow_merges_appends(self):
+        first = journal.Journal(journal_storage.TextStorage(self.directory))
+        second = journal.Journal(journal_storage.TextStorage(self.directory))
+        with first.batch():
+            first.add_task('test_task', 10, journal.TASK_WORK_TYPE)
+            first.add_action(journal.TASK_SWITCH, 0)
+        # only the appended records are read
+        second.reload = lambda: self.fail("the journal should not be read again")
+        with second.batch():
+            second.add_action(journal.TASK_WALK)
+        self.assertEqual(['test_task'], [task.name for task in second.tasks])
+        self.assertEqual([journal.TASK_ADD_TASKS, journal.TASK_ADD_TASKS, journal.TASK_SWITCH, journal.TASK_WALK],
+            [action.action for action in second.actions])
+        self.assertTrue(second.count_time_in_action(journal.TASK_SWITCH, 0, None, None) >= 0)
+        with first.batch():
+            first.set_task_completed(0, True)
+        self.assertEqual(4, len(first.actions))
+        with second.batch():
+            pass
+        self.assertTrue(second.tasks[0].completed)
+        # the tasks that did not change are kept as they are
+        task = second.tasks[0]
+        with first.batch():
+            first.add_task('other_task', 10, journal.TASK_WORK_TYPE)
+        with second.batch():
+            pass
+        self.assertTrue(task is second.tasks[0])
+        self.assertEqual(['test_task', 'other_task'], [task.name for task in second.tasks])
+
+    def test_background_conflict_reloads(self):
+        first = journal.Journal(journal_storage.TextStorage(self.directory))
+        second = journal.Journal(journal_storage.TextStorage(self.directory))
+        second.storage.start_writer()
+        with first.batch():
+            first.add_action(journal.TASK_LUNCH)
+        # the writer finds the lunch it has not read and leaves the walk out
+        second.add_action(journal.TASK_WALK)
+        second.storage.sync()
+        self.assertEqual(1, len(second.storage.write_errors()))
+        with second.batch():
+            pass
+        self.assertEqual([journal.TASK_ADD_TASKS, journal.TASK_ADD_TASKS, journal.TASK_LUNCH],
+            [action.action for action in second.actions])
+        with second.batch():
+            second.add_action(journal.TASK_WALK)
+        second.storage.close()
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual([journal.TASK_ADD_TASKS, journal.TASK_ADD_TASKS, journal.TASK_LUNCH, journal.TASK_WALK],
+            [action.action for action in reopened.actions])
+
+    def test_conflicting_command_is_not_saved(self):
+        first = journal.Journal(journal_storage.TextStorage(self.directory))
+        second = journal.Journal(journal_storage.TextStorage(self.directory))
+        values = ['test_task', '10']
+        def input_while_other_writes(s):
+            with first.batch():
+                first.add_action(journal.TASK_WALK)
+            return values.pop(0)
+        journal.input = input_while_other_writes
+        self.assertTrue(journal.dispatch(second, 'ws'))
+        self.assertEqual(0, len(second.tasks))
+        self.assertEqual([journal.TASK_ADD_TASKS, journal.TASK_ADD_TASKS, journal.TASK_WALK, journal.TASK_WALK],
+            [action.action for action in second.actions])
+        # outside a batch nothing is merged before writing
+        first.add_action(journal.TASK_LUNCH)
+        self.assertRaises(journal_storage.JournalChanged, second.add_action, journal.TASK_LUNCH)
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual(0, len(reopened.tasks))
+        self.assertEqual(5, len(reopened.actions))
+
+    def test_compaction_reloads_other(self):
+        first = journal.Journal(journal_storage.TextStorage(self.directory))
+        second = journal.Journal(journal_storage.TextStorage(self.directory))
+        with first.batch():
+            first.add_task('test_task', 10, journal.TASK_WORK_TYPE)
+            first.set_task_completed(0, True)
+        first.compact()
+        with second.batch():
+            second.add_action(journal.TASK_WALK)
+        self.assertTrue(second.tasks[0].completed)
+        self.assertEqual(3, len(second.actions))
+        with first.batch():
+            pass
+        self.assertEqual(3, len(first.actions))
+
+    def test_binary_follow(self):
+        first = journal.Journal(journal_storage.BinaryStorage(self.directory))
+        second = journal.Journal(journal_storage.BinaryStorage(self.directory))
+        with first.batch():
+            first.add_task('test_task', 10, journal.TASK_WORK_TYPE)
+            first.add_action(journal.TASK_SWITCH, 0)
+        with second.batch():
+            second.add_action(journal.TASK_WALK)
+        self.assertEqual(1, len(second.tasks))
+        self.assertEqual([journal.TASK_ADD_TASKS, journal.TASK_ADD_TASKS, journal.TASK_SWITCH, journal.TASK_WALK],
+            [action.action for action in second.actions])
+        self.assertTrue(second.count_time_in_action(journal.TASK_SWITCH, 0, None, None) >= 0)
+        first.storage.close()
+        second.storage.close()
+
+    def test_sqlite_follow(self):
+        path = os.path.join(self.directory, 'journal.db')
+        first = journal.Journal(journal_storage.SqliteStorage(path))
+        second = journal.Journal(journal_storage.SqliteStorage(path))
+        with first.batch():
+            first.add_task('test_task', 10, journal.TASK_WORK_TYPE)
+            first.add_action(journal.TASK_SWITCH, 0)
+        with second.batch():
+            second.add_action(journal.TASK_WALK)
+        self.assertEqual(1, len(second.tasks))
+        self.assertEqual(4, len(second.actions))
+        self.assertEqual(journal.TASK_WALK, second.actions[3].action)
+        first.storage.close()
+        second.storage.close()
+
+    def test_sqlite_conflicting_command_is_not_saved(self):
+        path = os.path.join(self.directory, 'journal.db')
+        first = journal.Journal(journal_storage.SqliteStorage(path))
+        second = journal.Journal(journal_storage.SqliteStorage(path))
+        values = ['test_task', '10']
+        def input_while_other_writes(s):
+            with first.batch():
+                first.add_action(journal.TASK_WALK)
+            return values.pop(0)
+        journal.input = input_while_other_writes
+        self.assertTrue(journal.dispatch(second, 'ws'))
+        self.assertEqual(0, len(second.tasks))
+        self.assertEqual([journal.TASK_ADD_TASKS, journal.TASK_ADD_TASKS, journal.TASK_WALK, journal.TASK_WALK],
+            [action.action for action in second.actions])
+
+        # a command does not wait for the other process to commit
+        second.storage.conn.execute('PRAGMA busy_timeout = 0')
+        with first.batch():
+            first.add_action(journal.TASK_LUNCH)
+            self.assertTrue(journal.dispatch(second, 'z'))
+        self.assertTrue(journal.dispatch(second, 'z'))
+        self.assertEqual([journal.TASK_LUNCH, journal.TASK_PAUSE], [action.action for action in second.actions[-2:]])
+        self.assertEqual(6, journal.Journal(journal_storage.SqliteStorage(path), start=False).storage.count)
+        first.storage.close()
+        second.storage.close()
+
+class CorrectionController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = journal_storage.TextStorage(self.directory)
+        tasks = [journal.Task(name='task{0}'.format(ix), time=30) for ix in range(4)]
+        self.storage.rewrite(tasks, random_actions(300, 4, 7))
+        self.journal = journal.Journal(self.storage, start=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertMatchesReopened(self):
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual([(a.action, a.task_id, a.dt) for a in self.journal.actions], [(a.action, a.task_id, a.dt) for a in reopened.actions])
+        for action_key in range(-1, 4):
+            self.assertEqual(reopened.count_time_in_action(journal.TASK_SWITCH, action_key, None, None),
+                self.journal.count_time_in_action(journal.TASK_SWITCH, action_key, None, None))
+
+    def test_move_appends_correction(self):
+        inode = os.stat(self.storage.actions_path).st_ino
+        size = os.path.getsize(self.storage.actions_path)
+        expected = [(a.action, a.task_id, a.dt) for a in self.journal.actions]
+        moved = expected[250]
+        new_dt = expected[100][2]
+        expected[250] = (moved[0], moved[1], new_dt)
+        expected.sort(key=lambda action: action[2])
+
+        self.assertEqual(101, self.journal.move_action(250, new_dt))
+        self.assertEqual(expected, [(a.action, a.task_id, a.dt) for a in self.journal.actions])
+        self.assertEqual(inode, os.stat(self.storage.actions_path).st_ino)
+        with open(self.storage.actions_path, 'r') as f:
+            f.seek(size)
+            self.assertEqual(['M,250,101,{0:%Y-%m-%d %H:%M:%S.%f}\n'.format(new_dt)], f.readlines())
+        self.assertMatchesReopened()
+
+        # forward, in front of the action it ties with
+        self.assertEqual(199, self.journal.move_action(10, self.journal.actions[200].dt))
+        self.assertEqual(self.journal.actions[199].dt, self.journal.actions[200].dt)
+        self.assertMatchesReopened()
+
+    def test_pop_appends_correction(self):
+        self.journal.pop_action()
+        self.journal.pop_action()
+        self.assertEqual(298, len(self.journal.actions))
+        with open(self.storage.actions_path, 'r') as f:
+            self.assertEqual(['P\n', 'P\n'], f.readlines()[-2:])
+        self.assertMatchesReopened()
+
+    def test_correction_after_snapshot(self):
+        self.journal.write_snapshot()
+        self.journal.move_action(299, self.journal.actions[298].dt - datetime.timedelta(minutes=1))
+        self.assertFalse(os.path.exists(self.storage.snapshot_path))
+        self.assertMatchesReopened()
+
+        # a snapshot written while another process holds a correction
+        other = journal_storage.TextStorage(self.directory)
+        other.read_tasks()
+        first = other.read_actions()[0]
+        with other.transaction():
+            other.move_action(0, 1, self.journal.actions[1].dt)
+            self.journal.write_snapshot()
+        self.assertTrue(os.path.exists(self.storage.snapshot_path))
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual(None, reopened.checkpoint)
+        self.assertEqual(300, len(reopened.actions))
+        self.assertEqual((first[0], first[1]), (reopened.actions[1].action, reopened.actions[1].task_id))
+
+class ReplayController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.journal = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_script_line(self):
+        self.assertEqual((datetime.datetime(2019, 3, 4, 9, 30), 'w', ['Write, then read', '30']),
+            journal.parse_script_line('2019-03-04 09:30 w | Write, then read | 30'))
+        self.assertEqual((datetime.datetime(2019, 3, 4, 9, 30, 15), 'sw1', []), journal.parse_script_line('2019-03-04T09:30:15 sw1'))
+        self.assertEqual((None, 'sw1', ['y']), journal.parse_script_line('sw1 | y'))
+
+    def test_replay(self):
+        script = ['# a day',
+            '2019-03-04 09:00 w | Write report | 30',
+            '2019-03-04 09:00 p | Groceries | 20',
+            '2019-03-04 09:05 sw0',
+            '',
+            '2019-03-04 10:05 sl | y',
+            '2019-03-04 10:35 sp1',
+            '2019-03-04 11:00 z | n']
+        summary = journal.replay(self.journal, script)
+        self.assertEqual(6, summary.num_commands)
+        self.assertEqual({'w': 1, 'p': 1, 's': 3, 'z': 1}, summary.commands)
+        self.assertEqual(7, summary.num_actions)
+        self.assertEqual(2, summary.num_tasks)
+        self.assertEqual(datetime.datetime(2019, 3, 4, 9), summary.first_dt)
+        self.assertEqual(datetime.datetime(2019, 3, 4, 11), summary.last_dt)
+        self.assertTrue(self.journal.tasks[0].completed)
+        self.assertEqual(journal.TASK_PAUSE, self.journal.cur_action)
+
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual(3600, reopened.count_time_in_action(journal.TASK_SWITCH, 0, datetime.date(2019, 3, 4), 1))
+        self.assertEqual(1500, reopened.count_time_in_action(journal.TASK_SWITCH, 1, datetime.date(2019, 3, 4), 1))
+        self.assertEqual(1800, reopened.count_time_in_action(journal.TASK_LUNCH, -1, datetime.date(2019, 3, 4), 1))
+
+    def test_scripts_carry_on(self):
+        journal.replay(self.journal, ['2019-03-04 09:00 w | Write report | 30', '2019-03-04 09:05 sw0'])
+        # the next run is still working on the task, so it is asked about it
+        second = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual((journal.TASK_SWITCH, 0), (second.cur_action, second.cur_action_key))
+        journal.replay(second, ['2019-03-04 10:05 sk | y'])
+        self.assertTrue(second.tasks[0].completed)
+        third = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual((journal.TASK_WALK, -1), (third.cur_action, third.cur_action_key))
+        self.assertTrue(third.tasks[0].completed)
+
+    def assertScriptFails(self, script, line_number):
+        try:
+            journal.replay(self.journal, script)
+            self.fail("the script should have failed")
+        except ValueError as e:
+            self.assertTrue(str(e).startswith('line {0}:'.format(line_number)))
+        self.assertEqual(0, len(self.journal.tasks))
+        self.assertEqual(0, len(self.journal.actions))
+        self.assertEqual(0, os.path.getsize(self.journal.storage.actions_path))
+        self.assertTrue(journal.input is self.input)
+
+    def test_failing_script_changes_nothing(self):
+        self.input = journal.input
+        self.assertScriptFails(['2019-03-04 09:00 w | Write report | 30', '2019-03-04 09:05 sw0 | extra'], 2)
+        self.assertScriptFails(['2019-03-04 09:00 w | Write report'], 1)
+        self.assertScriptFails(['2019-03-04 09:00 w | Write report | 30', '2019-03-04 08:00 sw0'], 2)
+        self.assertScriptFails(['2019-03-04 09:00 k'], 1)
+
 suite = unittest.TestSuite()
 suite.addTest(unittest.makeSuite(JournalController))
+suite.addTest(unittest.makeSuite(IntervalIndexController))
+suite.addTest(unittest.makeSuite(ReportController))
+suite.addTest(unittest.makeSuite(DayMatrixController))
+suite.addTest(unittest.makeSuite(SqliteJournalController))
+suite.addTest(unittest.makeSuite(BinaryJournalController))
+suite.addTest(unittest.makeSuite(SnapshotJournalController))
+suite.addTest(unittest.makeSuite(SegmentController))
+suite.addTest(unittest.makeSuite(BatchController))
+suite.addTest(unittest.makeSuite(SharedJournalController))
+suite.addTest(unittest.makeSuite(CorrectionController))
+suite.addTest(unittest.makeSuite(ReplayController))
 unittest.TextTestRunner(verbosity=2).run(suite)
 
 sys.stdout = saved
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+
+import unittest
+import datetime
+import shutil
+import tempfile
+
+import journal
+import journal_analytics
+import journal_benchmark
+import journal_storage
+
+def report_tuple(data):
+    return (data.first_action, data.category_times, data.task_times, data.num_overtime, data.overtime)
+
+@unittest.skipUnless(journal_analytics.available(), "NumPy is not installed")
+class AnalyticsController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.today = datetime.date.today()
+        tasks, actions = journal_benchmark.generate_history(years=1, num_tasks=200, end=self.today)
+        # reports that end before today do not depend on the time they run
+        self.midnight = datetime.datetime.combine(self.today, datetime.time())
+        actions.append(journal.Action(journal.TASK_ADD_TASKS, -1, self.midnight))
+        journal_storage.TextStorage(self.directory).rewrite(tasks, actions)
+        self.journal = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.journal.numpy_min_actions = 0
+
+    def tearDown(self):
+        self.journal.storage.close()
+        shutil.rmtree(self.directory)
+
+    def both(self, function):
+        """
+        function(journal) with the NumPy backend and with the loops
+        """
+        with_numpy = function(self.journal)
+        self.journal.use_numpy = False
+        try:
+            return with_numpy, function(self.journal)
+        finally:
+            self.journal.use_numpy = True
+
+    def test_report_matches_loops(self):
+        for day_start, num_days in [(self.today - datetime.timedelta(days=40), 30), (self.today - datetime.timedelta(days=1), 1), (self.today - datetime.timedelta(days=400), 400)]:
+            with_numpy, with_loops = self.both(lambda j: report_tuple(j.report_data(day_start, num_days)))
+            self.assertEqual(with_loops, with_numpy)
+        self.assertTrue(with_numpy[3] > 0)
+
+    def test_day_matrix_matches_loops(self):
+        first_day = self.today - datetime.timedelta(days=120)
+        with_numpy, with_loops = self.both(lambda j: j.day_matrix(first_day, 100))
+        self.assertEqual(with_loops, with_numpy)
+        self.assertTrue(any(any(row) for row in with_numpy))
+
+    def test_intervals_over_days(self):
+        # switches that run over several midnights, and an unordered log
+        start = datetime.datetime.combine(self.today - datetime.timedelta(days=10), datetime.time(22, 30))
+        first_day = self.today - datetime.timedelta(days=12)
+        before = self.journal.day_matrix(first_day, 12)
+        self.journal.clock = start
+        self.journal.add_action(journal.TASK_SWITCH, 0)
+        self.journal.clock = start + datetime.timedelta(days=2, hours=3, seconds=1, microseconds=999999)
+        self.journal.add_action(journal.TASK_MEETING)
+        self.journal.clock = start + datetime.timedelta(hours=1)
+        self.journal.add_action(journal.TASK_WALK)
+        self.journal.clock = self.midnight
+        self.journal.add_action(journal.TASK_PAUSE)
+        with_numpy, with_loops = self.both(lambda j: (j.day_matrix(first_day, 12), report_tuple(j.report_data(first_day, 12))))
+        self.assertEqual(with_loops, with_numpy)
+        self.assertEqual(5400, with_numpy[0][2][0] - before[2][0])
+        self.assertEqual(86400, with_numpy[0][3][0] - before[3][0])
+
+    def test_arrays_follow_changes(self):
+        arrays = self.journal.analytics(0, 0)
+        num_actions = len(arrays.codes)
+        rewrites = arrays.rewrites
+        self.journal.add_action(journal.TASK_WALK)
+        self.assertEqual(num_actions+1, len(self.journal.analytics(0, 0).codes))
+        self.assertEqual(rewrites, arrays.rewrites)
+
+        self.journal.pop_action()
+        self.journal.pop_action()
+        self.assertEqual(num_actions-1, len(self.journal.analytics(0, 0).codes))
+        self.journal.actions[-1].dt = self.journal.actions[-1].dt - datetime.timedelta(minutes=5)
+        self.assertEqual(self.journal.actions[-1].ts, self.journal.analytics(0, 0).starts[-1])
+        # close the last interval at midnight again, so that the report up to
+        # today does not depend on when each backend runs it
+        self.journal.clock = self.midnight
+        self.journal.add_action(journal.TASK_PAUSE)
+        with_numpy, with_loops = self.both(lambda j: report_tuple(j.report_data(self.today - datetime.timedelta(days=400), 400)))
+        self.assertEqual(with_loops, with_numpy)
+
+    def test_add_day_pieces(self):
+        column = journal_analytics.numpy.zeros(4, dtype=journal_analytics.numpy.int64)
+        day = journal_analytics.MICROS_PER_DAY
+        starts = journal_analytics.numpy.array([day//2, day-10**6, 0])
+        ends = journal_analytics.numpy.array([3*day + 2*10**6 + 5, day, day])
+        journal_analytics.add_day_pieces(column, starts, ends)
+        self.assertEqual([43200 + 1 + 86400, 86400, 86400, 2], column.tolist())
+
+    def test_overtime(self):
+        # only the second task went over, by the 10 minutes spent in the report
+        self.assertEqual((1, 600), journal_analytics.overtime([600, 600], [1200, 2400], [1800, 1800]))
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(AnalyticsController))
+unittest.TextTestRunner(verbosity=2).run(suite)
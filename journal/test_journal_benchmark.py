@@ -0,0 +1,52 @@
+#!/usr/bin/python
+
+import unittest
+import json
+import shutil
+import tempfile
+import datetime
+
+import journal
+import journal_benchmark
+import journal_storage
+
+class BenchmarkController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_history_is_deterministic(self):
+        end = datetime.date(2019, 3, 4)
+        tasks, actions = journal_benchmark.generate_history(years=0.5, num_tasks=50, seed=3, end=end)
+        same_tasks, same_actions = journal_benchmark.generate_history(years=0.5, num_tasks=50, seed=3, end=end)
+        self.assertEqual([(a.action, a.task_id, a.dt) for a in actions], [(a.action, a.task_id, a.dt) for a in same_actions])
+        self.assertEqual([(t.name, t.completed) for t in tasks], [(t.name, t.completed) for t in same_tasks])
+
+        self.assertEqual(50, len(tasks))
+        self.assertEqual(sorted(action.dt for action in actions), [action.dt for action in actions])
+        self.assertTrue(actions[-1].dt < datetime.datetime.combine(end, datetime.time(0)))
+        self.assertTrue(all(action.dt.weekday() < 5 for action in actions))
+        codes = set(action.action for action in actions)
+        for code in [journal.TASK_NEW, journal.TASK_SWITCH, journal.TASK_COMPLETED, journal.TASK_LUNCH, journal.TASK_MEETING, journal.TASK_PAUSE]:
+            self.assertTrue(code in codes)
+
+    def test_run_benchmarks(self):
+        tasks, actions = journal_benchmark.generate_history(years=0.1, num_tasks=20)
+        for storage in ['text', 'binary', 'sqlite']:
+            directory = tempfile.mkdtemp(dir=self.directory)
+            journal_benchmark.write_history(directory, tasks, actions, storage)
+            results = journal_benchmark.run_benchmarks(directory, storage, repeat=1)
+            self.assertEqual(sorted(name for name, function, answer in journal_benchmark.scenarios), sorted(results))
+            self.assertEqual(1, results['today_report']['repeat'])
+            json.dumps(results)
+            self.assertTrue(journal_benchmark.measure_memory(directory, storage)['journal_bytes'] > 0)
+
+            j = journal.Journal(journal_storage.open_storage(directory, storage))
+            self.assertEqual(len(actions) + 2 + 100, len(j.actions))
+            j.storage.close()
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(BenchmarkController))
+unittest.TextTestRunner(verbosity=2).run(suite)
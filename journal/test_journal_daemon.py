@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+import unittest
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+import journal
+import journal_client
+import journal_daemon
+import journal_storage
+
+class DaemonController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'journal.sock')
+        self.journal = journal.Journal(journal_storage.TextStorage(self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_command_for(self):
+        self.assertEqual(('sw3y', []), journal_daemon.command_for(self.journal, {'op': 'switch', 'action': 'w', 'task_id': 3, 'completed': True}))
+        self.assertEqual(('sk', ['n']), journal_daemon.command_for(self.journal, {'op': 'switch', 'action': 'k', 'uncomplete': False}))
+        self.assertEqual(('ps', ['Groceries', '20']), journal_daemon.command_for(self.journal, {'op': 'add_task', 'name': 'Groceries', 'minutes': 20, 'type': 'personal', 'switch': True}))
+        self.assertEqual(('r', ['7', 'c']), journal_daemon.command_for(self.journal, {'op': 'report', 'days': 7, 'kind': 'calendar'}))
+        self.assertEqual(('t', []), journal_daemon.command_for(self.journal, {'op': 'report'}))
+        self.assertRaises(ValueError, journal_daemon.command_for, self.journal, {'op': 'switch', 'action': 'q'})
+        self.assertRaises(ValueError, journal_daemon.command_for, self.journal, {'op': 'command', 'command': 'q'})
+        self.assertRaises(ValueError, journal_daemon.command_for, self.journal, {'op': 'fly'})
+
+    def test_num_questions(self):
+        self.assertEqual(0, journal_daemon.num_questions(self.journal, 'z', []))
+        self.assertEqual(1, journal_daemon.num_questions(self.journal, 'w', []))
+        self.assertEqual(1, journal_daemon.num_questions(self.journal, 'w', ['']))
+        self.assertEqual(2, journal_daemon.num_questions(self.journal, 'ws', ['Task', '10']))
+        self.assertEqual(2, journal_daemon.num_questions(self.journal, 's', ['w']))
+        self.assertEqual(1, journal_daemon.num_questions(self.journal, 'r', ['x']))
+        self.journal.add_task('Task', 10, journal.TASK_WORK_TYPE)
+        self.journal.add_action(journal.TASK_SWITCH, 0)
+        self.journal.cur_action, self.journal.cur_action_key = journal.TASK_SWITCH, 0
+        self.journal.set_task_completed(0, True)
+        # asked if the task is done, and if the completed task is to be reopened
+        self.assertEqual(1, journal_daemon.num_questions(self.journal, 'z', []))
+        self.assertEqual(0, journal_daemon.num_questions(self.journal, 'zn', []))
+        self.assertEqual(3, journal_daemon.num_questions(self.journal, 'ws', ['Task', '10']))
+        self.assertEqual(2, journal_daemon.num_questions(self.journal, 'sw0', ['n']))
+        self.assertEqual(1, journal_daemon.num_questions(self.journal, 'sw0', ['x']))
+        # the commands are run against a dry run, which changes nothing
+        generation = journal.Task.generation
+        num_actions = len(self.journal.actions)
+        self.assertEqual(3, journal_daemon.num_questions(self.journal, 'zy', []) + journal_daemon.num_questions(self.journal, 'ps', ['Task', '5', 'y']))
+        self.assertEqual(0, journal_daemon.num_questions(self.journal, 'xy', []))
+        self.assertEqual((generation, num_actions), (journal.Task.generation, len(self.journal.actions)))
+        self.assertEqual((1, 1), (len(self.journal.tasks), len(journal_storage.TextStorage(self.directory).read_tasks())))
+
+    def test_current_after_midnight(self):
+        class Today(datetime.date):
+            pass
+        day = datetime.date.today() - datetime.timedelta(days=3)
+        self.journal = journal.Journal(journal_storage.TextStorage(tempfile.mkdtemp(dir=self.directory)), start=False)
+        self.journal.add_task('Task', 10, journal.TASK_WORK_TYPE)
+        start = datetime.datetime.combine(day, datetime.time(22))
+        # an hour of work before midnight, one across and one after
+        for hours, action, task_id in [(0, journal.TASK_SWITCH, 0), (1, journal.TASK_PAUSE, -1),
+                                       (1.5, journal.TASK_SWITCH, 0), (3.5, journal.TASK_PAUSE, -1),
+                                       (4.5, journal.TASK_SWITCH, 0), (5.5, journal.TASK_PAUSE, -1)]:
+            self.journal.clock = start + datetime.timedelta(hours=hours)
+            self.journal.add_action(action, task_id)
+        self.journal.clock = None
+        self.journal.cur_action, self.journal.cur_action_key = journal.TASK_SWITCH, 0
+        saved_datetime = journal_daemon.datetime
+        journal_daemon.datetime = type('datetime', (), {'date': Today})
+        try:
+            # the daemon outlives the day it started on
+            Today.today = classmethod(lambda cls: day)
+            self.assertEqual(3*3600, journal_daemon.current_action(self.journal)['today'])
+            Today.today = classmethod(lambda cls: day + datetime.timedelta(days=1))
+            self.assertEqual(3600, journal_daemon.current_action(self.journal)['today'])
+        finally:
+            journal_daemon.datetime = saved_datetime
+
+    def test_handle(self):
+        response = journal_daemon.handle(self.journal, {'op': 'add_task', 'name': 'Write report', 'minutes': 30, 'switch': True})
+        self.assertTrue(response['ok'])
+        self.assertTrue('Added work task 0' in response['output'])
+        self.assertEqual((journal.TASK_SWITCH, 0), (self.journal.cur_action, self.journal.cur_action_key))
+
+        response = journal_daemon.handle(self.journal, {'op': 'current'})
+        self.assertEqual('SWITCH TASK', response['current']['action'])
+        self.assertEqual('w0.30 Write report', response['current']['task'])
+        self.assertTrue('Working on work task' in response['output'])
+
+        # the question is not answered, so the command does not run
+        num_actions = len(self.journal.actions)
+        reload = self.journal.reload
+        self.journal.reload = lambda: self.fail("the journal should not be read again")
+        for request in [{'op': 'switch', 'action': 'k'}, {'op': 'command', 'command': 'w', 'answers': ['Task']},
+                {'op': 'command', 'command': 'd', 'answers': ['5', '1', '-10']}, {'op': 'command', 'command': 's'}]:
+            response = journal_daemon.handle(self.journal, request)
+            self.assertFalse(response['ok'])
+            self.assertTrue('answers were given' in response['error'])
+        self.journal.reload = reload
+        self.assertEqual(num_actions, len(self.journal.actions))
+        self.assertEqual(journal.TASK_SWITCH, self.journal.cur_action)
+
+        # any other failure of a command is an error response
+        def fail():
+            raise IndexError("list index out of range")
+        self.journal.today_report = fail
+        response = journal_daemon.handle(self.journal, {'op': 'report'})
+        self.assertFalse(response['ok'])
+        self.assertEqual("IndexError: list index out of range", response['error'])
+        del self.journal.today_report
+
+        response = journal_daemon.handle(self.journal, {'op': 'switch', 'action': 'k', 'completed': True})
+        self.assertTrue(response['ok'])
+        self.assertTrue(self.journal.tasks[0].completed)
+        self.assertEqual(journal.TASK_WALK, self.journal.cur_action)
+        self.assertTrue(journal_daemon.handle(self.journal, {'op': 'report', 'days': 3})['ok'])
+        self.assertFalse(journal_daemon.handle(self.journal, ['current'])['ok'])
+
+    def test_concurrent_clients(self):
+        server = journal_daemon.JournalServer(self.journal, self.path)
+        self.journal.reload = lambda: self.fail("the journal should not be read again")
+
+        async def client(message):
+            reader, writer = await asyncio.open_unix_connection(self.path)
+            writer.write((json.dumps(message) + '\n').encode('utf-8'))
+            await writer.drain()
+            response = json.loads((await reader.readline()).decode('utf-8'))
+            writer.close()
+            return response
+
+        async def scenario():
+            running = asyncio.ensure_future(server.run())
+            while not os.path.exists(self.path):
+                await asyncio.sleep(0.01)
+            self.assertTrue(journal_daemon.is_running(self.path))
+            await client({'op': 'add_task', 'name': 'Write report', 'minutes': 30})
+            messages = [{'op': 'switch', 'action': 'w', 'task_id': 0, 'completed': False} if ix % 2 == 0 else {'op': 'current'} for ix in range(200)]
+            responses = await asyncio.gather(*[client(message) for message in messages])
+            loop = asyncio.get_running_loop()
+            bad = await loop.run_in_executor(None, journal_client.request, {'op': 'fly'}, self.path)
+            stopped = await client({'op': 'stop'})
+            await running
+            return responses, bad, stopped
+
+        responses, bad, stopped = asyncio.run(scenario())
+        self.assertTrue(all(response['ok'] for response in responses))
+        self.assertFalse(bad['ok'])
+        self.assertTrue(stopped['ok'])
+        self.assertEqual(203, server.num_requests)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual(100, len([action for action in self.journal.actions if action.action == journal.TASK_SWITCH]))
+
+        reopened = journal.Journal(journal_storage.TextStorage(self.directory), start=False)
+        self.assertEqual(len(self.journal.actions), len(reopened.actions))
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(DaemonController))
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+import journal
+import journal_stats
+import journal_storage
+
+class StatsController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record_and_dump(self):
+        stats = journal_stats.Stats()
+        stats.record('add_action', 0.5)
+        stats.record('add_action', 0.25)
+        with stats.timed('command s'):
+            pass
+        stats.read(10)
+        stats.written(20)
+        self.assertEqual([2, 0.75], stats.calls['add_action'])
+        self.assertEqual(1, stats.calls['command s'][0])
+        self.assertTrue(stats.report()[1].startswith('add_action'))
+
+        path = os.path.join(self.directory, 'stats.json')
+        stats.dump(path)
+        with open(path, 'r') as f:
+            dumped = json.load(f)
+        self.assertEqual({'calls': 2, 'seconds': 0.75}, dumped['calls']['add_action'])
+        self.assertEqual(10, dumped['bytes_read'])
+        self.assertEqual(20, dumped['bytes_written'])
+
+    def test_instrument_journal(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.append_action(journal.Action(journal.TASK_WALK))
+        size = os.path.getsize(storage.actions_path)
+
+        stats = journal_stats.Stats()
+        storage.stats = stats
+        j = journal.Journal(storage)
+        self.assertEqual(size, stats.bytes_read)
+        written = os.path.getsize(storage.actions_path) - size
+        self.assertEqual(written, stats.bytes_written)
+
+        stats.instrument(j)
+        run = stats.wrap_command(journal.dispatch)
+        run(j, 'zn')
+        j.count_time_in_action(journal.TASK_WALK, -1, None, None)
+        self.assertEqual(1, stats.calls['command z'][0])
+        self.assertEqual(1, stats.calls['add_action'][0])
+        self.assertEqual(1, stats.calls['count_time_in_action'][0])
+        self.assertEqual(1, stats.calls['total_time'][0])
+        self.assertEqual(os.path.getsize(storage.actions_path) - size, stats.bytes_written)
+
+    def test_binary_bytes(self):
+        storage = journal_storage.BinaryStorage(self.directory)
+        stats = journal_stats.Stats()
+        storage.stats = stats
+        for ix in range(3):
+            storage.append_action(journal.Action(journal.TASK_WALK))
+        list(storage.read_actions())
+        storage.action_at(1)
+        self.assertEqual(3*storage.record.size, stats.bytes_written)
+        self.assertEqual(4*storage.record.size, stats.bytes_read)
+        storage.close()
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(StatsController))
+unittest.TextTestRunner(verbosity=2).run(suite)
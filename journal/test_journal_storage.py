@@ -0,0 +1,392 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import shutil
+import tempfile
+import datetime
+import sqlite3
+
+import journal
+import journal_stats
+import journal_storage
+
+class StorageController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_micros_round_trip(self):
+        dt = datetime.datetime(2019, 3, 4, 5, 6, 7, 890)
+        self.assertEqual(dt, journal_storage.from_micros(journal_storage.to_micros(dt)))
+        self.assertTrue(journal_storage.to_micros(dt) < journal_storage.to_micros(dt + datetime.timedelta(microseconds=1)))
+
+    def test_text_update_records(self):
+        storage = journal_storage.TextStorage(self.directory)
+        task = journal.Task(name='test_task', time=10)
+        storage.append_task(0, task)
+        task.completed = True
+        storage.update_task(0, task)
+        self.assertEqual([['test_task', 10, journal.TASK_WORK_TYPE, True]], storage.read_tasks())
+
+    def test_text_actions_round_trip(self):
+        storage = journal_storage.TextStorage(self.directory)
+        dt = datetime.datetime(2019, 3, 4, 5, 6, 7, 890)
+        storage.append_action(journal.Action(journal.TASK_SWITCH, 3, dt))
+        self.assertEqual([(journal.TASK_SWITCH, 3, dt)], list(storage.read_actions()))
+
+    def test_text_transaction(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.append_action(journal.Action(journal.TASK_SWITCH, 0))
+        size = os.path.getsize(storage.actions_path)
+        with storage.transaction():
+            storage.append_action(journal.Action(journal.TASK_WALK))
+            self.assertEqual(size, os.path.getsize(storage.actions_path))
+        self.assertEqual(2, len(list(storage.read_actions())))
+
+        try:
+            with storage.transaction():
+                storage.append_action(journal.Action(journal.TASK_LUNCH))
+                # reading writes the held records, failing cuts them off again
+                self.assertEqual(3, len(list(storage.read_actions())))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual([journal.TASK_SWITCH, journal.TASK_WALK], [action for action, task_id, dt in storage.read_actions()])
+
+    def test_text_corrections(self):
+        storage = journal_storage.TextStorage(self.directory)
+        start = datetime.datetime(2019, 3, 4, 5)
+        for ix in range(5):
+            storage.append_action(journal.Action(ix, -1, start + datetime.timedelta(minutes=ix)))
+        size = os.path.getsize(storage.actions_path)
+        storage.move_action(0, 3, start + datetime.timedelta(minutes=3, seconds=30))
+        storage.pop_action()
+        self.assertEqual([1, 2, 3, 0], [action for action, task_id, dt in storage.read_actions()])
+        self.assertEqual(start + datetime.timedelta(minutes=3, seconds=30), storage.read_actions()[3][2])
+        self.assertRaises(journal_storage.JournalChanged, storage.read_actions, size)
+
+    def test_parse_dt(self):
+        for dt in [datetime.datetime(2019, 3, 4, 5, 6, 7, 890), datetime.datetime(2019, 3, 4, 5, 6, 7)]:
+            self.assertEqual(dt, journal_storage.parse_dt(str(dt)))
+            self.assertEqual(dt, journal_storage.parse_dt_fields(str(dt)))
+        for text in ['2019-03-04', '2019-03-04 05:06:07.89x', '2019-03-04 05:06:07+01:00']:
+            self.assertRaises(ValueError, journal_storage.parse_dt, text)
+            self.assertRaises(ValueError, journal_storage.parse_dt_fields, text)
+
+    def test_text_read_errors(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.create_files()
+        with open(storage.actions_path, 'w') as f:
+            f.write("1,0,2019-03-04 05:06:07\n2,0\n\n3,0,yesterday\nM,0\n4,0,2019-03-04 05:07:00.000001\n")
+        actions = storage.read_actions()
+        self.assertEqual([1, 4], [action for action, task_id, dt in actions])
+        self.assertEqual(datetime.datetime(2019, 3, 4, 5, 6, 7), actions[0][2])
+        errors = storage.read_errors()
+        self.assertEqual(3, len(errors))
+        self.assertTrue(errors[0].startswith("{0} line 2: expected 3 fields".format(storage.actions_path)))
+        self.assertEqual([2, 4, 5], [int(error.split(' line ')[1].split(':')[0]) for error in errors])
+        self.assertEqual([], storage.read_errors())
+
+        # lines numbered in the whole file when reading from an offset
+        size = os.path.getsize(storage.actions_path)
+        with open(storage.actions_path, 'a') as f:
+            f.write("5,0,2019-03-04 05:08:00.000000,x\n")
+        storage.read_actions(size)
+        self.assertEqual(["{0} line 7: expected 3 fields, found 4".format(storage.actions_path)], storage.read_errors())
+
+    def test_text_parse_processes(self):
+        storage = journal_storage.TextStorage(self.directory)
+        start = datetime.datetime(2019, 3, 4, 5)
+        for ix in range(50):
+            storage.append_action(journal.Action(ix % 5, ix, start + datetime.timedelta(minutes=ix)))
+        storage.move_action(0, 20, start + datetime.timedelta(minutes=20, seconds=30))
+        storage.pop_action()
+        expected = storage.read_actions()
+        storage.chunk_size = 100
+        self.assertEqual(expected, storage.read_actions())
+        storage.parse_processes = 2
+        storage.parallel_bytes = 0
+        self.assertEqual(expected, storage.read_actions())
+        self.assertEqual(49, len(expected))
+
+    def test_background_writer(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.start_writer()
+        for ix in range(50):
+            with storage.transaction():
+                storage.append_action(journal.Action(journal.TASK_WALK))
+        try:
+            with storage.transaction():
+                storage.append_action(journal.Action(journal.TASK_LUNCH))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual([journal.TASK_WALK]*50, [action for action, task_id, dt in storage.read_actions()])
+        storage.append_action(journal.Action(journal.TASK_PAUSE))
+        storage.close()
+        self.assertEqual(None, storage.writer)
+        self.assertEqual(51, len(list(journal_storage.TextStorage(self.directory).read_actions())))
+
+    def test_background_writer_errors(self):
+        writer = journal_storage.BackgroundWriter()
+        writer.put(os.path.join(self.directory, 'missing', 'journal_actions.txt'), 'record\n')
+        writer.put(os.path.join(self.directory, 'journal_actions.txt'), 'record\n')
+        writer.wait()
+        self.assertEqual(1, len(writer.take_errors()))
+        self.assertEqual([], writer.take_errors())
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
+        with open(os.path.join(self.directory, 'journal_actions.txt'), 'r') as f:
+            self.assertEqual('record\n', f.read())
+
+    def test_text_snapshot(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.append_task(0, journal.Task(name='test_task', time=10))
+        storage.append_action(journal.Action(journal.TASK_SWITCH, 0))
+        storage.write_snapshot({'count': 1})
+        snapshot = storage.read_snapshot()
+        self.assertEqual(1, snapshot['count'])
+        self.assertEqual(os.path.getsize(storage.actions_path), snapshot['actions_offset'])
+
+        # appending keeps the snapshot valid
+        storage.append_action(journal.Action(journal.TASK_WALK))
+        self.assertEqual(snapshot, storage.read_snapshot())
+        self.assertEqual([journal.TASK_WALK], [action for action, task_id, dt in storage.read_actions(snapshot['actions_offset'])])
+
+        # changing what it covers does not
+        with open(storage.actions_path, 'r+') as f:
+            f.write(str(journal.TASK_LUNCH))
+        self.assertEqual(None, storage.read_snapshot())
+
+    def test_text_snapshot_checksum(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.create_files()
+        storage.write_snapshot({'count': 0})
+        with open(storage.snapshot_path, 'r') as f:
+            content = f.read()
+        with open(storage.snapshot_path, 'w') as f:
+            f.write(content.replace('"count": 0', '"count": 5'))
+        self.assertEqual(None, storage.read_snapshot())
+        with open(storage.snapshot_path, 'w') as f:
+            f.write(content[:-10])
+        self.assertEqual(None, storage.read_snapshot())
+
+    def test_text_segments(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.create_files()
+        self.assertEqual([], storage.read_segment_summaries())
+        dt = datetime.datetime(2019, 2, 4, 5, 6, 7, 890)
+        for name in ['2019-02', '2019-01']:
+            storage.write_segment(name, [journal.Action(journal.TASK_SWITCH, 3, dt)], {'name': name, 'count': 1})
+        self.assertEqual(['2019-01', '2019-02'], [summary['name'] for summary in storage.read_segment_summaries()])
+        self.assertEqual([(journal.TASK_SWITCH, 3, journal_storage.to_micros(dt))], storage.read_segment('2019-02'))
+
+        # unreadable lines of a plain segment are reported like the log's
+        actions_path = storage.segment_paths('2019-02')[0]
+        with open(actions_path, 'a') as f:
+            f.write("3,0\n")
+        self.assertEqual(1, len(storage.read_segment('2019-02')))
+        self.assertEqual(["{0} line 2: expected 3 fields, found 2".format(actions_path)], storage.read_errors())
+
+        # a segment is only there once its summary is
+        os.remove(storage.segment_paths('2019-02')[1])
+        self.assertEqual(['2019-01'], [summary['name'] for summary in storage.read_segment_summaries()])
+        storage.clear()
+        self.assertEqual([], storage.read_segment_summaries())
+
+    def test_segment_file(self):
+        path = os.path.join(self.directory, 'segment.seg')
+        start = journal_storage.to_micros(datetime.datetime(2019, 3, 4, 5))
+        records = [(ix % 8, ix % 5 - 1, start + ix*ix*1000003) for ix in range(1000)]
+        methods = ['zlib', 'lzma'] if journal_storage.lzma is not None else ['zlib']
+        for method in methods:
+            journal_storage.SegmentFile.write(path, records, {'name': '2019-03'}, method, block_size=64)
+            segment = journal_storage.SegmentFile(path)
+            self.assertEqual((method, 1000, 16), (segment.method, segment.count, len(segment.blocks)))
+            self.assertEqual({'name': '2019-03'}, segment.summary())
+            self.assertEqual(records, segment.records())
+            self.assertEqual(records[100:130], segment.records(100, 130))
+
+        # a few records only decompress the block they are in
+        stats = journal_stats.Stats()
+        segment = journal_storage.SegmentFile(path, stats)
+        stats.bytes_read = 0
+        segment.records(130, 135)
+        self.assertEqual(segment.blocks[2][1], stats.bytes_read)
+
+    def test_compress_segments(self):
+        storage = journal_storage.TextStorage(self.directory)
+        storage.create_files()
+        dt = datetime.datetime(2019, 1, 4, 5, 6, 7, 890)
+        names = ['2019-01', '2019-02', '2019-03']
+        for name in names:
+            storage.write_segment(name, [journal.Action(journal.TASK_SWITCH, 3, dt), journal.Action(journal.TASK_WALK, -1, dt)], {'name': name, 'count': 2})
+        storage.compress_segments()
+        self.assertEqual([[False, False, True], [True, True, False], [True, True, False]],
+            [[os.path.exists(path) for path in storage.segment_paths(name)] for name in names])
+        self.assertEqual(names, [summary['name'] for summary in storage.read_segment_summaries()])
+        self.assertEqual(storage.read_segment('2019-02'), storage.read_segment('2019-01'))
+        self.assertEqual([(journal.TASK_WALK, -1, journal_storage.to_micros(dt))], storage.read_segment('2019-01', 1))
+        storage.clear()
+        self.assertEqual([], os.listdir(storage.segments_path))
+
+    def test_sqlite_round_trip(self):
+        path = os.path.join(self.directory, 'journal.db')
+        storage = journal_storage.SqliteStorage(path)
+        task = journal.Task(name='comma, in name', time=10, task_type=journal.TASK_PERS_TYPE)
+        storage.append_task(0, task)
+        task.completed = True
+        storage.update_task(0, task)
+        dt = datetime.datetime(2019, 3, 4, 5, 6, 7, 890)
+        storage.append_action(journal.Action(journal.TASK_SWITCH, 0, dt))
+        storage.close()
+
+        storage = journal_storage.SqliteStorage(path)
+        self.assertEqual([['comma, in name', 10, journal.TASK_PERS_TYPE, True]], storage.read_tasks())
+        self.assertEqual([(journal.TASK_SWITCH, 0, dt)], list(storage.read_actions()))
+        self.assertEqual(1, storage.count)
+        self.assertEqual('wal', storage.conn.execute('PRAGMA journal_mode').fetchone()[0])
+        indexes = [row[1] for row in storage.conn.execute("PRAGMA index_list('actions')")]
+        self.assertTrue('actions_dt' in indexes)
+        self.assertTrue('actions_task_dt' in indexes)
+
+    def test_sqlite_follow_reads_changed_tasks(self):
+        path = os.path.join(self.directory, 'journal.db')
+        first = journal_storage.SqliteStorage(path)
+        second = journal_storage.SqliteStorage(path)
+        for task_id in range(3):
+            first.append_task(task_id, journal.Task(name='task{0}'.format(task_id), time=10))
+        tasks = second.read_tasks()
+        self.assertEqual(None, second.follow(tasks))
+        task = journal.Task(name='task1', time=10)
+        task.completed = True
+        first.update_task(1, task)
+        first.append_task(3, journal.Task(name='task3', time=20))
+        # only the changed and the new task are read, the others are left as they are
+        tasks[0][0] = 'renamed here'
+        self.assertEqual([], second.follow(tasks))
+        self.assertEqual(['renamed here', 'task1', 'task2', 'task3'], [name for name, time, task_type, completed in tasks])
+        self.assertTrue(tasks[1][3])
+        self.assertEqual(None, second.follow(tasks))
+        first.close()
+        second.close()
+
+    def test_sqlite_upgrade_schema(self):
+        path = os.path.join(self.directory, 'journal.db')
+        conn = sqlite3.connect(path)
+        conn.execute('CREATE TABLE tasks (id INTEGER PRIMARY KEY, name TEXT NOT NULL, time INTEGER NOT NULL, task_type INTEGER NOT NULL, completed INTEGER NOT NULL)')
+        conn.execute("INSERT INTO tasks VALUES (0, 'old_task', 10, 0, 0)")
+        conn.commit()
+        conn.close()
+        storage = journal_storage.SqliteStorage(path)
+        self.assertEqual([['old_task', 10, 0, False]], storage.read_tasks())
+        storage.append_task(1, journal.Task(name='new_task', time=10))
+        self.assertEqual(2, len(storage.read_tasks()))
+        storage.close()
+
+    def test_sqlite_read_only(self):
+        path = os.path.join(self.directory, 'journal.db')
+        self.assertRaises(ValueError, journal_storage.SqliteStorage, path, True)
+        self.assertFalse(os.path.exists(path))
+        storage = journal_storage.SqliteStorage(path)
+        storage.append_task(0, journal.Task(name='test_task', time=10))
+        storage.append_action(journal.Action(journal.TASK_SWITCH, 0))
+        storage.close()
+        read_only = journal_storage.SqliteStorage(path, read_only=True)
+        self.assertEqual(1, read_only.count)
+        self.assertEqual(['test_task'], [name for name, time, task_type, completed in read_only.read_tasks()])
+        self.assertRaises(sqlite3.OperationalError, read_only.append_action, journal.Action(journal.TASK_WALK))
+        read_only.close()
+
+    def test_sqlite_transaction_rollback(self):
+        storage = journal_storage.SqliteStorage(os.path.join(self.directory, 'journal.db'))
+        try:
+            with storage.transaction():
+                storage.append_action(journal.Action(journal.TASK_WALK))
+                with storage.transaction():
+                    storage.append_action(journal.Action(journal.TASK_WALK))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(0, storage.count)
+        self.assertEqual([], list(storage.read_actions()))
+
+    def test_sqlite_move_action(self):
+        storage = journal_storage.SqliteStorage(os.path.join(self.directory, 'journal.db'))
+        start = datetime.datetime(2019, 3, 4, 5)
+        for ix in range(5):
+            storage.append_action(journal.Action(ix, -1, start + datetime.timedelta(minutes=ix)))
+        storage.move_action(4, 1, start + datetime.timedelta(seconds=30))
+        self.assertEqual([0, 4, 1, 2, 3], [action for action, task_id, dt in storage.read_actions()])
+        storage.move_action(1, 4, start + datetime.timedelta(minutes=10))
+        self.assertEqual([0, 1, 2, 3, 4], [action for action, task_id, dt in storage.read_actions()])
+
+    def test_binary_round_trip(self):
+        storage = journal_storage.BinaryStorage(self.directory)
+        start = datetime.datetime(2019, 3, 4, 5, 6, 7, 890)
+        for ix in range(5):
+            storage.append_action(journal.Action(ix, ix-1, start + datetime.timedelta(minutes=ix)))
+        self.assertEqual(5*storage.record.size, os.path.getsize(storage.actions_path))
+        self.assertEqual((3, 2, start + datetime.timedelta(minutes=3)), storage.action_at(3))
+        storage.pop_action()
+        storage.close()
+
+        storage = journal_storage.BinaryStorage(self.directory)
+        self.assertEqual(4, storage.count)
+        self.assertEqual([(ix, ix-1, start + datetime.timedelta(minutes=ix)) for ix in range(4)], list(storage.read_actions()))
+        self.assertEqual([(2, 1, start + datetime.timedelta(minutes=2), None)], storage.actions_between(2, 3))
+        storage.close()
+
+    def test_binary_no_background_writer(self):
+        storage = journal_storage.BinaryStorage(self.directory)
+        self.assertRaises(ValueError, storage.start_writer)
+        self.assertEqual(None, storage.writer)
+        storage.close()
+
+    def test_binary_move_action(self):
+        storage = journal_storage.BinaryStorage(self.directory)
+        start = datetime.datetime(2019, 3, 4, 5)
+        for ix in range(5):
+            storage.append_action(journal.Action(ix, -1, start + datetime.timedelta(minutes=ix)))
+        storage.move_action(0, 3, start + datetime.timedelta(minutes=3, seconds=30))
+        self.assertEqual([1, 2, 3, 0, 4], [action for action, task_id, dt in storage.read_actions()])
+        storage.close()
+
+    def test_text_follow(self):
+        storage = journal_storage.TextStorage(self.directory)
+        other = journal_storage.TextStorage(self.directory)
+        tasks = storage.read_tasks()
+        list(storage.read_actions())
+        self.assertEqual(None, storage.follow(tasks))
+        dt = datetime.datetime(2019, 3, 4, 5, 6, 7, 890)
+        other.read_tasks()
+        other.append_task(0, journal.Task(name='test_task', time=10))
+        other.append_action(journal.Action(journal.TASK_SWITCH, 0, dt))
+        self.assertEqual([(journal.TASK_SWITCH, 0, dt)], storage.follow(tasks))
+        self.assertEqual([['test_task', 10, journal.TASK_WORK_TYPE, False]], tasks)
+        self.assertEqual(None, storage.follow(tasks))
+
+        other.rewrite([journal.Task(name='test_task', time=10)], [])
+        self.assertRaises(journal_storage.JournalChanged, storage.follow, tasks)
+        self.assertRaises(journal_storage.JournalChanged, storage.append_action, journal.Action(journal.TASK_WALK))
+
+    def test_binary_follow(self):
+        storage = journal_storage.BinaryStorage(self.directory)
+        other = journal_storage.BinaryStorage(self.directory)
+        tasks = storage.read_tasks()
+        dt = datetime.datetime(2019, 3, 4, 5, 6, 7, 890)
+        other.append_action(journal.Action(journal.TASK_WALK, -1, dt))
+        self.assertRaises(journal_storage.JournalChanged, storage.append_action, journal.Action(journal.TASK_LUNCH))
+        self.assertEqual([(journal.TASK_WALK, -1, dt)], storage.follow(tasks))
+        self.assertEqual(1, storage.count)
+        storage.append_action(journal.Action(journal.TASK_LUNCH))
+        self.assertEqual(1, len(other.follow_actions()))
+        storage.close()
+        other.close()
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(StorageController))
+unittest.TextTestRunner(verbosity=2).run(suite)
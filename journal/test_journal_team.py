@@ -0,0 +1,82 @@
+#!/usr/bin/python
+
+import unittest
+import os
+import shutil
+import tempfile
+import datetime
+
+import journal
+import journal_storage
+import journal_team
+
+class TeamController(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.day = datetime.date(2019, 3, 4)
+        start = datetime.datetime.combine(self.day, datetime.time(9))
+        self.directories = []
+        for person, minutes in [('alice', 30), ('bob', 90)]:
+            directory = os.path.join(self.directory, person)
+            os.mkdir(directory)
+            tasks = [journal.Task('Write report', 60)]
+            actions = [journal.Action(journal.TASK_NEW, 0, start),
+                journal.Action(journal.TASK_SWITCH, 0, start),
+                journal.Action(journal.TASK_WALK, -1, start + datetime.timedelta(minutes=minutes)),
+                journal.Action(journal.TASK_SWITCH, 0, start + datetime.timedelta(days=1)),
+                journal.Action(journal.TASK_PAUSE, -1, start + datetime.timedelta(days=1, minutes=minutes))]
+            journal_storage.TextStorage(directory).rewrite(tasks, actions)
+            self.directories.append(directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_merge_days(self):
+        first = [(1, [1, 0]), (3, [2, 2])]
+        second = [(2, [5, 5]), (3, [1, 1])]
+        self.assertEqual([(1, [1, 0]), (2, [5, 5]), (3, [3, 3])], list(journal_team.merge_days(first, second)))
+        self.assertEqual(first, list(journal_team.merge_days(first, [])))
+
+    def test_task_report(self):
+        people = []
+        team = journal_team.aggregate(self.directories, self.day, 1, processes=2, on_person=people.append)
+        # the people come in as they are read
+        people.sort(key=lambda person: person.name)
+        self.assertEqual(['alice', 'bob'], [person.name for person in people])
+        self.assertEqual({'w0.60 Write report': 1800}, people[0].data.task_times)
+        self.assertEqual({'alice: w0.60 Write report': 1800, 'bob: w0.60 Write report': 5400}, team.data.task_times)
+        self.assertEqual(7200, team.data.category_time(journal.TASK_SWITCH))
+        self.assertEqual(datetime.datetime(2019, 3, 4, 9), team.data.first_action)
+        self.assertEqual((1, 5400), (team.data.num_overtime, team.data.overtime))
+
+    def test_calendar(self):
+        first_day = self.day - datetime.timedelta(days=1)
+        team = journal_team.aggregate(self.directories, first_day, 4, calendar=True, processes=2)
+        self.assertEqual([self.day, self.day + datetime.timedelta(days=1)], [day for day, row in team.days])
+        matrices = [journal.Journal(journal_storage.TextStorage(directory), start=False).day_matrix(first_day, 4) for directory in self.directories]
+        self.assertEqual([[a + b for a, b in zip(*rows)] for rows in zip(*matrices)][1:3], [row for day, row in team.days])
+        self.assertEqual(7200, team.days[0][1][0])
+        matrix = journal_team.calendar_matrix(team.days, first_day, 4)
+        self.assertEqual([0]*5, matrix[0])
+        self.assertEqual(team.days[0][1], matrix[1])
+
+    def test_missing_directory(self):
+        self.assertRaises(ValueError, journal_team.aggregate, self.directories + [os.path.join(self.directory, 'carol')], self.day, 1, processes=2)
+
+    def test_nothing_written(self):
+        def files():
+            return [sorted((name, os.stat(os.path.join(directory, name)).st_mtime, os.path.getsize(os.path.join(directory, name)))
+                for name in os.listdir(directory)) for directory in self.directories]
+        before = files()
+        journal_team.aggregate(self.directories, self.day, 1, processes=2)
+        journal_team.aggregate(self.directories, self.day, 1, calendar=True, processes=2)
+        self.assertEqual(before, files())
+        # an empty directory holds no journal, and is not given one
+        empty = os.path.join(self.directory, 'carol')
+        os.mkdir(empty)
+        self.assertRaises(ValueError, journal_team.aggregate, [empty], self.day, 1, processes=2)
+        self.assertEqual([], os.listdir(empty))
+
+suite = unittest.TestSuite()
+suite.addTest(unittest.makeSuite(TeamController))
+unittest.TextTestRunner(verbosity=2).run(suite)